@@ -0,0 +1,53 @@
+import sys
+
+import pytest
+from pytest_redis import factories
+
+from benchmarks.utils import BenchmarkResults, ZeroDelaySensor
+
+
+if sys.platform == 'darwin':  # local testing on mac
+    redis_my_proc = factories.redis_proc(executable='/usr/local/bin/redis-server', port=None, datadir='/tmp/pytest')
+    fake_redis_db = factories.redisdb('redis_my_proc')
+else:  # Redis is already running on port 6379
+    fake_redis_db = factories.redisdb('redis_nooproc')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--benchmark-output', default='benchmark-results.json', help='file the JSON results are written to')
+    group.addoption('--benchmark-duration', type=float, default=2.0, help='seconds each polling benchmark runs for')
+    group.addoption(
+        '--sensor-counts', default='10,100,1000', help='comma separated numbers of synthetic sensors, between 10 and 10000'
+        )
+    group.addoption('--history-sizes', default='1000,10000,100000', help='comma separated numbers of stored measurements')
+
+
+def _counts(value):
+    return [int(count) for count in value.split(',') if count]
+
+
+def pytest_generate_tests(metafunc):
+    if 'sensor_count' in metafunc.fixturenames:
+        metafunc.parametrize('sensor_count', _counts(metafunc.config.getoption('--sensor-counts')))
+    if 'history_size' in metafunc.fixturenames:
+        metafunc.parametrize('history_size', _counts(metafunc.config.getoption('--history-sizes')))
+
+
+@pytest.fixture(scope='session')
+def benchmark_results(request):
+    results = BenchmarkResults()
+    yield results
+    results.write(request.config.getoption('--benchmark-output'))
+
+
+@pytest.fixture
+def benchmark_duration(request):
+    return request.config.getoption('--benchmark-duration')
+
+
+@pytest.fixture
+def zero_delay_sensors():
+    def create(count, polling_interval=0.1):
+        return [ZeroDelaySensor('sensor_{}'.format(i), polling_interval) for i in range(count)]
+    yield create
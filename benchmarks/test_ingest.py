@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from monitor.controller import Controller
+from monitor.measurements import Measurement
+from monitor.repository import RedisRepository, RedisSensorIdDictionary, sensor_key
+from monitor.serializers import BinarySerializer, JSONSerializer
+
+POLLING_INTERVAL = 0.05
+START = 1_600_000_000.0
+
+
+def stored_count(redis_client, sensor_ids):
+    pipe = redis_client.pipeline()
+    for sensor_id in sensor_ids:
+        pipe.zcard(sensor_key(sensor_id))
+    return sum(pipe.execute())
+
+
+def test_ingest_throughput(sensor_count, zero_delay_sensors, benchmark_duration, benchmark_results, fake_redis_db):
+    sensors = zero_delay_sensors(sensor_count, POLLING_INTERVAL)
+    controller = Controller(RedisRepository(fake_redis_db), batch_size=1000, max_workers=8)
+    for sensor in sensors:
+        controller.add_sensor(sensor)
+
+    start = time.perf_counter()
+    controller.start_polling()
+    time.sleep(benchmark_duration)
+    controller.stop_polling()
+    elapsed = time.perf_counter() - start
+
+    stored = stored_count(fake_redis_db, [sensor.sensor_id for sensor in sensors])
+    polled = sum(len(sensor.polled_at) for sensor in sensors)
+    benchmark_results.record(
+        'ingest_throughput',
+        {'sensors': sensor_count, 'polling_interval': POLLING_INTERVAL, 'duration': benchmark_duration},
+        measurements_per_second=stored / elapsed,
+        offered_per_second=sensor_count / POLLING_INTERVAL,
+        stored=stored,
+        polled=polled,
+        )
+    assert stored == polled
+
+
+@pytest.mark.parametrize('serializer', ['json', 'binary'])
+@pytest.mark.parametrize('batch_size', [1, 100, 1000])
+def test_add_measurements_throughput(batch_size, serializer, benchmark_results, fake_redis_db):
+    if serializer == 'json':
+        repo = RedisRepository(fake_redis_db, serializer=JSONSerializer())
+    else:
+        repo = RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db)))
+    total = 10000 if batch_size > 1 else 2000
+    measurements = [Measurement('sensor_{}'.format(i % 10), START + i, float(i)) for i in range(total)]
+
+    start = time.perf_counter()
+    for offset in range(0, total, batch_size):
+        repo.add_measurements(measurements[offset:offset + batch_size])
+    elapsed = time.perf_counter() - start
+
+    benchmark_results.record(
+        'add_measurements_throughput',
+        {'batch_size': batch_size, 'serializer': serializer, 'measurements': total},
+        measurements_per_second=total / elapsed,
+        )
+    assert stored_count(fake_redis_db, ['sensor_{}'.format(i) for i in range(10)]) == total
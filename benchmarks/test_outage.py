@@ -0,0 +1,106 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+from redis import Redis
+
+from monitor.controller import Controller
+from monitor.repository import MEASUREMENTS_KEY, RedisRepository, sensor_key
+
+POLLING_INTERVAL = 0.1
+SENSORS = 100
+
+
+class RedisServer:
+    '''
+    A redis-server process that can be killed and restarted on the same port with the same append-only file.
+    '''
+    def __init__(self, executable, directory):
+        self.executable = executable
+        self.directory = directory
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.executable, '--port', str(self.port), '--bind', '127.0.0.1', '--dir', str(self.directory), '--save', '',
+             '--appendonly', 'yes', '--appendfsync', 'always'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+        client = self.client()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                client.ping()
+                return
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def client(self):
+        return Redis(host='127.0.0.1', port=self.port, socket_timeout=1.0, socket_connect_timeout=1.0)
+
+
+@pytest.fixture
+def redis_server(tmp_path):
+    executable = shutil.which('redis-server') or '/usr/local/bin/redis-server'
+    if not os.path.exists(executable):
+        pytest.skip('redis-server not found')
+    server = RedisServer(executable, tmp_path)
+    server.start()
+    yield server
+    server.kill()
+
+
+def test_ingest_through_outage(redis_server, zero_delay_sensors, benchmark_duration, benchmark_results, tmp_path):
+    '''
+    Polls sensors while redis is killed for the middle third of the run, then measures how long the spool takes to
+    replay and checks every measurement taken reached redis exactly once.
+    '''
+    controller = Controller(
+        RedisRepository(redis_server.client()), batch_size=100, max_workers=8, spool_path=tmp_path / 'spool'
+        )
+    sensors = zero_delay_sensors(SENSORS, POLLING_INTERVAL)
+    controller.add_sensors(sensors)
+
+    controller.start_polling()
+    time.sleep(benchmark_duration / 3)
+    redis_server.kill()
+    time.sleep(benchmark_duration / 3)
+    redis_server.start()
+    restarted = time.monotonic()
+    while controller._spool.spooling and time.monotonic() - restarted < benchmark_duration / 3:
+        time.sleep(0.01)
+    caught_up = time.monotonic()
+    time.sleep(max(0.0, benchmark_duration / 3 - (caught_up - restarted)))
+    controller.stop_polling()
+    stopped = time.monotonic()
+    controller._spool.replay()
+    replayed = time.monotonic()
+
+    client = redis_server.client()
+    taken = sum(len(sensor.polled_at) for sensor in sensors)
+    stored = client.llen(MEASUREMENTS_KEY)
+    spooled = controller.metrics.get('monitor_measurements_spooled_total').collect()[0].value
+    benchmark_results.record(
+        'ingest_through_outage',
+        {'sensors': SENSORS, 'polling_interval': POLLING_INTERVAL, 'duration': benchmark_duration},
+        taken=taken,
+        stored=stored,
+        spooled=spooled,
+        throughput_per_second=taken / benchmark_duration,
+        catch_up_seconds=caught_up - restarted,
+        final_replay_seconds=replayed - stopped,
+        )
+    assert stored == taken
+    assert sum(client.zcard(sensor_key(sensor.sensor_id)) for sensor in sensors) == taken
@@ -0,0 +1,35 @@
+import pytest
+
+from benchmarks.utils import summarize, timed
+from monitor.sensors import DS18B20Sensor
+
+GOOD_MEASUREMENT = b'''bd 00 4b 46 ff ff ff ff ff ff : crc=ff YES
+bd 00 4b 46 ff ff ff ff ff ff t=27772
+'''
+REPEAT = 10000
+
+
+@pytest.fixture
+def device_file(tmp_path):
+    path = tmp_path / 'w1_slave'
+    path.write_bytes(GOOD_MEASUREMENT)
+    yield path
+
+
+@pytest.mark.parametrize('keep_open', [False, True])
+def test_ds18b20_get_measurement_cost(keep_open, device_file, benchmark_results):
+    sensor = DS18B20Sensor('sensor_id', device_file, keep_open=keep_open)
+    try:
+        durations = timed(sensor.get_measurement, REPEAT)
+    finally:
+        sensor.close()
+    benchmark_results.record(
+        'ds18b20_get_measurement', {'keep_open': keep_open, 'repeat': REPEAT}, seconds=summarize(durations)
+        )
+    assert sensor.get_measurement().value == 27.8
+
+
+def test_ds18b20_parse_cost(device_file, benchmark_results):
+    sensor = DS18B20Sensor('sensor_id', device_file)
+    durations = timed(lambda: sensor._parse(GOOD_MEASUREMENT, len(GOOD_MEASUREMENT)), REPEAT)
+    benchmark_results.record('ds18b20_parse', {'repeat': REPEAT}, seconds=summarize(durations))
@@ -0,0 +1,68 @@
+import math
+import time
+
+import pytest
+
+from benchmarks.utils import summarize
+from monitor.controller import Controller
+from monitor.repository import AbstractRepository
+
+POLLING_INTERVAL = 0.1
+
+
+class NullRepository(AbstractRepository):
+    '''
+    Repository that only counts measurements, so the benchmark measures scheduling alone.
+    '''
+    def __init__(self):
+        self.count = 0
+
+    def add_measurement(self, measurement):
+        self.count += 1
+
+    def add_measurements(self, measurements):
+        self.count += len(list(measurements))
+
+
+def jitter(polled_at, interval):
+    '''
+    Returns how far every poll after the first was from the grid started by the first poll, in seconds.
+    '''
+    first = polled_at[0]
+    result = []
+    for polled in polled_at[1:]:
+        elapsed = polled - first
+        result.append(abs(elapsed - round(elapsed / interval) * interval))
+    return result
+
+
+@pytest.mark.parametrize('mode', ['threads', 'scheduler'])
+def test_polling_jitter(mode, sensor_count, zero_delay_sensors, benchmark_duration, benchmark_results):
+    if mode == 'threads' and sensor_count > 1000:
+        pytest.skip('one thread per sensor does not scale to this many sensors')
+    sensors = zero_delay_sensors(sensor_count, POLLING_INTERVAL)
+    repo = NullRepository()
+    controller = Controller(repo, batch_size=1000, max_workers=None if mode == 'threads' else 8)
+    for sensor in sensors:
+        controller.add_sensor(sensor)
+
+    started = time.monotonic()
+    controller.start_polling()
+    time.sleep(benchmark_duration)
+    controller.stop_polling()
+
+    deviations = []
+    for sensor in sensors:
+        if sensor.polled_at:
+            deviations.extend(jitter(sensor.polled_at, POLLING_INTERVAL))
+    first_poll = [sensor.polled_at[0] - started for sensor in sensors if sensor.polled_at]
+    expected = sensor_count * (math.floor(benchmark_duration / POLLING_INTERVAL) + 1)  # the first poll is immediate
+    benchmark_results.record(
+        'polling_jitter',
+        {'mode': mode, 'sensors': sensor_count, 'polling_interval': POLLING_INTERVAL, 'duration': benchmark_duration},
+        jitter_seconds=summarize(deviations),
+        first_poll_seconds=summarize(first_poll),
+        polls=repo.count,
+        expected_polls=expected,
+        )
+    assert repo.count > 0
@@ -0,0 +1,54 @@
+from benchmarks.utils import summarize, timed
+from monitor.measurements import Measurement
+from monitor.repository import RedisRepository
+
+START = 1_600_000_000.0
+RECENT = 100
+CHUNK = 10000
+
+
+def test_get_measurements_latency(history_size, benchmark_results, fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    for offset in range(0, history_size, CHUNK):
+        repo.add_measurements(
+            Measurement('sensor_id', START + i, float(i)) for i in range(offset, min(offset + CHUNK, history_size))
+            )
+    end = START + history_size - 1
+    repeat = max(3, min(50, 1000000 // history_size))
+
+    full = timed(lambda: repo.get_measurements('sensor_id'), repeat)
+    full_batch = timed(lambda: repo.get_measurement_batch('sensor_id'), repeat)
+    recent = timed(lambda: repo.get_measurements('sensor_id', start=end - RECENT + 1, end=end), 50)
+    limited = timed(lambda: repo.get_measurements('sensor_id', limit=RECENT), 50)
+
+    benchmark_results.record(
+        'get_measurements_latency',
+        {'history_size': history_size, 'recent': RECENT},
+        full_range_seconds=summarize(full),
+        full_range_batch_seconds=summarize(full_batch),
+        recent_range_seconds=summarize(recent),
+        limit_seconds=summarize(limited),
+        )
+    assert len(repo.get_measurements('sensor_id', start=end - RECENT + 1, end=end)) == RECENT
+
+
+def test_get_measurements_many_latency(sensor_count, benchmark_results, fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    sensor_ids = ['sensor_{}'.format(i) for i in range(sensor_count)]
+    for offset in range(0, sensor_count, CHUNK // RECENT):
+        repo.add_measurements(
+            Measurement(sensor_id, START + i, float(i)) for sensor_id in sensor_ids[offset:offset + CHUNK // RECENT] for i in range(RECENT)
+            )
+
+    looped = timed(lambda: [repo.get_measurements(sensor_id) for sensor_id in sensor_ids], 3)
+    many = timed(lambda: repo.get_measurements_many(sensor_ids), 3)
+    streamed = timed(lambda: sum(len(chunk) for chunk in repo.iter_measurements(sensor_ids, chunk_size=CHUNK)), 3)
+
+    benchmark_results.record(
+        'get_measurements_many_latency',
+        {'sensors': sensor_count, 'per_sensor': RECENT},
+        loop_seconds=summarize(looped),
+        many_seconds=summarize(many),
+        streamed_seconds=summarize(streamed),
+        )
+    assert sum(len(chunk) for chunk in repo.iter_measurements(sensor_ids, chunk_size=CHUNK)) == sensor_count * RECENT
@@ -0,0 +1,41 @@
+import time
+
+from benchmarks.test_polling import NullRepository
+from benchmarks.utils import summarize
+from monitor.controller import Controller
+from monitor.sensors import discover_ds18b20_sensors
+
+GOOD_MEASUREMENT = '''bd 00 4b 46 ff ff ff ff ff ff : crc=ff YES
+bd 00 4b 46 ff ff ff ff ff ff t=27772
+'''
+
+
+def test_bulk_registration(sensor_count, zero_delay_sensors, benchmark_results):
+    sensors = zero_delay_sensors(sensor_count)
+    controller = Controller(NullRepository())
+
+    start = time.perf_counter()
+    controller.add_sensors(sensors)
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    controller.remove_sensors(sensors)
+    removed = time.perf_counter() - start
+
+    benchmark_results.record(
+        'bulk_registration', {'sensors': sensor_count}, add_seconds=summarize([added]), remove_seconds=summarize([removed])
+        )
+    assert not controller.sensors
+
+
+def test_w1_discovery(sensor_count, tmp_path, benchmark_results):
+    for i in range(sensor_count):
+        device_dir = tmp_path / '28-{:012x}'.format(i)
+        device_dir.mkdir()
+        (device_dir / 'w1_slave').write_text(GOOD_MEASUREMENT)
+
+    start = time.perf_counter()
+    sensors = discover_ds18b20_sensors(tmp_path)
+    elapsed = time.perf_counter() - start
+
+    benchmark_results.record('w1_discovery', {'sensors': sensor_count}, seconds=summarize([elapsed]))
+    assert len(sensors) == sensor_count
@@ -0,0 +1,49 @@
+from benchmarks.utils import summarize, timed
+from monitor.measurements import Measurement
+from monitor.repository import MEASUREMENTS_KEY, RedisRepository
+from monitor.retention import EvictionWorker, RetentionPolicy
+
+START = 1_600_000_000.0
+RETAINED = 1000  # seconds of history kept, one measurement per second
+STEPS = 5
+
+
+def test_read_latency_as_history_ages(history_size, benchmark_results, fake_redis_db):
+    '''
+    Writes `history_size` seconds of measurements in steps, evicting after every step, and reads the full history
+    of a sensor with a retention and of a sensor without one. With eviction the read latency of the first stays
+    flat while the latency of the second grows with the history.
+    '''
+    repo = RedisRepository(fake_redis_db)
+    now = START
+    worker = EvictionWorker(
+        repo, RetentionPolicy(sensors={'retained': float(RETAINED)}), batch_size=1000, pause=0.0, max_batches=1000, clock=lambda: now
+        )
+    step = max(1, history_size // STEPS)
+    retained_reads = []
+    unbounded_reads = []
+    passes = []
+    written = 0
+    while written < history_size:
+        count = min(step, history_size - written)
+        for offset in range(0, count, 10000):
+            repo.add_measurements(
+                Measurement(sensor_id, START + i, float(i))
+                for i in range(written + offset, written + min(offset + 10000, count)) for sensor_id in ('retained', 'unbounded')
+                )
+        written += count
+        now = START + written
+        passes.append(worker.run_once().seconds)
+        retained_reads.append(summarize(timed(lambda: repo.get_measurements('retained'), 5))['p50'])
+        unbounded_reads.append(summarize(timed(lambda: repo.get_measurements('unbounded'), 3))['p50'])
+
+    benchmark_results.record(
+        'read_latency_as_history_ages',
+        {'history_size': history_size, 'retained_seconds': RETAINED, 'steps': len(passes)},
+        retained_read_seconds_by_step=retained_reads,
+        unbounded_read_seconds_by_step=unbounded_reads,
+        eviction_pass_seconds=summarize(passes),
+        list_length=fake_redis_db.llen(MEASUREMENTS_KEY),
+        )
+    assert len(repo.get_measurements('retained')) <= RETAINED + 1
+    assert len(repo.get_measurements('unbounded')) == history_size
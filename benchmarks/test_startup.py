@@ -0,0 +1,53 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+import monitor
+from benchmarks.utils import summarize, timed
+
+GOOD_MEASUREMENT = '''bd 00 4b 46 ff ff ff ff ff ff : crc=ff YES
+bd 00 4b 46 ff ff ff ff ff ff t=27772'''
+REPEAT = 20
+HEAVY_MODULES = ('redis', 'numpy', 'asyncio', 'http.server')
+
+
+@pytest.fixture
+def environment(tmp_path):
+    '''
+    Environment for fresh interpreters, with a bytecode cache so modules are not compiled on every start as on an installed package.
+    '''
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+    env['PYTHONPATH'] = str(Path(monitor.__file__).parent.parent)
+    env['PYTHONPYCACHEPREFIX'] = str(tmp_path / 'pycache')
+    yield env
+
+
+def start(args, env):
+    subprocess.run([sys.executable] + args, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+@pytest.mark.parametrize('module', [None, 'monitor.measurements', 'monitor.sensors', 'monitor.controller', 'monitor.cli', 'redis', 'numpy'])
+def test_import_startup(module, environment, benchmark_results):
+    code = 'pass' if module is None else 'import sys, {}; print(sorted(m for m in {!r} if m in sys.modules))'.format(module, HEAVY_MODULES)
+    loaded = subprocess.run([sys.executable, '-c', code], env=environment, check=True, capture_output=True, text=True).stdout.strip()
+    durations = timed(lambda: start(['-c', code], environment), REPEAT)
+    benchmark_results.record('import_startup', {'module': module, 'repeat': REPEAT}, seconds=summarize(durations), loaded=loaded)
+
+
+def test_one_shot_poll_startup(environment, tmp_path, benchmark_results):
+    '''
+    Times `python -m monitor poll` storing one measurement of each of 4 sensors in a file store, as run from cron.
+    '''
+    devices = tmp_path / 'devices'
+    for i in range(4):
+        (devices / '28-00000000000{}'.format(i)).mkdir(parents=True)
+        (devices / '28-00000000000{}'.format(i) / 'w1_slave').write_text(GOOD_MEASUREMENT)
+    config = tmp_path / 'monitor.json'
+    config.write_text(json.dumps({'w1_devices_dir': str(devices), 'repository': {'path': str(tmp_path / 'store')}}))
+    start(['-m', 'monitor', 'poll', str(config)], environment)
+    durations = timed(lambda: start(['-m', 'monitor', 'poll', str(config)], environment), REPEAT)
+    benchmark_results.record('one_shot_poll_startup', {'sensors': 4, 'repeat': REPEAT}, seconds=summarize(durations))
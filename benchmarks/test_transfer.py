@@ -0,0 +1,32 @@
+from benchmarks.utils import timed
+from monitor.measurements import Measurement
+from monitor.repository import RedisRepository
+from monitor.transfer import export_measurements, import_measurements, read_archive
+
+START = 1_600_000_000.0
+PER_RECORD = 500  # measurements written and read one by one for the baseline
+
+
+def test_transfer_throughput(history_size, benchmark_results, fake_redis_db, tmp_path):
+    repo = RedisRepository(fake_redis_db)
+    path = tmp_path / 'history.npz'
+    for offset in range(0, history_size, 10000):
+        repo.backfill(Measurement('sensor_id', START + i, float(i)) for i in range(offset, min(offset + 10000, history_size)))
+
+    export_seconds = timed(lambda: export_measurements(repo, path, chunk_size=10000), 1)[0]
+    fake_redis_db.flushdb()
+    import_seconds = timed(lambda: import_measurements(repo, path), 1)[0]
+    batches = list(read_archive(path))
+    baseline = [m for batch in batches for m in batch][:PER_RECORD]
+    fake_redis_db.flushdb()
+    record_seconds = timed(lambda: [repo.add_measurement(measurement) for measurement in baseline], 1)[0]
+
+    benchmark_results.record(
+        'transfer_throughput',
+        {'history_size': history_size},
+        export_per_second=history_size / export_seconds,
+        import_per_second=history_size / import_seconds,
+        add_measurement_per_second=len(baseline) / record_seconds,
+        archive_bytes=path.stat().st_size,
+        )
+    assert sum(len(batch) for batch in batches) == history_size
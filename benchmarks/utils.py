@@ -0,0 +1,96 @@
+from datetime import datetime
+import json
+import platform
+import statistics
+import time
+
+from monitor.measurements import Measurement
+from monitor.sensors import AbstractSensor, SensorType
+
+
+class BenchmarkResults:
+    '''
+    Collects benchmark results and writes them as JSON so runs can be compared.
+    '''
+    def __init__(self) -> None:
+        self.results = []
+
+    def record(self, name, params, **metrics):
+        '''
+        Adds the result of a benchmark.
+
+        :param name: benchmark name
+        :param params: parameters the benchmark ran with
+        :param metrics: measured values
+        '''
+        self.results.append({'name': name, 'params': params, 'metrics': metrics})
+
+    def write(self, path):
+        document = {
+            'metadata': {
+                'created': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'machine': platform.machine(),
+                },
+            'results': self.results,
+            }
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2)
+
+
+def summarize(samples):
+    '''
+    Returns summary statistics of a list of samples.
+
+    :param samples: samples, e.g. latencies in seconds
+    :return: dict with count, min, mean, p50, p95, p99 and max
+    '''
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'min': ordered[0],
+        'mean': statistics.fmean(ordered),
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': ordered[-1],
+        }
+
+
+def timed(func, repeat):
+    '''
+    Calls a function repeatedly and returns the duration of every call in seconds.
+    '''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+class ZeroDelaySensor(AbstractSensor):
+    '''
+    Synthetic sensor that returns immediately and records when it was polled.
+    '''
+    def __init__(self, sensor_id, polling_interval=0.1) -> None:
+        super().__init__(sensor_id)
+        self._measurement_delay = 0.0
+        self._polling_interval = polling_interval
+        self.polled_at = []
+
+    def get_measurement(self):
+        self.polled_at.append(time.monotonic())
+        return Measurement(self.sensor_id, time.time(), 1.0)
+
+    @property
+    def type(self):
+        return SensorType.TEMPERATURE
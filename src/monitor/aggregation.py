@@ -0,0 +1,343 @@
+from dataclasses import dataclass, field
+import logging
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Iterable, Optional, Sequence, Union
+
+import numpy as np
+
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.repository import AbstractRepository, sensor_key
+
+LOG = logging.getLogger('monitor_logger')
+
+MINUTE = 60.0
+HOUR = 3600.0
+DAY = 86400.0
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+
+@dataclass
+class Rollup:
+    '''
+    Aggregated measurements of a sensor, one entry per time bucket.
+
+    Buckets are aligned to multiples of `bucket` seconds since the epoch and empty buckets are left out.
+    '''
+    sensor_id: str
+    bucket: float
+    starts: np.ndarray
+    count: np.ndarray
+    sum: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    percentiles: dict[float, np.ndarray] = field(default_factory=dict)
+
+    @property
+    def mean(self) -> np.ndarray:
+        '''
+        Returns the mean value of each bucket.
+        '''
+        mean: np.ndarray = self.sum / self.count
+        return mean
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+def aggregate(
+        sensor_id: str, timestamps: Any, values: Any, bucket: float, percentiles: Sequence[float] = ()
+        ) -> Rollup:
+    '''
+    Aggregates measurements into time buckets.
+
+    :param sensor_id: sensor id
+    :param timestamps: array-like of timestamps
+    :param values: array-like of values
+    :param bucket: bucket width in seconds
+    :param percentiles: percentiles to compute per bucket, between 0 and 100
+    :return: a rollup
+    '''
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    buckets = np.floor(timestamps / bucket)
+    order = np.lexsort((values, buckets))  # sorted by bucket, then by value for the percentiles
+    buckets = buckets[order]
+    values = values[order]
+
+    if len(values) == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return Rollup(sensor_id, bucket, empty, np.empty(0, dtype=np.int64), empty, empty, empty, {q: empty for q in percentiles})
+
+    unique, first, count = np.unique(buckets, return_index=True, return_counts=True)
+    last = first + count - 1
+    result = Rollup(
+        sensor_id,
+        bucket,
+        unique * bucket,
+        count,
+        np.add.reduceat(values, first),
+        values[first],
+        values[last],
+        )
+    for q in percentiles:
+        position = first + (count - 1) * (q / 100.0)  # linear interpolation between the closest ranks
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        fraction = position - lower
+        result.percentiles[q] = values[lower] + (values[upper] - values[lower]) * fraction
+    return result
+
+
+def rollup(
+        repo: AbstractRepository, sensor_id: str, start: Optional[float], end: Optional[float], bucket: float,
+        percentiles: Sequence[float] = ()
+        ) -> Rollup:
+    '''
+    Reads the measurements of a sensor from a repository and aggregates them into time buckets.
+
+    :param repo: repository to read from
+    :param sensor_id: sensor id
+    :param start: earliest timestamp to aggregate (inclusive)
+    :param end: latest timestamp to aggregate (inclusive)
+    :param bucket: bucket width in seconds
+    :param percentiles: percentiles to compute per bucket, between 0 and 100
+    :return: a rollup
+    '''
+    columns = repo.get_measurement_batch(sensor_id, start, end).to_numpy()
+    return aggregate(sensor_id, columns['timestamps'], columns['values'], bucket, percentiles)
+
+
+class RollupStore:
+    '''
+    In-memory store of incrementally computed rollups.
+
+    Each bucket keeps its count, sum, min and max so new measurements can be merged in.
+    '''
+    def __init__(self) -> None:
+        self._buckets: dict[tuple[str, float], dict[float, list[float]]] = {}
+        self._lock = Lock()
+
+    def merge(self, sensor_id: str, resolution: float, partial: Rollup) -> None:
+        '''
+        Merges a partial rollup into the stored rollup.
+
+        :param sensor_id: sensor id
+        :param resolution: bucket width in seconds
+        :param partial: rollup of new measurements
+        '''
+        with self._lock:
+            buckets = self._buckets.setdefault((sensor_id, resolution), {})
+            for start, count, total, low, high in zip(
+                    partial.starts.tolist(), partial.count.tolist(), partial.sum.tolist(), partial.min.tolist(), partial.max.tolist()
+                    ):
+                current = buckets.get(start)
+                if current is None:
+                    buckets[start] = [count, total, low, high]
+                else:
+                    current[0] += count
+                    current[1] += total
+                    current[2] = min(current[2], low)
+                    current[3] = max(current[3], high)
+
+    def get(self, sensor_id: str, resolution: float, start: Optional[float] = None, end: Optional[float] = None) -> Rollup:
+        '''
+        Returns the stored rollup of a sensor.
+
+        :param sensor_id: sensor id
+        :param resolution: bucket width in seconds
+        :param start: earliest bucket start to return (inclusive)
+        :param end: latest bucket start to return (inclusive)
+        :return: a rollup
+        '''
+        with self._lock:
+            buckets = self._buckets.get((sensor_id, resolution), {})
+            rows = sorted(
+                (bucket_start, *stats) for bucket_start, stats in buckets.items()
+                if (start is None or bucket_start >= start) and (end is None or bucket_start <= end)
+                )
+        return _rollup_from_rows(sensor_id, resolution, rows)
+
+
+class RedisRollupStore(RollupStore):
+    '''
+    Rollup store kept in redis so every process reads the same precomputed rollups.
+
+    Each sensor and resolution has a sorted set of buckets scored by bucket start. Buckets are merged
+    by a script so concurrent writers do not lose updates.
+    '''
+    MERGE_SCRIPT = '''
+local current = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+local count, total, low, high = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+if current[1] then
+    local fields = {}
+    for value in string.gmatch(current[1], '[^,]+') do
+        fields[#fields + 1] = tonumber(value)
+    end
+    count = count + fields[2]
+    total = total + fields[3]
+    low = math.min(low, fields[4])
+    high = math.max(high, fields[5])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+end
+local member = string.format('%.17g,%d,%.17g,%.17g,%.17g', tonumber(ARGV[1]), count, total, low, high)
+redis.call('ZADD', KEYS[1], ARGV[1], member)
+'''
+
+    def __init__(self, redis_client: Any) -> None:
+        super().__init__()
+        self.redis_client = redis_client
+        self._merge = redis_client.register_script(self.MERGE_SCRIPT)
+
+    def merge(self, sensor_id: str, resolution: float, partial: Rollup) -> None:
+        key = rollup_key(sensor_id, resolution)
+        pipe = self.redis_client.pipeline()
+        for start, count, total, low, high in zip(
+                partial.starts.tolist(), partial.count.tolist(), partial.sum.tolist(), partial.min.tolist(), partial.max.tolist()
+                ):
+            self._merge(keys=[key], args=[repr(start), count, repr(total), repr(low), repr(high)], client=pipe)
+        pipe.execute()
+
+    def get(self, sensor_id: str, resolution: float, start: Optional[float] = None, end: Optional[float] = None) -> Rollup:
+        members = self.redis_client.zrangebyscore(
+            rollup_key(sensor_id, resolution), '-inf' if start is None else start, '+inf' if end is None else end
+            )
+        rows = [tuple(float(value) for value in _text(member).split(',')) for member in members]
+        return _rollup_from_rows(sensor_id, resolution, rows)
+
+
+def rollup_key(sensor_id: str, resolution: float) -> str:
+    '''
+    Returns the key of the sorted set holding the rollups of a sensor at a resolution.
+
+    :param sensor_id: sensor id
+    :param resolution: bucket width in seconds
+    :return: redis key
+    '''
+    return 'rollups:{}:{:g}'.format(sensor_key(sensor_id), resolution)
+
+
+class RollupRepository(AbstractRepository):
+    '''
+    Repository wrapper that keeps rollups up to date as measurements are written.
+
+    Measurements are passed on to the wrapped repository and merged into rollups at every resolution,
+    either inline or, with `background=True`, by a worker thread so writers are not slowed down.
+    '''
+    def __init__(
+            self, repo: AbstractRepository, store: Optional[RollupStore] = None, resolutions: Sequence[float] = RESOLUTIONS,
+            background: bool = False
+            ) -> None:
+        '''
+        Initializes a new RollupRepository.
+
+        :param repo: repository measurements are written to
+        :param store: store for the rollups, in memory by default
+        :param resolutions: bucket widths in seconds
+        :param background: merge rollups in a worker thread
+        '''
+        self.repo = repo
+        self.store = RollupStore() if store is None else store
+        self.resolutions = tuple(resolutions)
+
+        self._queue: 'Optional[Queue[Optional[list[Measurement]]]]' = None
+        self._worker: Optional[Thread] = None
+        if background:
+            self._queue = Queue()
+            self._worker = Thread(target=self._merge_queued, daemon=True)
+            self._worker.start()
+
+    def add_measurement(self, measurement: Measurement) -> None:
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        measurements = list(measurements)
+        self.repo.add_measurements(measurements)
+        if self._queue is not None:
+            self._queue.put(measurements)
+        else:
+            self.update(measurements)
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        return self.repo.get_measurements(sensor_id, start, end, limit)
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        return self.repo.get_measurement_batch(sensor_id, start, end, limit)
+
+    def get_measurements_many(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> dict[str, list[Measurement]]:
+        return self.repo.get_measurements_many(sensor_ids, start, end, limit)
+
+    def update(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Merges measurements into the rollups without writing them to the repository.
+
+        :param measurements: measurements to merge
+        '''
+        by_sensor: dict[str, MeasurementBatch] = {}
+        for measurement in measurements:
+            by_sensor.setdefault(measurement.sensor_id, MeasurementBatch()).append(measurement)
+        for sensor_id, batch in by_sensor.items():
+            columns = batch.to_numpy()
+            for resolution in self.resolutions:
+                self.store.merge(sensor_id, resolution, aggregate(sensor_id, columns['timestamps'], columns['values'], resolution))
+
+    def get_rollup(self, sensor_id: str, resolution: float, start: Optional[float] = None, end: Optional[float] = None) -> Rollup:
+        '''
+        Returns the precomputed rollup of a sensor.
+
+        :param sensor_id: sensor id
+        :param resolution: one of the repository's resolutions
+        :param start: earliest bucket start to return (inclusive)
+        :param end: latest bucket start to return (inclusive)
+        :return: a rollup
+        '''
+        if resolution not in self.resolutions:
+            raise ValueError('Rollups are not kept at resolution [{}]'.format(resolution))
+        return self.store.get(sensor_id, resolution, start, end)
+
+    def join(self) -> None:
+        '''
+        Wait until all queued measurements are merged into the rollups.
+        '''
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        '''
+        Merge queued measurements and stop the worker thread.
+        '''
+        if self._queue is not None and self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._queue = None
+            self._worker = None
+
+    def _merge_queued(self) -> None:
+        queue = self._queue
+        if queue is None:
+            return
+        while True:
+            measurements = queue.get()
+            try:
+                if measurements is None:
+                    return
+                self.update(measurements)
+            except Exception as e:
+                LOG.error('Error updating rollups - [{}]'.format(e))
+            finally:
+                queue.task_done()
+
+
+def _rollup_from_rows(sensor_id: str, resolution: float, rows: Sequence[Sequence[float]]) -> Rollup:
+    table = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return Rollup(sensor_id, resolution, table[:, 0], table[:, 1].astype(np.int64), table[:, 2], table[:, 3], table[:, 4])
+
+
+def _text(value: Union[str, bytes]) -> str:
+    return value.decode() if isinstance(value, bytes) else value
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from typing import Optional
+
+from monitor.buffer import BLOCK, DROP_OLDEST
+from monitor.measurements import Measurement
+from monitor.repository import AbstractRepository
+from monitor.scheduler import next_deadline
+from monitor.sensors import AbstractSensor
+
+LOG = logging.getLogger('monitor_logger')
+
+
+class AsyncController:
+    '''
+    Controller for sensors that runs on an asyncio event loop.
+
+    Every sensor is polled by its own task, so a single thread can handle many mostly idle sensors.
+    Measurements are buffered and written with `async_add_measurements` by a flush task.
+
+    When more than `queue_size` measurements are buffered, e.g. while the repository is down, the overflow
+    policy applies as in `QueuedRepository`: `block` makes polls wait for room and `drop-oldest` discards
+    the oldest measurements.
+    '''
+    OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST)
+
+    def __init__(
+            self, repo: AbstractRepository, batch_size: int = 100, flush_interval: float = 1.0, queue_size: int = 10000, overflow: str = BLOCK
+            ):
+        '''
+        Initializes a new AsyncController.
+
+        :param repo: repository measurements are written to
+        :param batch_size: number of buffered measurements that triggers a write to the repository
+        :param flush_interval: maximum seconds a measurement is buffered before it is written
+        :param queue_size: number of buffered measurements before the overflow policy applies
+        :param overflow: what to do when the buffer is full, `block` or `drop-oldest`
+        '''
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy [{}], expected one of {}'.format(overflow, self.OVERFLOW_POLICIES))
+        self.repo = repo
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.running = False
+
+        self._sensors: list[AbstractSensor] = []
+        self._polling_tasks: list['asyncio.Task[None]'] = []
+        self._stop_events: dict[AbstractSensor, asyncio.Event] = {}
+        self._flush_task: Optional['asyncio.Task[None]'] = None
+        self._pending: list[Measurement] = []
+        self._room: Optional[asyncio.Condition] = None
+        self._flush_event: Optional[asyncio.Event] = None
+
+    @property
+    def sensors(self):
+        return self._sensors
+
+    def add_sensor(self, sensor: AbstractSensor):
+        '''
+        Add a sensor to the list of sensors.
+        While polling the sensor is polled straight away, so this must be called from the event loop.
+        :param sensor: sensor to add
+        '''
+        self._sensors.append(sensor)
+        if self.running:
+            self._start_sensor(sensor)
+        LOG.info('Added sensor - [{}]'.format(sensor.sensor_id))
+
+    def remove_sensor(self, sensor: AbstractSensor):
+        '''
+        Remove a sensor from the list of sensors.
+        While polling its task is stopped, a measurement in progress is allowed to finish before the sensor is closed.
+        :param sensor: sensor to remove
+        '''
+        try:
+            self._sensors.remove(sensor)
+        except ValueError:
+            LOG.error('Sensor not found - [{}]'.format(sensor.sensor_id))
+            return
+        stop_event = self._stop_events.pop(sensor, None)
+        if stop_event is not None:
+            stop_event.set()
+        self._polling_tasks = [task for task in self._polling_tasks if not task.done()]
+        LOG.info('Removed sensor - [{}]'.format(sensor.sensor_id))
+
+    async def start_polling(self):
+        '''
+        Start a polling task for every sensor.
+        '''
+        LOG.info('Starting polling [{}] sensors'.format(len(self._sensors)))
+        self.running = True
+        self._room = asyncio.Condition()
+        self._flush_event = asyncio.Event()
+        self._flush_task = asyncio.create_task(self._flush_periodically(self._flush_event))
+        for sensor in self._sensors:
+            self._start_sensor(sensor)
+
+    def _start_sensor(self, sensor: AbstractSensor):
+        self._stop_events[sensor] = asyncio.Event()
+        self._polling_tasks.append(asyncio.create_task(self.poll_sensor(sensor)))
+
+    async def poll_sensor(self, sensor: AbstractSensor):
+        '''
+        Poll a sensor until polling is stopped.
+
+        Polls are kept on a fixed grid of the sensor's polling interval. If a measurement takes longer
+        than the interval the missed polls are skipped. The sensor is closed once polling stops.
+        :param sensor: sensor to poll
+        '''
+        loop = asyncio.get_running_loop()
+        stop_event = self._stop_events.get(sensor) or asyncio.Event()
+        deadline = loop.time()
+        try:
+            while self.running and not stop_event.is_set():
+                try:
+                    await self.take_measurement(sensor)
+                except Exception as e:
+                    LOG.error('Error polling sensor - [{}] - [{}]'.format(sensor.sensor_id, e))
+                deadline = next_deadline(deadline, sensor.polling_interval, loop.time())
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._close_sensor(sensor)
+
+    @staticmethod
+    def _close_sensor(sensor: AbstractSensor):
+        try:
+            sensor.close()
+        except Exception as e:
+            LOG.error('Error closing sensor - [{}] - [{}]'.format(sensor.sensor_id, e))
+
+    async def take_measurement(self, sensor: AbstractSensor):
+        '''
+        Take a single measurement from a sensor and buffer it for the repository.
+        :param sensor: sensor to measure
+        '''
+        LOG.debug('Polling sensor - [%s] with interval - [%s]', sensor.sensor_id, sensor.polling_interval)
+        measurement = await sensor.async_get_measurement()
+        if self.overflow == BLOCK and self._room is not None and len(self._pending) >= self.queue_size:
+            async with self._room:
+                await self._room.wait_for(lambda: len(self._pending) < self.queue_size or not self.running)
+        self._pending.append(measurement)
+        self._trim()
+        if len(self._pending) >= self.batch_size and self._flush_event is not None:
+            self._flush_event.set()
+
+    async def flush(self):
+        '''
+        Write all buffered measurements to the repository.
+        '''
+        batch = self._pending
+        self._pending = []
+        if not batch:
+            return
+        try:
+            await self.repo.async_add_measurements(batch)
+        except Exception:
+            self._pending = batch + self._pending
+            self._trim()
+            raise
+        await self._notify_room()
+
+    def _trim(self):
+        '''
+        Discards the oldest measurements beyond `queue_size` under the `drop-oldest` policy.
+        '''
+        excess = len(self._pending) - self.queue_size
+        if self.overflow == DROP_OLDEST and excess > 0:
+            del self._pending[:excess]
+            LOG.warning('Dropped [{}] measurements that could not be queued or written'.format(excess))
+
+    async def _notify_room(self):
+        if self._room is not None:
+            async with self._room:
+                self._room.notify_all()
+
+    async def stop_polling(self):
+        '''
+        Stop polling sensors and flush buffered measurements.
+        '''
+        self.running = False
+        LOG.info('Stopping polling sensors')
+        for stop_event in self._stop_events.values():
+            stop_event.set()
+        self._stop_events = {}
+        await self._notify_room()  # polls waiting for room in a full buffer
+        if self._flush_event is not None:
+            self._flush_event.set()
+        await asyncio.gather(*self._polling_tasks)
+        self._polling_tasks = []
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+        LOG.info('Polling sensors stopped')
+
+    async def _flush_periodically(self, flush_event: asyncio.Event):
+        while self.running:
+            try:
+                await asyncio.wait_for(flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                LOG.error('Error flushing measurements - [{}]'.format(e))
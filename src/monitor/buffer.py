@@ -0,0 +1,343 @@
+from collections import deque
+import logging
+import os
+from pathlib import Path
+from threading import Condition, Event, Lock, Thread
+import time
+from typing import Iterable, Optional
+
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.repository import AbstractRepository
+from monitor.serializers import JSONSerializer, SerializationError
+
+LOG = logging.getLogger('monitor_logger')
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+SPILL = 'spill'
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+
+class QueuedRepository(AbstractRepository):
+    '''
+    Bounded queue in front of a repository, drained by writer threads so producers never wait on a write.
+
+    Measurements are written in batches of up to `batch_size` once that many are queued or the oldest one has
+    waited `max_age` seconds. A failed write is retried with exponential backoff, and after the last retry the
+    batch goes back to the front of the queue.
+
+    When more than `max_size` measurements are queued the overflow policy decides what happens:
+    `block` makes the producer wait for room, `drop-oldest` discards the oldest measurements and
+    `spill` appends them to `spill_path`, from where a writer replays them once the queue is empty.
+    Replayed measurements are written at least once.
+    '''
+    def __init__(
+            self, repo: AbstractRepository, max_size: int = 10000, batch_size: int = 100, max_age: float = 1.0, writers: int = 1,
+            overflow: str = BLOCK, spill_path: Optional[Path] = None, retries: int = 3, backoff: float = 0.1, max_backoff: float = 5.0,
+            metrics: Optional[MetricsRegistry] = None
+            ) -> None:
+        '''
+        Initializes a new QueuedRepository.
+
+        :param repo: repository the queue is written to
+        :param max_size: number of queued measurements before the overflow policy applies
+        :param batch_size: maximum number of measurements per write
+        :param max_age: seconds a measurement may wait before it is written
+        :param writers: number of writer threads
+        :param overflow: overflow policy, one of `block`, `drop-oldest` or `spill`
+        :param spill_path: file measurements are spilled to, required by the `spill` policy
+        :param retries: number of times a failed write is retried
+        :param backoff: seconds before the first retry, doubled for every following retry
+        :param max_backoff: longest wait between retries
+        :param metrics: registry to record write latency, errors, dropped, delayed and spilled measurements in
+        '''
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy [{}], expected one of {}'.format(overflow, OVERFLOW_POLICIES))
+        if overflow == SPILL and spill_path is None:
+            raise ValueError('The spill overflow policy needs a spill path')
+        self.repo = repo
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.writers = writers
+        self.overflow = overflow
+        self.spill_path = None if spill_path is None else Path(spill_path)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+
+        self._queue: deque[Measurement] = deque()
+        self._oldest: Optional[float] = None
+        self._condition = Condition()
+        self._stopping = Event()
+        self._threads: list[Thread] = []
+        self._serializer = JSONSerializer()
+        self._spill_lock = Lock()
+        self._replay_lock = Lock()
+        self._spill_pending = self.spill_path is not None and (self.spill_path.exists() or self._replay_path().exists())
+
+        if metrics is not None:
+            self._write_seconds = metrics.histogram('monitor_repository_write_seconds', 'Seconds taken to write a batch to the repository')
+            self._write_errors = metrics.counter('monitor_repository_write_errors_total', 'Failed writes to the repository')
+            self._written = metrics.counter('monitor_measurements_written_total', 'Measurements written to the repository')
+            self._dropped = metrics.counter('monitor_measurements_dropped_total', 'Measurements discarded because the write queue was full')
+            self._delayed = metrics.counter(
+                'monitor_measurements_delayed_total', 'Measurements held up by a full write queue or a failed write'
+                )
+            self._spilled = metrics.counter('monitor_measurements_spilled_total', 'Measurements spilled to disk because the write queue was full')
+            metrics.gauge('monitor_buffer_pending', 'Measurements waiting to be written to the repository').set_function(lambda: self.pending)
+
+    @property
+    def pending(self) -> int:
+        '''
+        Returns the number of queued measurements.
+        '''
+        return len(self._queue)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and not self._stopping.is_set()
+
+    def add_measurement(self, measurement: Measurement) -> None:
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement], cancel: Optional[Event] = None) -> None:
+        '''
+        Queues measurements, applying the overflow policy if the queue is full.
+
+        Without running writers a full queue is written from the calling thread.
+
+        :param measurements: measurements to add
+        :param cancel: stop waiting for room under the `block` policy once this is set, the measurements are queued anyway.
+            Call `wake` after setting it.
+        '''
+        measurements = list(measurements)
+        with self._condition:
+            if self.overflow == BLOCK and len(self._queue) >= self.max_size and self.running:
+                if self.metrics is not None:
+                    self._delayed.inc(len(measurements))
+                while len(self._queue) >= self.max_size and self.running and not (cancel is not None and cancel.is_set()):
+                    self._condition.wait()
+            was_empty = not self._queue
+            if was_empty:
+                self._oldest = time.monotonic()
+            self._queue.extend(measurements)
+            overflow = self._trim()
+            if was_empty or len(self._queue) >= self.batch_size:
+                self._condition.notify()
+        self._overflow(overflow)
+        if not self.running and len(self._queue) > self.max_size:
+            self.flush()
+
+    def wake(self) -> None:
+        '''
+        Wakes producers waiting for room in a full queue, so they can check their `cancel` events.
+        '''
+        with self._condition:
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        '''
+        Writes all queued measurements from the calling thread.
+
+        If a write fails the measurements are kept and the error is raised.
+        '''
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            start = time.perf_counter()
+            try:
+                self.repo.add_measurements(batch)
+            except Exception:
+                self._requeue(batch)
+                if self.metrics is not None:
+                    self._write_errors.inc()
+                raise
+            self._record(batch, start, delayed=False)
+
+    def start(self) -> None:
+        '''
+        Start the writer threads.
+        '''
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(self.writers):
+            thread = Thread(target=self._write_loop, name='monitor-writer-{}'.format(index), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        '''
+        Stop the writer threads once everything queued is written.
+
+        Measurements that still cannot be written are spilled, or kept in the queue without a spill path,
+        whatever the overflow policy, so a later `flush` or `start` can write them.
+        '''
+        self._stopping.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        try:
+            self.flush()
+        except Exception as e:
+            if self.spill_path is None:
+                LOG.error('Could not write [{}] queued measurements before stopping, they are kept in memory - [{}]'.format(self.pending, e))
+                return
+            with self._condition:
+                unwritten = list(self._queue)
+                self._queue.clear()
+                self._oldest = None
+            self._spill(unwritten)
+            LOG.warning('Spilled [{}] measurements that could not be written before stopping - [{}]'.format(len(unwritten), e))
+
+    def _take(self) -> list[Measurement]:
+        with self._condition:
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            if not self._queue:
+                self._oldest = None
+            if count:
+                self._condition.notify_all()
+            return batch
+
+    def _requeue(self, batch: list[Measurement]) -> None:
+        with self._condition:
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.extendleft(reversed(batch))
+            overflow = self._trim()
+        self._overflow(overflow)
+
+    def _trim(self) -> list[Measurement]:
+        '''
+        Removes the oldest measurements beyond `max_size` under the drop and spill policies and returns them.
+        '''
+        if self.overflow == BLOCK or len(self._queue) <= self.max_size:
+            return []
+        return [self._queue.popleft() for _ in range(len(self._queue) - self.max_size)]
+
+    def _overflow(self, measurements: list[Measurement]) -> None:
+        if not measurements:
+            return
+        if self.overflow == SPILL:
+            self._spill(measurements)
+            return
+        LOG.warning('Dropped [{}] measurements that could not be queued or written'.format(len(measurements)))
+        if self.metrics is not None:
+            self._dropped.inc(len(measurements))
+
+    def _spill(self, measurements: list[Measurement]) -> None:
+        if self.spill_path is None:
+            return
+        encoded = ''.join(self._serializer.dumps(measurement) + '\n' for measurement in measurements)
+        with self._spill_lock:
+            with open(self.spill_path, 'a') as f:
+                f.write(encoded)
+            self._spill_pending = True
+        if self.metrics is not None:
+            self._spilled.inc(len(measurements))
+
+    def _replay_path(self) -> Path:
+        assert self.spill_path is not None
+        return self.spill_path.with_name(self.spill_path.name + '.replay')
+
+    def _replay(self) -> bool:
+        '''
+        Writes spilled measurements to the repository and returns whether the spill file was emptied.
+        '''
+        if self.spill_path is None or not self._replay_lock.acquire(blocking=False):
+            return True
+        try:
+            replaying = self._replay_path()
+            with self._spill_lock:
+                if not replaying.exists():
+                    if not self.spill_path.exists():
+                        self._spill_pending = False
+                        return True
+                    os.replace(self.spill_path, replaying)
+            replayed = 0
+            batch: list[Measurement] = []
+            with open(replaying) as f:
+                for line in f:
+                    try:
+                        batch.append(self._serializer.loads(line))
+                    except SerializationError as e:  # a partial line left by a crash
+                        LOG.error('Error reading spilled measurement - [{}]'.format(e))
+                    if len(batch) >= self.batch_size:
+                        if not self._write(batch):
+                            return False
+                        replayed += len(batch)
+                        batch = []
+            if batch and not self._write(batch):
+                return False
+            replayed += len(batch)
+            replaying.unlink()
+            with self._spill_lock:
+                self._spill_pending = self.spill_path.exists()
+            LOG.info('Replayed [{}] spilled measurements'.format(replayed))
+            return True
+        finally:
+            self._replay_lock.release()
+
+    def _write(self, batch: list[Measurement]) -> bool:
+        '''
+        Writes a batch, retrying with exponential backoff, and returns whether it was written.
+        '''
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                self.repo.add_measurements(batch)
+            except Exception as e:
+                LOG.error('Error writing measurements - [{}]'.format(e))
+                if self.metrics is not None:
+                    self._write_errors.inc()
+                if attempt < self.retries:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_backoff)
+                continue
+            self._record(batch, start, delayed=attempt > 0)
+            return True
+        return False
+
+    def _record(self, batch: list[Measurement], start: float, delayed: bool) -> None:
+        if self.metrics is None:
+            return
+        self._write_seconds.observe(time.perf_counter() - start)
+        self._written.inc(len(batch))
+        if delayed:
+            self._delayed.inc(len(batch))
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopping.is_set():
+                    queued = len(self._queue)
+                    if queued >= self.batch_size or (not queued and self._spill_pending and not self._replay_lock.locked()):
+                        break
+                    if self._oldest is not None:
+                        age = time.monotonic() - self._oldest
+                        if age >= self.max_age:
+                            break
+                        self._condition.wait(self.max_age - age)
+                    else:
+                        self._condition.wait()
+                if self._stopping.is_set() and not self._queue:
+                    return
+            batch = self._take()
+            if not batch:
+                if not self._replay():
+                    self._stopping.wait(self.max_backoff)
+                continue
+            if self._write(batch):
+                continue
+            self._requeue(batch)
+            if self._stopping.is_set():
+                return  # `stop` makes a last attempt and spills or keeps what is left
+            self._stopping.wait(self.max_backoff)
@@ -0,0 +1,269 @@
+from array import array
+import bisect
+from collections import OrderedDict
+import math
+from threading import Lock
+from typing import Iterable, Optional
+
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.metrics import MetricsRegistry
+from monitor.repository import AbstractRepository
+
+ENTRY_BYTES = 2 * array('d').itemsize  # a timestamp and a value
+
+
+class _Ring:
+    '''
+    The latest measurements of one sensor, ordered by timestamp.
+
+    Every measurement of the sensor from `floor` onwards is held, older measurements are only in the repository.
+    Like a sorted set, a ring holds each timestamp and value pair once.
+    '''
+    __slots__ = ('timestamps', 'values', 'floor')
+
+    def __init__(self, floor: float) -> None:
+        self.timestamps: 'array[float]' = array('d')
+        self.values: 'array[float]' = array('d')
+        self.floor = floor
+
+    def add(self, timestamp: float, value: float) -> None:
+        timestamps = self.timestamps
+        if not timestamps or timestamp > timestamps[-1]:
+            timestamps.append(timestamp)
+            self.values.append(value)
+        elif timestamp >= self.floor:
+            lo = bisect.bisect_left(timestamps, timestamp)
+            index = bisect.bisect_right(timestamps, timestamp, lo)
+            if value in self.values[lo:index]:
+                return  # already read back from the repository by a fill that ran after the write
+            timestamps.insert(index, timestamp)
+            self.values.insert(index, value)
+
+    def trim(self, size: int) -> int:
+        '''
+        Drops the oldest measurements until at most `size` are left and returns how many were dropped.
+        '''
+        dropped = len(self.timestamps) - size
+        if dropped <= 0:
+            return 0
+        self.floor = math.nextafter(self.timestamps[dropped - 1], math.inf)
+        del self.timestamps[:dropped]
+        del self.values[:dropped]
+        return dropped
+
+
+class CachedRepository(AbstractRepository):
+    '''
+    Read-through cache of the latest measurements of each sensor in front of a repository.
+
+    Measurements written through the cache are kept in a ring buffer of the latest `max_size` measurements per
+    sensor. Reads starting at or after the oldest measurement a ring is known to be complete from are served from
+    memory, other reads go to the repository. A read of a recent window that misses fills the ring, so the next
+    read of the same window is a hit.
+
+    Sensors are evicted least recently used first once the cache holds more than `max_entries` measurements or
+    `max_bytes` bytes of timestamps and values.
+
+    The cache only sees writes made through it, so every writer of the repository should share the same cache.
+    '''
+    def __init__(
+            self, repo: AbstractRepository, max_size: int = 1000, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+            metrics: Optional[MetricsRegistry] = None
+            ) -> None:
+        '''
+        Initializes a new CachedRepository.
+
+        :param repo: repository holding all measurements
+        :param max_size: number of measurements kept per sensor
+        :param max_entries: number of measurements kept across all sensors, unlimited by default
+        :param max_bytes: bytes of timestamps and values kept across all sensors, unlimited by default
+        :param metrics: registry to record hits, misses and the number of cached measurements in
+        '''
+        if max_size < 1:
+            raise ValueError('Cache size must be at least 1')
+        self.repo = repo
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+
+        self._rings: 'OrderedDict[str, _Ring]' = OrderedDict()
+        self._entries = 0
+        self._lock = Lock()
+
+        if metrics is not None:
+            self._hits = metrics.counter('monitor_cache_hits_total', 'Reads served from the measurement cache')
+            self._misses = metrics.counter('monitor_cache_misses_total', 'Reads passed on to the repository')
+            metrics.gauge('monitor_cache_entries', 'Measurements held in the measurement cache').set_function(lambda: self.entries)
+
+    @property
+    def entries(self) -> int:
+        '''
+        Returns the number of measurements held across all sensors.
+        '''
+        return self._entries
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Returns the bytes of timestamps and values held across all sensors.
+        '''
+        return self._entries * ENTRY_BYTES
+
+    def add_measurement(self, measurement: Measurement) -> None:
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Writes measurements to the repository and then to the cache.
+
+        If the write fails the cache is left unchanged and the error is raised.
+
+        :param measurements: measurements to add
+        '''
+        measurements = list(measurements)
+        self.repo.add_measurements(measurements)
+        self._cache(measurements)
+
+    async def async_add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        measurements = list(measurements)
+        await self.repo.async_add_measurements(measurements)
+        self._cache(measurements)
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        return list(self.get_measurement_batch(sensor_id, start, end, limit))
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        '''
+        Returns the measurements of a sensor ordered by timestamp as a columnar batch.
+
+        :param sensor_id: sensor id
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param limit: maximum number of measurements to return
+        :return: batch of measurements
+        '''
+        if start is not None:
+            with self._lock:
+                ring = self._rings.get(sensor_id)
+                if ring is not None and start >= ring.floor:
+                    self._rings.move_to_end(sensor_id)
+                    batch = self._slice(sensor_id, ring, start, end, limit)
+                else:
+                    batch = None
+            if batch is not None:
+                if self.metrics is not None:
+                    self._hits.inc()
+                return batch
+
+        if self.metrics is not None:
+            self._misses.inc()
+        batch = self.repo.get_measurement_batch(sensor_id, start, end, limit)
+        if start is not None and end is None and (limit is None or len(batch) < limit):
+            self._fill(sensor_id, start, batch)
+        return batch
+
+    def get_measurements_many(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> dict[str, list[Measurement]]:
+        '''
+        Returns the measurements of several sensors, serving the cached ones from memory and reading the rest together.
+
+        Takes the same arguments as `AbstractRepository.get_measurements_many`.
+        '''
+        sensor_ids = list(dict.fromkeys(sensor_ids))
+        result: dict[str, list[Measurement]] = {}
+        missed = []
+        with self._lock:
+            for sensor_id in sensor_ids:
+                ring = self._rings.get(sensor_id)
+                if start is not None and ring is not None and start >= ring.floor:
+                    self._rings.move_to_end(sensor_id)
+                    result[sensor_id] = list(self._slice(sensor_id, ring, start, end, limit))
+                else:
+                    missed.append(sensor_id)
+        if self.metrics is not None:
+            self._hits.inc(len(result))
+            self._misses.inc(len(missed))
+        if missed:
+            read = self.repo.get_measurements_many(missed, start, end, limit)
+            for sensor_id, measurements in read.items():
+                if start is not None and end is None and (limit is None or len(measurements) < limit):
+                    self._fill(sensor_id, start, MeasurementBatch(measurements))
+            result.update(read)
+        return {sensor_id: result[sensor_id] for sensor_id in sensor_ids}
+
+    def invalidate(self, sensor_id: Optional[str] = None) -> None:
+        '''
+        Drops the cached measurements of a sensor, or of every sensor.
+
+        :param sensor_id: sensor id, every sensor if not given
+        '''
+        with self._lock:
+            if sensor_id is None:
+                self._rings.clear()
+                self._entries = 0
+                return
+            ring = self._rings.pop(sensor_id, None)
+            if ring is not None:
+                self._entries -= len(ring.timestamps)
+
+    def _cache(self, measurements: list[Measurement]) -> None:
+        with self._lock:
+            touched: dict[str, _Ring] = {}
+            for measurement in measurements:
+                ring = touched.get(measurement.sensor_id)
+                if ring is None:
+                    ring = self._rings.get(measurement.sensor_id)
+                    if ring is None:
+                        ring = self._rings[measurement.sensor_id] = _Ring(measurement.timestamp)
+                    self._rings.move_to_end(measurement.sensor_id)
+                    touched[measurement.sensor_id] = ring
+                size = len(ring.timestamps)
+                ring.add(measurement.timestamp, measurement.value)
+                self._entries += len(ring.timestamps) - size
+            for ring in touched.values():
+                self._entries -= ring.trim(self.max_size)
+            self._evict()
+
+    def _fill(self, sensor_id: str, start: float, batch: MeasurementBatch) -> None:
+        '''
+        Replaces the ring of a sensor with the result of a read from `start` to now.
+
+        Measurements written through the cache while the read was running are kept.
+        '''
+        with self._lock:
+            ring = self._rings.get(sensor_id)
+            if ring is not None and start >= ring.floor:
+                return
+            pairs = set(zip(batch.timestamps, batch.values))
+            if ring is not None:
+                pairs.update(zip(ring.timestamps, ring.values))
+                self._entries -= len(ring.timestamps)
+            filled = self._rings[sensor_id] = _Ring(start)
+            self._rings.move_to_end(sensor_id)
+            for timestamp, value in sorted(pair for pair in pairs if pair[0] >= start):
+                filled.timestamps.append(timestamp)
+                filled.values.append(value)
+            filled.trim(self.max_size)
+            self._entries += len(filled.timestamps)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._rings and (
+                (self.max_entries is not None and self._entries > self.max_entries)
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+                ):
+            _, ring = self._rings.popitem(last=False)
+            self._entries -= len(ring.timestamps)
+
+    def _slice(self, sensor_id: str, ring: _Ring, start: float, end: Optional[float], limit: Optional[int]) -> MeasurementBatch:
+        lo = bisect.bisect_left(ring.timestamps, start)
+        hi = len(ring.timestamps) if end is None else bisect.bisect_right(ring.timestamps, end)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return MeasurementBatch.from_columns(sensor_id, ring.timestamps[lo:hi], ring.values[lo:hi])
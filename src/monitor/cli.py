@@ -0,0 +1,234 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+import signal
+import sys
+from threading import Event
+from typing import TYPE_CHECKING, Any, Optional, Sequence, Union
+
+from monitor.sensors import SensorConfigError, load_sensors
+
+if TYPE_CHECKING:
+    from monitor.controller import Controller
+    from monitor.repository import AbstractRepository
+
+LOG = logging.getLogger('monitor_logger')
+
+DEFAULT_URL = 'redis://localhost:6379/0'
+CONTROLLER_OPTIONS = ('batch_size', 'flush_interval', 'max_workers', 'queue_size', 'overflow', 'spill_path', 'writers', 'spool_path')
+TRANSFER_COMMANDS = ('export', 'import')
+
+
+class ConfigError(Exception):
+    '''
+    Exception for errors in the monitor config file.
+    '''
+    pass
+
+
+def load_config(config_file: Union[str, Path]) -> dict[str, Any]:
+    '''
+    Reads the JSON config file of the monitor.
+
+    The file is a sensor config as read by `load_sensors`, with optional sections for the repository and the controller::
+
+        {
+            "polling_interval": 5.0,
+            "w1_devices_dir": "/sys/bus/w1/devices",
+            "repository": {"url": "redis://localhost:6379/0"},
+            "controller": {"batch_size": 100, "max_workers": 4, "spool_path": "/var/lib/monitor/spool"},
+            "metrics_port": 9100
+        }
+
+    The repository is either a redis `url`, a list of `urls` of the nodes of a sharded repository,
+    or the `path` of a file store. It defaults to a local redis.
+
+    :param config_file: path to the config file
+    :return: the config
+    raises: ConfigError
+    '''
+    try:
+        with open(config_file) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError('Cannot read config [{}] - [{}]'.format(config_file, e)) from e
+    if not isinstance(config, dict):
+        raise ConfigError('Config [{}] must be a JSON object'.format(config_file))
+    for section in ('repository', 'controller'):
+        if not isinstance(config.get(section, {}), dict):
+            raise ConfigError('Config section [{}] must be a JSON object'.format(section))
+    unknown = set(config.get('controller', {})) - set(CONTROLLER_OPTIONS)
+    if unknown:
+        raise ConfigError('Unknown controller options [{}]'.format(', '.join(sorted(unknown))))
+    return config
+
+
+def build_repository(config: dict[str, Any]) -> 'AbstractRepository':
+    '''
+    Builds the repository of a config, importing only the backend it selects.
+
+    :param config: config read by `load_config`
+    :return: a repository
+    '''
+    section = config.get('repository', {})
+    if 'path' in section:
+        from monitor.filestore import FileRepository
+
+        return FileRepository(Path(section['path']))
+    from monitor.repository import RedisRepository, ShardedRedisRepository
+
+    urls = section.get('urls') or [section.get('url', DEFAULT_URL)]
+    if len(urls) == 1:
+        return RedisRepository.from_url(urls[0])
+    return ShardedRedisRepository.from_urls(urls)
+
+
+def close_repository(repo: 'AbstractRepository') -> None:
+    '''
+    Flushes and closes a repository that holds buffers or worker threads.
+    '''
+    close = getattr(repo, 'close', None)
+    if close is not None:
+        close()
+
+
+def build_controller(config: dict[str, Any], repo: 'AbstractRepository') -> 'Controller':
+    '''
+    Builds a controller for the repository with the options of the `controller` section of a config.
+
+    :param config: config read by `load_config`
+    :param repo: repository measurements are written to
+    :return: a controller
+    '''
+    from monitor.controller import Controller
+
+    options = dict(config.get('controller', {}))
+    for key in ('spill_path', 'spool_path'):
+        if options.get(key) is not None:
+            options[key] = Path(options[key])
+    return Controller(repo, **options)
+
+
+def run(config_file: Union[str, Path], stop: Event) -> None:
+    '''
+    Polls the sensors of a config file until `stop` is set.
+
+    :param config_file: path to the config file
+    :param stop: event ending the run
+    raises: ConfigError, SensorConfigError
+    '''
+    config = load_config(config_file)
+    sensors = load_sensors(Path(config_file))
+    repo = build_repository(config)
+    controller = build_controller(config, repo)
+    controller.add_sensors(sensors)
+    server = None
+    if config.get('metrics_port') is not None:
+        from monitor.metrics import MetricsServer
+
+        server = MetricsServer(controller.metrics, int(config['metrics_port']))
+        server.start()
+    controller.start_polling(config.get('polling_interval', 2))
+    try:
+        while not stop.wait(1.0):
+            pass
+    finally:
+        controller.stop_polling()
+        if server is not None:
+            server.stop()
+        close_repository(repo)
+
+
+def poll_once(config_file: Union[str, Path]) -> int:
+    '''
+    Takes one measurement from every sensor of a config file and writes them to the repository in one batch.
+
+    No controller or worker threads are started, so this suits short-lived runs from cron.
+
+    :param config_file: path to the config file
+    :return: number of sensors that failed to measure
+    raises: ConfigError, SensorConfigError
+    '''
+    config = load_config(config_file)
+    sensors = load_sensors(Path(config_file))
+    measurements = []
+    failed = 0
+    for sensor in sensors:
+        try:
+            measurements.append(sensor.get_measurement())
+        except Exception as e:
+            LOG.error('Error polling sensor - [{}] - [{}]'.format(sensor.sensor_id, e))
+            failed += 1
+    repo = build_repository(config)
+    try:
+        if measurements:
+            repo.add_measurements(measurements)
+    finally:
+        close_repository(repo)
+    LOG.info('Stored [{}] measurements'.format(len(measurements)))
+    return failed
+
+
+def read(config_file: Union[str, Path], sensor_id: str, start: Optional[float], end: Optional[float], limit: Optional[int]) -> None:
+    '''
+    Prints the stored measurements of a sensor as tab separated timestamps and values.
+    '''
+    repo = build_repository(load_config(config_file))
+    try:
+        for measurement in repo.get_measurements(sensor_id, start, end, limit):
+            print('{}\t{}'.format(measurement.timestamp, measurement.value))
+    finally:
+        close_repository(repo)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    '''
+    Runs the monitor from the command line.
+
+        monitor run /etc/monitor.json
+        monitor poll /etc/monitor.json
+        monitor read /etc/monitor.json tank --start 1600000000
+        monitor export --url redis://localhost:6379/0 history.npz
+
+    Only the modules of the selected command and backend are imported, e.g. numpy is only loaded by `export` and `import`.
+
+    :param argv: arguments, the process arguments by default
+    :return: exit code
+    '''
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in TRANSFER_COMMANDS:
+        from monitor import transfer
+
+        return transfer.main(argv)
+
+    parser = argparse.ArgumentParser(prog='monitor', description='Poll sensors and store their measurements')
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), help='logging level')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('run', help='poll sensors until interrupted').add_argument('config', type=Path, help='config file')
+    commands.add_parser('poll', help='measure every sensor once and store the measurements').add_argument('config', type=Path, help='config file')
+    read_command = commands.add_parser('read', help='print the stored measurements of a sensor')
+    read_command.add_argument('config', type=Path, help='config file')
+    read_command.add_argument('sensor_id', help='sensor id')
+    read_command.add_argument('--start', type=float, help='earliest timestamp to read')
+    read_command.add_argument('--end', type=float, help='latest timestamp to read')
+    read_command.add_argument('--limit', type=int, help='maximum number of measurements')
+    for name in TRANSFER_COMMANDS:
+        commands.add_parser(name, help='{} measurements as .npz archives, see `monitor {} --help`'.format(name, name))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    try:
+        if args.command == 'run':
+            stop = Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: stop.set())
+            run(args.config, stop)
+        elif args.command == 'poll':
+            return 1 if poll_once(args.config) else 0
+        else:
+            read(args.config, args.sensor_id, args.start, args.end, args.limit)
+    except (ConfigError, SensorConfigError, OSError) as e:
+        LOG.error('Error during {} - [{}]'.format(args.command, e))
+        return 1
+    return 0
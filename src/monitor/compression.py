@@ -0,0 +1,209 @@
+from array import array
+import struct
+from typing import Sequence, Union
+
+from monitor.serializers import SerializationError
+
+VERSION = 1
+HEADER = struct.Struct('<BBIdd')  # version, flags, count, first timestamp, last timestamp
+MICROSECONDS = 0x01  # timestamps are whole microseconds and stored as delta-of-delta
+
+# prefix, prefix bits and payload bits of the delta-of-delta buckets, after the single 0 bit for a zero delta-of-delta
+TIMESTAMP_BUCKETS = ((0b10, 2, 7), (0b110, 3, 12), (0b1110, 4, 20), (0b1111, 4, 64))
+
+
+class _BitWriter:
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, bits: int) -> None:
+        self._acc = (self._acc << bits) | value
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self.buffer.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self._bits:
+            return bytes(self.buffer) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+class _BitReader:
+    def __init__(self, data: bytes, offset: int) -> None:
+        self._data = data
+        self._pos = offset * 8
+
+    def read(self, bits: int) -> int:
+        pos = self._pos
+        first = pos >> 3
+        last = (pos + bits + 7) >> 3
+        if last > len(self._data):
+            raise SerializationError('Truncated measurement chunk')
+        chunk = int.from_bytes(self._data[first:last], 'big')
+        self._pos = pos + bits
+        return (chunk >> (last * 8 - pos - bits)) & ((1 << bits) - 1)
+
+    def bit(self) -> int:
+        pos = self._pos
+        if (pos >> 3) >= len(self._data):
+            raise SerializationError('Truncated measurement chunk')
+        self._pos = pos + 1
+        return (self._data[pos >> 3] >> (7 - (pos & 7))) & 1
+
+
+def encode_chunk(timestamps: Sequence[float], values: Sequence[float]) -> bytes:
+    '''
+    Compresses measurements of one sensor into a chunk.
+
+    Timestamps that are whole microseconds, as produced by `get_timestamp_now`, are stored as delta-of-delta,
+    which takes a single bit per measurement for readings at a fixed interval. Other timestamps and the values
+    are stored as the XOR with the previous value, which takes a single bit when the value did not change.
+    Decoding returns exactly the encoded floats.
+
+    :param timestamps: timestamps in ascending order
+    :param values: values
+    :return: the chunk
+    '''
+    if len(timestamps) != len(values):
+        raise ValueError('Timestamps and values must have the same length')
+    count = len(timestamps)
+    if count == 0:
+        return HEADER.pack(VERSION, 0, 0, 0.0, 0.0)
+    microseconds = [round(timestamp * 1e6) for timestamp in timestamps]
+    flags = MICROSECONDS if all(us / 1e6 == timestamp for us, timestamp in zip(microseconds, timestamps)) else 0
+
+    writer = _BitWriter()
+    if flags & MICROSECONDS:
+        _write_delta_of_delta(writer, microseconds)
+    else:
+        _write_xor(writer, _float_bits(timestamps))
+    _write_xor(writer, _float_bits(values))
+    return HEADER.pack(VERSION, flags, count, timestamps[0], timestamps[-1]) + writer.getvalue()
+
+
+def decode_chunk(data: bytes) -> tuple['array[float]', 'array[float]']:
+    '''
+    Decompresses a chunk.
+
+    :param data: chunk created by `encode_chunk`
+    :return: timestamps and values
+    raises: SerializationError
+    '''
+    _, flags, count, first, _ = _header(data)
+    timestamps: 'array[float]' = array('d')
+    values: 'array[float]' = array('d')
+    if count == 0:
+        return timestamps, values
+    reader = _BitReader(data, HEADER.size)
+    if flags & MICROSECONDS:
+        timestamps.extend(us / 1e6 for us in _read_delta_of_delta(reader, round(first * 1e6), count))
+    else:
+        timestamps.frombytes(_read_xor(reader, count).tobytes())
+    values.frombytes(_read_xor(reader, count).tobytes())
+    return timestamps, values
+
+
+def chunk_range(data: bytes) -> tuple[float, float, int]:
+    '''
+    Returns the first and last timestamp and the number of measurements of a chunk without decoding it.
+
+    :param data: chunk created by `encode_chunk`
+    :return: first timestamp, last timestamp and count
+    '''
+    _, _, count, first, last = _header(data)
+    return first, last, count
+
+
+def _header(data: Union[bytes, bytearray]) -> tuple[int, int, int, float, float]:
+    if len(data) < HEADER.size or data[0] != VERSION:
+        raise SerializationError('Unsupported measurement chunk format [{!r}]'.format(bytes(data[:1])))
+    version, flags, count, first, last = HEADER.unpack_from(data)
+    return version, flags, count, first, last
+
+
+def _float_bits(floats: Sequence[float]) -> 'array[int]':
+    bits: 'array[int]' = array('Q')
+    bits.frombytes(array('d', floats).tobytes())
+    return bits
+
+
+def _write_delta_of_delta(writer: _BitWriter, microseconds: list[int]) -> None:
+    previous = microseconds[0]
+    previous_delta = 0
+    for current in microseconds[1:]:
+        delta = current - previous
+        dod = delta - previous_delta
+        previous = current
+        previous_delta = delta
+        if dod == 0:
+            writer.write(0, 1)
+            continue
+        zigzag = dod * 2 if dod > 0 else -dod * 2 - 1
+        for prefix, prefix_bits, bits in TIMESTAMP_BUCKETS:
+            if zigzag < (1 << bits):
+                writer.write(prefix, prefix_bits)
+                writer.write(zigzag, bits)
+                break
+        else:
+            raise ValueError('Timestamps are too far apart to compress')
+
+
+def _read_delta_of_delta(reader: _BitReader, first: int, count: int) -> list[int]:
+    result = [first]
+    previous = first
+    delta = 0
+    for _ in range(count - 1):
+        if reader.bit():
+            for bits in (7, 12, 20):
+                if not reader.bit():
+                    break
+            else:
+                bits = 64
+            zigzag = reader.read(bits)
+            delta += (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1)
+        previous += delta
+        result.append(previous)
+    return result
+
+
+def _write_xor(writer: _BitWriter, bits: 'array[int]') -> None:
+    previous = bits[0]
+    writer.write(previous, 64)
+    leading = trailing = -1
+    for current in bits[1:]:
+        xor = current ^ previous
+        previous = current
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        current_leading = min(64 - xor.bit_length(), 31)
+        current_trailing = (xor & -xor).bit_length() - 1
+        if leading >= 0 and current_leading >= leading and current_trailing >= trailing:
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+            continue
+        leading = current_leading
+        trailing = current_trailing
+        meaningful = 64 - leading - trailing
+        writer.write(0b11, 2)
+        writer.write(leading, 5)
+        writer.write(meaningful - 1, 6)
+        writer.write(xor >> trailing, meaningful)
+
+
+def _read_xor(reader: _BitReader, count: int) -> 'array[int]':
+    previous = reader.read(64)
+    result: 'array[int]' = array('Q', [previous])
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if reader.bit():
+            if reader.bit():
+                leading = reader.read(5)
+                trailing = 64 - leading - (reader.read(6) + 1)
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        result.append(previous)
+    return result
@@ -1,7 +1,15 @@
 import logging
-from threading import Thread
+from pathlib import Path
+from threading import Event, RLock, Thread
 import time
+from typing import Iterable, Optional
 
+from monitor.buffer import BLOCK, QueuedRepository
+from monitor.metrics import MetricsRegistry
+from monitor.policy import PollingPolicy
+from monitor.rules import RuleEngine
+from monitor.spool import SpoolingRepository
+from monitor.scheduler import PollMetrics, PollingScheduler, next_deadline
 from monitor.sensors import AbstractSensor
 from monitor.repository import AbstractRepository
 
@@ -12,34 +20,132 @@ class Controller:
     '''
     Controller for sensors.
     '''
-    def __init__(self, repo: AbstractRepository):
+    def __init__(
+            self, repo: AbstractRepository, batch_size: int = 100, flush_interval: float = 1.0, max_workers: Optional[int] = None,
+            metrics: Optional[MetricsRegistry] = None, policy: Optional[PollingPolicy] = None, queue_size: int = 10000,
+            overflow: str = BLOCK, spill_path: Optional[Path] = None, writers: int = 1,
+            rules: Optional[RuleEngine] = None, spool_path: Optional[Path] = None
+            ):
+        '''
+        Initializes a new Controller.
+
+        :param repo: repository measurements are written to
+        :param batch_size: number of buffered measurements that triggers a write to the repository
+        :param flush_interval: maximum seconds a measurement is buffered before it is written
+        :param max_workers: poll sensors from a single scheduler with this many worker threads,
+            by default every sensor is polled in its own thread
+        :param metrics: registry the controller records its metrics in, a new one by default
+        :param policy: decides which measurements are stored and how often sensors are polled,
+            by default every measurement is stored and sensors are polled at their polling interval
+        :param queue_size: number of measurements waiting to be written before the overflow policy applies
+        :param overflow: what to do when the write queue is full, `block`, `drop-oldest` or `spill`
+        :param spill_path: file measurements are spilled to by the `spill` overflow policy
+        :param writers: number of threads writing measurements to the repository
+        :param rules: rule engine every measurement is handed to, including measurements the policy does not store
+        :param spool_path: directory measurements are spooled to while the repository is down or slow, and replayed from
+        '''
         self.repo = repo
+        self.max_workers = max_workers
+        self.metrics = MetricsRegistry() if metrics is None else metrics
+        self.policy = PollingPolicy() if policy is None else policy
+        self.rules = rules
+        self.running = False
+        self._spool = None if spool_path is None else SpoolingRepository(repo, spool_path, batch_size, metrics=self.metrics)
+        self._queue = QueuedRepository(
+            repo if self._spool is None else self._spool, queue_size, batch_size, flush_interval, writers, overflow, spill_path, metrics=self.metrics
+            )
 
-        self._sensors: list[AbstractSensor] = []
-        self._polling_threads: list[Thread] = []
+        self._sensors: dict[str, AbstractSensor] = {}
+        self._polling_threads: dict[str, tuple[Thread, Event]] = {}
+        self._lock = RLock()
+        self._scheduler: Optional[PollingScheduler] = None
+        self._stop_event = Event()
+
+        self._poll_metrics = PollMetrics(self.metrics)
+        self._polls = self.metrics.counter('monitor_polls_total', 'Measurements taken', ['sensor_id'])
+        self._poll_errors = self.metrics.counter('monitor_poll_errors_total', 'Failed measurements', ['sensor_id'])
+        self._overruns = self.metrics.counter(
+            'monitor_poll_overruns_total', 'Measurements that took longer than the polling interval', ['sensor_id']
+            )
+        self._suppressed = self.metrics.counter(
+            'monitor_measurements_suppressed_total', 'Measurements not stored because the value did not change', ['sensor_id']
+            )
+        self._measurement_seconds = self.metrics.histogram(
+            'monitor_measurement_seconds', 'Seconds taken to read a measurement from a sensor', ['sensor_id']
+            )
+        self.metrics.gauge('monitor_sensors', 'Sensors registered with the controller').set_function(lambda: len(self._sensors))
 
     @property
-    def sensors(self):
-        return self._sensors
+    def sensors(self) -> list[AbstractSensor]:
+        return list(self._sensors.values())
+
+    def get_sensor(self, sensor_id: str) -> Optional[AbstractSensor]:
+        '''
+        Returns the sensor with an id, or None if it was not added.
+        :param sensor_id: sensor id
+        '''
+        return self._sensors.get(sensor_id)
 
     def add_sensor(self, sensor: AbstractSensor):
         '''
-        Add a sensor to the list of sensors.
+        Add a sensor, replacing a sensor with the same id.
+        While polling the sensor is polled straight away.
         :param sensor: sensor to add
         '''
-        self._sensors.append(sensor)
+        self.add_sensors([sensor], log=False)
         LOG.info('Added sensor - [{}]'.format(sensor.sensor_id))
 
+    def add_sensors(self, sensors: Iterable[AbstractSensor], log: bool = True):
+        '''
+        Add many sensors at once, replacing sensors with the same ids.
+        While polling the sensors are polled straight away, sensors added again keep their schedule.
+        :param sensors: sensors to add
+        :param log: log the number of sensors added
+        '''
+        sensors = list(sensors)
+        with self._lock:
+            added = [sensor for sensor in sensors if self._sensors.get(sensor.sensor_id) is not sensor]
+            replaced = [self._sensors[sensor.sensor_id] for sensor in added if sensor.sensor_id in self._sensors]
+            if replaced:
+                self._stop_sensors(replaced)
+            for sensor in added:
+                self._sensors[sensor.sensor_id] = sensor
+            if self.rules is not None:
+                self.rules.watch(sensors)
+            if self.running:
+                self._start_sensors(added)
+        if log:
+            LOG.info('Added [{}] sensors'.format(len(sensors)))
+
     def remove_sensor(self, sensor: AbstractSensor):
         '''
-        Remove a sensor from the list of sensors.
+        Remove a sensor.
         :param sensor: sensor to remove
         '''
-        try:
-            self._sensors.remove(sensor)
-            LOG.info('Removed sensor - [{}]'.format(sensor.sensor_id))
-        except ValueError:
+        if not self.remove_sensors([sensor], log=False):
             LOG.error('Sensor not found - [{}]'.format(sensor.sensor_id))
+            return
+        LOG.info('Removed sensor - [{}]'.format(sensor.sensor_id))
+
+    def remove_sensors(self, sensors: Iterable[AbstractSensor], log: bool = True) -> int:
+        '''
+        Remove many sensors at once. While polling, polls in progress are allowed to finish.
+        :param sensors: sensors to remove
+        :param log: log the number of sensors removed
+        :return: number of sensors removed
+        '''
+        with self._lock:
+            removed = [self._sensors.pop(sensor.sensor_id) for sensor in sensors if sensor.sensor_id in self._sensors]
+            self._stop_sensors(removed)
+        for sensor in removed:
+            for metric in (self._polls, self._poll_errors, self._overruns, self._suppressed, self._measurement_seconds):
+                metric.remove(sensor.sensor_id)
+            self.policy.reset(sensor.sensor_id)
+        if self.rules is not None:
+            self.rules.forget(sensor.sensor_id for sensor in removed)
+        if log:
+            LOG.info('Removed [{}] sensors'.format(len(removed)))
+        return len(removed)
 
     def start_polling(self, polling_interval: float = 2):
         '''
@@ -47,33 +153,121 @@ class Controller:
         :param polling_interval: polling interval in seconds
         '''
         LOG.info('Starting polling sensors with interval - [{}]'.format(polling_interval))
-        self.running = True
-        for sensor in self._sensors:
-            t = Thread(target=self.poll_sensor, args=(sensor,))
+        with self._lock:
+            self.running = True
+            self._stop_event.clear()
+            if self._spool is not None:
+                self._spool.start()
+            self._queue.start()
+            if self.rules is not None:
+                self.rules.start()
+            if self.max_workers is not None:
+                self._scheduler = PollingScheduler(self.take_measurement, self.max_workers, self.metrics, self.policy.interval)
+                self._scheduler.start()
+            self._start_sensors(self._sensors.values())
+
+    def _start_sensors(self, sensors: Iterable[AbstractSensor]):
+        if self._scheduler is not None:
+            for sensor in sensors:
+                self._scheduler.add_sensor(sensor)
+            return
+        for sensor in sensors:
+            stop = Event()
+            t = Thread(target=self.poll_sensor, args=(sensor, stop))
             t.start()
-            self._polling_threads.append(t)
+            self._polling_threads[sensor.sensor_id] = (t, stop)
+
+    def _stop_sensors(self, sensors: list[AbstractSensor]):
+        '''
+        Stops polling sensors and closes each one once no poll of it is in progress, so no device file is left open.
+        '''
+        if self._scheduler is not None:
+            for sensor in sensors:
+                self._scheduler.remove_sensor(sensor, self._close_sensor)
+            return
+        threads = [self._polling_threads.pop(sensor.sensor_id) for sensor in sensors if sensor.sensor_id in self._polling_threads]
+        for _, stop in threads:
+            stop.set()
+        self._queue.wake()  # pollers waiting for room in a full queue
+        for t, _ in threads:
+            t.join()
+        for sensor in sensors:
+            self._close_sensor(sensor)
+
+    @staticmethod
+    def _close_sensor(sensor: AbstractSensor):
+        try:
+            sensor.close()
+        except Exception as e:
+            LOG.error('Error closing sensor - [{}] - [{}]'.format(sensor.sensor_id, e))
 
-    def poll_sensor(self, sensor: AbstractSensor):
+    def poll_sensor(self, sensor: AbstractSensor, stop: Optional[Event] = None):
         '''
         Poll sensors in a separate thread.
-        :param polling_interval: polling interval in seconds
+
+        Polls are kept on a grid of the interval chosen by the polling policy. If a measurement takes longer
+        than the interval the missed polls are skipped.
+        :param sensor: sensor to poll
+        :param stop: event ending the polling of this sensor, besides `stop_polling`
+        '''
+        stop = self._stop_event if stop is None else stop
+        deadline = time.monotonic()
+        while self.running and not stop.is_set():
+            started = time.monotonic()
+            try:
+                self.take_measurement(sensor, stop)
+            except Exception as e:
+                LOG.error('Error polling sensor - [{}] - [{}]'.format(sensor.sensor_id, e))
+            interval = self.policy.interval(sensor)
+            following = next_deadline(deadline, interval, time.monotonic())
+            self._poll_metrics.record(sensor.sensor_id, deadline, started, following, interval)
+            deadline = following
+            stop.wait(max(0.0, deadline - time.monotonic()))
+
+    def take_measurement(self, sensor: AbstractSensor, stop: Optional[Event] = None):
+        '''
+        Take a single measurement from a sensor and queue it for the repository if the polling policy stores it.
+        :param sensor: sensor to measure
+        :param stop: event ending the polling of this sensor, besides `stop_polling`. Once either is set the measurement
+            is queued without waiting for room in a full queue
         '''
-        polling_interval = sensor.polling_interval
-        while True and self.running:
-            LOG.info('Polling sensor - [{}] with interval - [{}]'.format(sensor.sensor_id, polling_interval))
-            start = time.time()
+        sensor_id = sensor.sensor_id
+        LOG.debug('Polling sensor - [%s] with interval - [%s]', sensor_id, sensor.polling_interval)
+        start = time.perf_counter()
+        try:
             measurement = sensor.get_measurement()
-            stop = time.time()
-            self.repo.add_measurement(measurement)
-            time.sleep(polling_interval - (stop - start))
+        except Exception:
+            self._poll_errors.labels(sensor_id).inc()
+            raise
+        elapsed = time.perf_counter() - start
+        self._polls.labels(sensor_id).inc()
+        self._measurement_seconds.labels(sensor_id).observe(elapsed)
+        if elapsed > sensor.polling_interval:
+            self._overruns.labels(sensor_id).inc()
+        if self.rules is not None:
+            self.rules.submit(sensor, measurement)
+        if self.policy.observe(sensor, measurement).store:
+            self._queue.add_measurements([measurement], self._stop_event if stop is None else stop)
+        else:
+            self._suppressed.labels(sensor_id).inc()
 
     def stop_polling(self):
         '''
-        Stop polling sensors.
+        Stop polling sensors and close them.
         '''
-        self.running = False
-        LOG.info('Stopping polling sensors')
-        for t in self._polling_threads:
-            t.join()
-        self._polling_threads = []
+        with self._lock:
+            self.running = False
+            self._stop_event.set()
+            self._queue.wake()
+            LOG.info('Stopping polling sensors')
+            if self._scheduler is not None:
+                self._scheduler.stop()
+                self._scheduler = None
+            self._stop_sensors(list(self._sensors.values()))
+            self._polling_threads = {}
+            self._queue.stop()
+            if self._spool is not None:
+                self._spool.stop()
+            if self.rules is not None:
+                self.rules.stop()
         LOG.info('Polling sensors stopped')
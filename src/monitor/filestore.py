@@ -0,0 +1,265 @@
+from array import array
+import bisect
+from collections import OrderedDict
+import logging
+import math
+import mmap
+import os
+from pathlib import Path
+from threading import RLock
+from typing import Iterable, NamedTuple, Optional, Sequence
+from urllib.parse import quote, unquote
+
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.repository import AbstractRepository
+
+LOG = logging.getLogger('monitor_logger')
+
+RECORD_SIZE = 16  # timestamp and value as little endian doubles
+SEGMENT_SUFFIX = '.seg'
+
+
+class Segment(NamedTuple):
+    '''
+    A memory-mapped segment file and its sparse timestamp index.
+    '''
+    timestamps: Sequence[float]
+    values: Sequence[float]
+    sparse_index: list[float]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+class FileRepository(AbstractRepository):
+    '''
+    Repository storing measurements in local append-only files.
+
+    Every sensor has one segment file per time window holding (timestamp, value) records as doubles, ordered by
+    timestamp. Writes are buffered and appended in batches. Reads memory-map the segments and use a sparse
+    timestamp index to binary search the requested range, returning views over the map rather than copies.
+    The maps of the most recently read segments are kept open, up to `max_open_segments`.
+    '''
+    def __init__(
+            self, root: Path, window: float = 86400.0, buffer_size: int = 1000, index_interval: int = 1024, fsync: bool = False,
+            max_open_segments: int = 64
+            ) -> None:
+        '''
+        Initializes a new FileRepository.
+
+        :param root: directory holding the segment files
+        :param window: seconds of measurements per segment, a whole number as segments are named after the second
+            their window starts at
+        :param buffer_size: number of buffered measurements that triggers a write to disk
+        :param index_interval: number of records between entries of the sparse timestamp index
+        :param fsync: fsync segment files after every write
+        :param max_open_segments: number of segment maps kept open between reads, each holds a file descriptor
+        raises: ValueError if the window is not a positive whole number of seconds
+        '''
+        if window < 1 or window != int(window):
+            raise ValueError('Window must be a positive whole number of seconds, got [{}]'.format(window))
+        self.root = Path(root)
+        self.window = window
+        self.buffer_size = buffer_size
+        self.index_interval = index_interval
+        self.fsync = fsync
+        self.max_open_segments = max_open_segments
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._pending: 'dict[Path, array[float]]' = {}
+        self._pending_count = 0
+        self._segments: 'OrderedDict[Path, Segment]' = OrderedDict()
+        self._lock = RLock()
+
+    def add_measurement(self, measurement: Measurement) -> None:
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        with self._lock:
+            for measurement in measurements:
+                path = self._segment_path(measurement.sensor_id, measurement.timestamp)
+                records = self._pending.get(path)
+                if records is None:
+                    records = self._pending[path] = array('d')
+                records.append(measurement.timestamp)
+                records.append(measurement.value)
+                self._pending_count += 1
+            if self._pending_count >= self.buffer_size:
+                self.flush()
+
+    def flush(self) -> None:
+        '''
+        Appends all buffered measurements to their segment files.
+        '''
+        with self._lock:
+            for path in list(self._pending):
+                self._flush_segment(path)
+
+    def close(self) -> None:
+        '''
+        Flushes buffered measurements and releases the memory maps.
+        '''
+        self.flush()
+        with self._lock:
+            self._segments = OrderedDict()
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        return list(self.get_measurement_batch(sensor_id, start, end, limit))
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        '''
+        Returns the measurements of a sensor ordered by timestamp as a columnar batch.
+
+        When the range lies within one segment the batch columns are views over the memory map.
+
+        :param sensor_id: sensor id
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param limit: maximum number of measurements to return
+        :return: a batch
+        '''
+        with self._lock:
+            views = []
+            remaining = limit
+            for path in self._segment_paths(sensor_id, start, end):
+                if remaining is not None and remaining <= 0:
+                    break
+                if path in self._pending:
+                    self._flush_segment(path)
+                segment = self._segment(path)
+                if segment is None:
+                    continue
+                lo = 0 if start is None else self._bisect(segment, start, left=True)
+                hi = len(segment) if end is None else self._bisect(segment, end, left=False)
+                if remaining is not None:
+                    hi = min(hi, lo + remaining)
+                    remaining -= max(0, hi - lo)
+                if hi > lo:
+                    views.append((segment.timestamps[lo:hi], segment.values[lo:hi]))
+        if len(views) == 1:
+            return MeasurementBatch.from_columns(sensor_id, views[0][0], views[0][1])
+        timestamps = array('d')
+        values = array('d')
+        for segment_timestamps, segment_values in views:
+            timestamps.extend(segment_timestamps)
+            values.extend(segment_values)
+        return MeasurementBatch.from_columns(sensor_id, timestamps, values)
+
+    def sensor_ids(self) -> list[str]:
+        '''
+        Returns the ids of all sensors with stored measurements.
+        '''
+        with self._lock:
+            pending = {unquote(path.parent.name) for path in self._pending}
+        stored = {unquote(path.name) for path in self.root.iterdir() if path.is_dir()}
+        return sorted(pending | stored)
+
+    def _segment_path(self, sensor_id: str, timestamp: float) -> Path:
+        window_start = int(math.floor(timestamp / self.window) * self.window)
+        return self.root / quote(sensor_id, safe='') / '{}{}'.format(window_start, SEGMENT_SUFFIX)
+
+    def _segment_paths(self, sensor_id: str, start: Optional[float], end: Optional[float]) -> list[Path]:
+        directory = self.root / quote(sensor_id, safe='')
+        paths = set(path for path in self._pending if path.parent == directory)
+        if directory.is_dir():
+            paths.update(directory.glob('*{}'.format(SEGMENT_SUFFIX)))
+        selected = []
+        for path in paths:
+            window_start = int(path.name[:-len(SEGMENT_SUFFIX)])
+            if end is not None and window_start > end:
+                continue
+            if start is not None and window_start + self.window <= start:
+                continue
+            selected.append((window_start, path))
+        return [path for _, path in sorted(selected)]
+
+    def _flush_segment(self, path: Path) -> None:
+        records = self._pending.pop(path)
+        self._pending_count -= len(records) // 2
+        self._segments.pop(path, None)  # remapped on the next read, existing views keep the old map alive
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        pairs = sorted(zip(records[0::2], records[1::2]), key=lambda pair: pair[0])
+        last = self._last_timestamp(path)
+        if last is not None and pairs[0][0] < last:
+            LOG.info('Rewriting segment [{}] for out of order measurements'.format(path))
+            with open(path, 'rb') as f:
+                stored = array('d', f.read())
+            pairs = sorted(list(zip(stored[0::2], stored[1::2])) + pairs, key=lambda pair: pair[0])
+            self._write(path.with_suffix('.tmp'), pairs, 'wb')
+            os.replace(path.with_suffix('.tmp'), path)
+        else:
+            self._write(path, pairs, 'ab')
+
+    def _write(self, path: Path, pairs: list[tuple[float, float]], mode: str) -> None:
+        records = array('d')
+        for timestamp, value in pairs:
+            records.append(timestamp)
+            records.append(value)
+        with open(path, mode) as f:
+            f.write(records.tobytes())
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _last_timestamp(self, path: Path) -> Optional[float]:
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return None
+        if size % RECORD_SIZE:
+            LOG.error('Truncating partial record at the end of segment [{}]'.format(path))
+            size -= size % RECORD_SIZE
+            os.truncate(path, size)
+        if size == 0:
+            return None
+        with open(path, 'rb') as f:
+            f.seek(size - RECORD_SIZE)
+            return array('d', f.read(RECORD_SIZE))[0]
+
+    def _segment(self, path: Path) -> Optional[Segment]:
+        segment = self._segments.get(path)
+        if segment is not None:
+            self._segments.move_to_end(path)
+            return segment
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % RECORD_SIZE
+                if size == 0:
+                    return None
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        records = memoryview(mapped).cast('d')
+        timestamps = records[0::2]
+        segment = Segment(timestamps, records[1::2], [timestamps[i] for i in range(0, len(timestamps), self.index_interval)])
+        self._segments[path] = segment
+        if len(self._segments) > self.max_open_segments:
+            self._segments.popitem(last=False)  # closed once batches viewing it are released
+        return segment
+
+    def _bisect(self, segment: Segment, timestamp: float, left: bool) -> int:
+        '''
+        Returns the position of a timestamp in a segment, like `bisect_left` or `bisect_right`.
+
+        The sparse index narrows the search to one block so only a few pages of the map are touched.
+        '''
+        if left:
+            block = bisect.bisect_left(segment.sparse_index, timestamp) - 1
+        else:
+            block = bisect.bisect_right(segment.sparse_index, timestamp) - 1
+        lo = max(0, block * self.index_interval)
+        hi = min(len(segment), (block + 1) * self.index_interval + 1)
+        timestamps = segment.timestamps
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if timestamps[mid] < timestamp or (not left and timestamps[mid] == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
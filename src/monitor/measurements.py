@@ -1,4 +1,6 @@
+from array import array
 from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, Optional, Sequence, Union, overload
 
 
 @dataclass
@@ -6,6 +8,173 @@ class Measurement:
     '''
     A measurement is a single reading from a sensor.
     '''
+    __slots__ = ('sensor_id', 'timestamp', 'value')
+
     sensor_id: str
     timestamp: float
     value: float
+
+
+class MeasurementBatch(Sequence[Measurement]):
+    '''
+    A batch of measurements stored as columns.
+
+    Timestamps and values are kept in `array('d')` buffers (or any buffer of doubles, such as a memoryview)
+    and sensor ids are dictionary encoded, so large reads do not allocate an object per measurement.
+    Indexing and iterating still produce `Measurement` objects.
+    '''
+    def __init__(self, measurements: Iterable[Measurement] = ()) -> None:
+        '''
+        Initializes a new MeasurementBatch.
+
+        :param measurements: measurements to add to the batch
+        '''
+        self.dictionary: list[str] = []
+        self.codes: Optional[Sequence[int]] = array('I')
+        self.timestamps: Sequence[float] = array('d')
+        self.values: Sequence[float] = array('d')
+
+        self._code_of: dict[str, int] = {}
+        self.extend(measurements)
+
+    @classmethod
+    def from_columns(
+            cls, sensor_ids: Union[str, Sequence[str]], timestamps: Sequence[float], values: Sequence[float]
+            ) -> 'MeasurementBatch':
+        '''
+        Creates a batch from existing columns without copying them.
+
+        :param sensor_ids: sensor id shared by every row, or one sensor id per row
+        :param timestamps: buffer of timestamps
+        :param values: buffer of values
+        :return: a batch
+        '''
+        if len(timestamps) != len(values):
+            raise ValueError('Timestamps and values must have the same length')
+        batch = cls()
+        batch.timestamps = timestamps
+        batch.values = values
+        if isinstance(sensor_ids, str):
+            batch._code(sensor_ids)
+            batch.codes = None
+        else:
+            if len(sensor_ids) != len(timestamps):
+                raise ValueError('Sensor ids and timestamps must have the same length')
+            batch.codes = array('I', (batch._code(sensor_id) for sensor_id in sensor_ids))
+        return batch
+
+    def append(self, measurement: Measurement) -> None:
+        '''
+        Adds a measurement to the end of the batch.
+
+        :param measurement: measurement to add
+        '''
+        self.append_values(measurement.sensor_id, measurement.timestamp, measurement.value)
+
+    def append_values(self, sensor_id: str, timestamp: float, value: float) -> None:
+        '''
+        Adds a measurement to the end of the batch without creating a `Measurement`.
+
+        :param sensor_id: sensor id
+        :param timestamp: timestamp
+        :param value: value
+        '''
+        self._ensure_mutable()
+        self.codes.append(self._code(sensor_id))  # type: ignore
+        self.timestamps.append(timestamp)  # type: ignore
+        self.values.append(value)  # type: ignore
+
+    def extend(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Adds measurements to the end of the batch.
+
+        :param measurements: measurements to add
+        '''
+        for measurement in measurements:
+            self.append(measurement)
+
+    def sensor_id(self, index: int) -> str:
+        '''
+        Returns the sensor id of a row.
+
+        :param index: row index
+        :return: sensor id
+        '''
+        if self.codes is None:
+            self.timestamps[index]  # raise IndexError for rows that do not exist
+            return self.dictionary[0]
+        return self.dictionary[self.codes[index]]
+
+    def to_numpy(self) -> dict[str, Any]:
+        '''
+        Returns the columns as NumPy arrays. The arrays share memory with the batch.
+
+        :return: dict with `codes`, `timestamps` and `values` arrays
+        '''
+        import numpy as np
+
+        codes = np.zeros(len(self), dtype=np.uint32) if self.codes is None else np.asarray(self.codes, dtype=np.uint32)
+        return {
+            'codes': codes,
+            'timestamps': np.asarray(self.timestamps, dtype=np.float64),
+            'values': np.asarray(self.values, dtype=np.float64),
+            }
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @overload
+    def __getitem__(self, index: int) -> Measurement: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> 'MeasurementBatch': ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Measurement, 'MeasurementBatch']:
+        if isinstance(index, slice):
+            batch = MeasurementBatch()
+            batch.dictionary = list(self.dictionary)
+            batch._code_of = dict(self._code_of)
+            batch.codes = None if self.codes is None else self.codes[index]
+            batch.timestamps = self.timestamps[index]
+            batch.values = self.values[index]
+            return batch
+        return Measurement(self.sensor_id(index), self.timestamps[index], self.values[index])
+
+    def __iter__(self) -> Iterator[Measurement]:
+        dictionary = self.dictionary
+        if self.codes is None:
+            sensor_id = dictionary[0] if dictionary else ''
+            for timestamp, value in zip(self.timestamps, self.values):
+                yield Measurement(sensor_id, timestamp, value)
+            return
+        for code, timestamp, value in zip(self.codes, self.timestamps, self.values):
+            yield Measurement(dictionary[code], timestamp, value)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (MeasurementBatch, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return 'MeasurementBatch(<{} measurements>)'.format(len(self))
+
+    def _code(self, sensor_id: str) -> int:
+        code = self._code_of.get(sensor_id)
+        if code is None:
+            code = len(self.dictionary)
+            self.dictionary.append(sensor_id)
+            self._code_of[sensor_id] = code
+        return code
+
+    def _ensure_mutable(self) -> None:
+        '''
+        Copies columns created by `from_columns` or slicing into arrays so they can be appended to.
+        '''
+        if self.codes is None:
+            self.codes = array('I', [0]) * len(self)
+        if not isinstance(self.codes, array):
+            self.codes = array('I', self.codes)
+        if not isinstance(self.timestamps, array):
+            self.timestamps = array('d', self.timestamps)
+        if not isinstance(self.values, array):
+            self.values = array('d', self.values)
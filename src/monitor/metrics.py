@@ -0,0 +1,410 @@
+import bisect
+from contextlib import contextmanager
+import logging
+import math
+from threading import Lock, Thread
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, NamedTuple, Optional, Sequence, TypeVar, Union
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+LOG = logging.getLogger('monitor_logger')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Sample(NamedTuple):
+    '''
+    A single value of a metric.
+    '''
+    name: str
+    labels: dict[str, str]
+    value: float
+
+
+class CounterChild:
+    '''
+    A counter for one set of label values.
+    '''
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        '''
+        Increments the counter.
+
+        :param amount: amount to add, must not be negative
+        '''
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        with self._lock:
+            self.value += amount
+
+
+class GaugeChild:
+    '''
+    A gauge for one set of label values.
+    '''
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = Lock()
+
+    @property
+    def value(self) -> float:
+        function = self._function
+        return float(function()) if function is not None else self._value
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        '''
+        Reads the value from a callable when the gauge is collected, e.g. the length of a queue.
+
+        :param function: callable returning the current value
+        '''
+        self._function = function
+
+
+class HistogramChild:
+    '''
+    A histogram for one set of label values.
+    '''
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        '''
+        Records a value.
+
+        :param value: value to record, e.g. a duration in seconds
+        '''
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        '''
+        Records the duration of a block in seconds.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+Child = Union[CounterChild, GaugeChild, HistogramChild]
+
+
+class Metric:
+    '''
+    A named metric with optional labels.
+
+    Every combination of label values has its own child holding the value, created on first use by `labels`.
+    Metrics without labels can be updated directly.
+    '''
+    TYPE = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._children: dict[tuple[str, ...], Any] = {}
+        self._lock = Lock()
+
+    def labels(self, *values: str) -> Any:
+        '''
+        Returns the child of a combination of label values.
+
+        :param values: label values, in the order of the label names
+        :return: child metric
+        '''
+        child = self._children.get(values)
+        if child is not None:
+            return child
+        if len(values) != len(self.labelnames):
+            raise ValueError('Metric [{}] expects labels {}'.format(self.name, self.labelnames))
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def remove(self, *values: str) -> None:
+        '''
+        Removes the child of a combination of label values, e.g. for a sensor that was removed.
+        '''
+        with self._lock:
+            self._children.pop(values, None)
+
+    def collect(self) -> list[Sample]:
+        '''
+        Returns the current values of the metric.
+        '''
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for values, child in sorted(children, key=lambda item: item[0]):
+            samples.extend(self._samples(dict(zip(self.labelnames, values)), child))
+        return samples
+
+    def _new_child(self) -> Child:
+        raise NotImplementedError()
+
+    def _samples(self, labels: dict[str, str], child: Any) -> list[Sample]:
+        return [Sample(self.name, labels, child.value)]
+
+
+class Counter(Metric):
+    '''
+    A value that only goes up, such as the number of polls.
+    '''
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+
+class Gauge(Metric):
+    '''
+    A value that goes up and down, such as a queue depth.
+    '''
+    TYPE = 'gauge'
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    '''
+    Counts values in buckets, such as latencies.
+    '''
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> Any:
+        return self.labels().time()
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def _samples(self, labels: dict[str, str], child: Any) -> list[Sample]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), list(child.counts)):
+            cumulative += count
+            samples.append(Sample(self.name + '_bucket', dict(labels, le=_format_value(bound)), cumulative))
+        samples.append(Sample(self.name + '_sum', labels, child.sum))
+        samples.append(Sample(self.name + '_count', labels, child.count))
+        return samples
+
+
+M = TypeVar('M', bound=Metric)
+
+
+class MetricsRegistry:
+    '''
+    Registry of counters, gauges and histograms.
+
+    Metrics are created on first use and returned again for the same name, so independent components can
+    share a metric. Values are read with `collect` or rendered in the Prometheus text format with `exposition`.
+    '''
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = Lock()
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        '''
+        Returns the counter with a name, creating it if needed.
+
+        :param name: metric name
+        :param help: description of the metric
+        :param labelnames: label names
+        :return: a counter
+        '''
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        '''
+        Returns the gauge with a name, creating it if needed.
+
+        :param name: metric name
+        :param help: description of the metric
+        :param labelnames: label names
+        :return: a gauge
+        '''
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        '''
+        Returns the histogram with a name, creating it if needed.
+
+        :param name: metric name
+        :param help: description of the metric
+        :param labelnames: label names
+        :param buckets: upper bounds of the buckets
+        :return: a histogram
+        '''
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def get(self, name: str) -> Optional[Metric]:
+        '''
+        Returns the metric with a name, or None if it does not exist.
+        '''
+        return self._metrics.get(name)
+
+    def collect(self) -> list[Sample]:
+        '''
+        Returns the current values of every metric.
+        '''
+        samples = []
+        for metric in self._sorted_metrics():
+            samples.extend(metric.collect())
+        return samples
+
+    def exposition(self) -> str:
+        '''
+        Returns every metric in the Prometheus text exposition format.
+        '''
+        lines = []
+        for metric in self._sorted_metrics():
+            lines.append('# HELP {} {}'.format(metric.name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            for sample in metric.collect():
+                lines.append('{}{} {}'.format(sample.name, _format_labels(sample.labels), _format_value(sample.value)))
+        return '\n'.join(lines) + '\n'
+
+    def _get_or_create(self, cls: 'type[M]', name: str, help: str, labelnames: Sequence[str], **kwargs: Any) -> M:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            if not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError('Metric [{}] is already registered as a different metric'.format(name))
+            return metric
+
+    def _sorted_metrics(self) -> list[Metric]:
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+
+class MetricsServer:
+    '''
+    Serves the metrics of a registry over HTTP from a background thread, for Prometheus to scrape.
+    '''
+    def __init__(self, registry: MetricsRegistry, port: int = 9100, host: str = '127.0.0.1') -> None:
+        '''
+        Initializes a new MetricsServer.
+
+        :param registry: registry to serve
+        :param port: port to listen on, 0 picks a free port
+        :param host: address to listen on
+        '''
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+        self._server: Optional['ThreadingHTTPServer'] = None
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        '''
+        Start serving `/metrics`.
+        '''
+        if self._server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                LOG.debug('Metrics request - %s', format % args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever, name='monitor-metrics', daemon=True)
+        self._thread.start()
+        LOG.info('Serving metrics on [{}:{}]'.format(self.host, self.port))
+
+    def stop(self) -> None:
+        '''
+        Stop serving and close the socket.
+        '''
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self._server = None
+        self._thread = None
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels.items()
+        )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
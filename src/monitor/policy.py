@@ -0,0 +1,125 @@
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from monitor.measurements import Measurement
+from monitor.sensors import AbstractSensor
+
+
+class Decision(NamedTuple):
+    '''
+    What to do with a measurement and when to poll the sensor next.
+    '''
+    store: bool
+    interval: float
+
+
+class PollingPolicy:
+    '''
+    Polls every sensor at its polling interval and stores every measurement.
+    '''
+
+    def observe(self, sensor: AbstractSensor, measurement: Measurement) -> Decision:
+        '''
+        Decides whether a measurement is stored and how long to wait before the next poll.
+
+        :param sensor: sensor the measurement was taken from
+        :param measurement: the new measurement
+        :return: a decision
+        '''
+        return Decision(True, sensor.polling_interval)
+
+    def interval(self, sensor: AbstractSensor) -> float:
+        '''
+        Returns the current polling interval of a sensor.
+
+        :param sensor: sensor
+        :return: seconds until the next poll
+        '''
+        return sensor.polling_interval
+
+    def reset(self, sensor_id: str) -> None:
+        '''
+        Forgets the state kept for a sensor.
+
+        :param sensor_id: sensor id
+        '''
+        pass
+
+
+class _SensorState:
+    __slots__ = ('value', 'timestamp', 'interval')
+
+    def __init__(self, value: float, timestamp: float, interval: float) -> None:
+        self.value = value
+        self.timestamp = timestamp
+        self.interval = interval
+
+
+class DeadbandPolicy(PollingPolicy):
+    '''
+    Stores a measurement only when it has moved by more than a deadband, and polls stable sensors less often.
+
+    A measurement is stored when it differs from the last stored value of the sensor by more than `deadband`,
+    or when nothing was stored for `max_silence` seconds, so a stable sensor still sends a heartbeat.
+    While a sensor is stable its interval is multiplied by `backoff` after every poll, up to `max_interval`.
+    On a change the interval drops back to `min_interval`, or to the sensor's polling interval if not set.
+    Intervals never go below the sensor's measurement delay.
+    '''
+    def __init__(
+            self, deadband: float = 0.1, max_silence: float = 300.0, max_interval: Optional[float] = None,
+            min_interval: Optional[float] = None, backoff: float = 2.0
+            ) -> None:
+        '''
+        Initializes a new DeadbandPolicy.
+
+        :param deadband: smallest change of value that is stored
+        :param max_silence: maximum seconds between stored measurements of a sensor
+        :param max_interval: longest polling interval of a stable sensor, by default intervals are not adapted
+        :param min_interval: polling interval after a change, the sensor's polling interval by default
+        :param backoff: factor the interval of a stable sensor grows by after every poll
+        '''
+        if deadband < 0:
+            raise ValueError('Deadband cannot be negative')
+        if backoff < 1:
+            raise ValueError('Backoff cannot be less than 1')
+        self.deadband = deadband
+        self.max_silence = max_silence
+        self.max_interval = max_interval
+        self.min_interval = min_interval
+        self.backoff = backoff
+
+        self._states: dict[str, _SensorState] = {}
+        self._lock = Lock()
+
+    def observe(self, sensor: AbstractSensor, measurement: Measurement) -> Decision:
+        state = self._states.get(sensor.sensor_id)
+        fastest = self._fastest(sensor)
+        if state is None:
+            with self._lock:
+                self._states[sensor.sensor_id] = _SensorState(measurement.value, measurement.timestamp, fastest)
+            return Decision(True, fastest)
+
+        changed = abs(measurement.value - state.value) > self.deadband
+        if changed:
+            state.interval = fastest
+        elif self.max_interval is not None:
+            slowest = max(fastest, min(self.max_interval, self.max_silence))
+            state.interval = min(state.interval * self.backoff, slowest)
+
+        store = changed or measurement.timestamp - state.timestamp >= self.max_silence
+        if store:
+            state.value = measurement.value
+            state.timestamp = measurement.timestamp
+        return Decision(store, state.interval)
+
+    def interval(self, sensor: AbstractSensor) -> float:
+        state = self._states.get(sensor.sensor_id)
+        return self._fastest(sensor) if state is None else state.interval
+
+    def reset(self, sensor_id: str) -> None:
+        with self._lock:
+            self._states.pop(sensor_id, None)
+
+    def _fastest(self, sensor: AbstractSensor) -> float:
+        interval = sensor.polling_interval if self.min_interval is None else self.min_interval
+        return max(interval, sensor.measurement_delay)
@@ -1,10 +1,116 @@
 from abc import ABC, abstractmethod
-from dataclasses import asdict
-import json
-from typing import Union
+from array import array
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import logging
+from operator import attrgetter
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, NamedTuple, Optional, Sequence, TypeVar, Union
 
-from monitor.measurements import Measurement
-from redis import Redis  # type: ignore
+from monitor.compression import chunk_range, decode_chunk, encode_chunk
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.serializers import AbstractSerializer, JSONSerializer, SensorIdDictionary
+
+if TYPE_CHECKING:
+    from redis import Redis  # type: ignore
+    from redis.asyncio import Redis as AsyncRedis  # type: ignore
+
+
+MEASUREMENTS_KEY = 'measurements'
+SENSORS_KEY = 'sensors'
+SENSOR_CODES_KEY = 'sensor_codes'
+SENSOR_IDS_KEY = 'sensor_ids'
+SENSOR_CODE_COUNTER_KEY = 'sensor_codes:next'
+PENDING_KEY_PREFIX = 'measurements:pending:'
+CHUNKS_SUFFIX = ':chunks'
+CHUNK_SPAN_SUFFIX = ':chunks:span'
+CHUNK_PAGE = 16
+CLUSTER_SLOTS = 16384
+MAX_READ_WORKERS = 8
+
+LOG = logging.getLogger('monitor_logger')
+
+T = TypeVar('T')
+Page = TypeVar('Page', list[Measurement], MeasurementBatch)
+
+# Chunks of a sensor scored by their last timestamp, from `start` to `end` plus the widest span of any chunk,
+# so chunks ending after `end` that still overlap it are included. Without a recorded span every chunk from `start` on.
+CHUNKS_SCRIPT = '''
+local span = redis.call('GET', KEYS[2])
+local max = ARGV[2]
+if max ~= '+inf' then
+    max = span and string.format('%.17g', tonumber(max) + tonumber(span)) or '+inf'
+end
+return {span or false, redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], max, 'LIMIT', ARGV[3], ARGV[4])}
+'''
+
+
+def _crc16_table() -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC16 = _crc16_table()
+
+
+def sensor_key(sensor_id: str) -> str:
+    '''
+    Returns the key of the sorted set holding the measurements of a sensor.
+
+    The sensor id is wrapped in a hash tag so all keys of one sensor map to the same cluster slot.
+
+    :param sensor_id: sensor id
+    :return: redis key
+    '''
+    return '{}:{{{}}}'.format(MEASUREMENTS_KEY, sensor_id)
+
+
+def chunk_key(sensor_id: str) -> str:
+    '''
+    Returns the key of the sorted set holding the compressed chunks of a sensor, scored by their last timestamp.
+
+    :param sensor_id: sensor id
+    :return: redis key
+    '''
+    return sensor_key(sensor_id) + CHUNKS_SUFFIX
+
+
+def chunk_span_key(sensor_id: str) -> str:
+    '''
+    Returns the key holding the widest span, last minus first timestamp, of the compressed chunks of a sensor.
+
+    :param sensor_id: sensor id
+    :return: redis key
+    '''
+    return sensor_key(sensor_id) + CHUNK_SPAN_SUFFIX
+
+
+def key_slot(key: str) -> int:
+    '''
+    Returns the redis cluster hash slot of a key.
+
+    Like redis cluster, only the part between the first `{` and the following `}` is hashed if it is not empty,
+    so every key of a sensor maps to the same slot.
+
+    :param key: redis key
+    :return: slot between 0 and 16383
+    '''
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    crc = 0
+    for byte in key.encode():
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16[((crc >> 8) ^ byte) & 0xFF]
+    return crc % CLUSTER_SLOTS
 
 
 class AbstractRepository(ABC):
@@ -19,21 +125,880 @@ class AbstractRepository(ABC):
         '''
         pass
 
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Adds a batch of measurements to the repository.
+
+        Repositories that can write a batch in one round-trip should override this.
+        '''
+        for measurement in measurements:
+            self.add_measurement(measurement)
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        '''
+        Returns the measurements of a sensor ordered by timestamp.
+
+        Repositories that can be read from should override this.
+        '''
+        raise NotImplementedError('{} cannot be read from'.format(type(self).__name__))
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        '''
+        Returns the measurements of a sensor ordered by timestamp as a columnar batch.
+
+        Repositories that can fill the columns without creating measurements should override this.
+        '''
+        return MeasurementBatch(self.get_measurements(sensor_id, start, end, limit))
+
+    def sensor_ids(self) -> list[str]:
+        '''
+        Returns the ids of every sensor with stored measurements, in order.
+
+        Repositories that can list their sensors should override this.
+        '''
+        raise NotImplementedError('{} cannot list its sensors'.format(type(self).__name__))
+
+    def get_measurements_many(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> dict[str, list[Measurement]]:
+        '''
+        Returns the measurements of several sensors ordered by timestamp.
+
+        The reads run in parallel on a thread pool. Repositories that can read several sensors in one round-trip
+        should override this.
+
+        :param sensor_ids: sensor ids
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param limit: maximum number of measurements to return per sensor
+        :return: measurements by sensor id
+        '''
+        sensor_ids = list(dict.fromkeys(sensor_ids))
+        if len(sensor_ids) <= 1:
+            return {sensor_id: self.get_measurements(sensor_id, start, end, limit) for sensor_id in sensor_ids}
+        with ThreadPoolExecutor(max_workers=min(MAX_READ_WORKERS, len(sensor_ids)), thread_name_prefix='monitor-read') as executor:
+            results = executor.map(lambda sensor_id: self.get_measurements(sensor_id, start, end, limit), sensor_ids)
+            return dict(zip(sensor_ids, results))
+
+    def iter_measurements(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, chunk_size: int = 1000
+            ) -> Iterator[list[Measurement]]:
+        '''
+        Streams the measurements of several sensors merged in timestamp order, in lists of up to `chunk_size`.
+
+        Sensors are read a page of `chunk_size` measurements at a time, the first pages with `get_measurements_many`,
+        so at most one page per sensor is held in memory.
+
+        :param sensor_ids: sensor ids
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param chunk_size: number of measurements per list and per page read
+        :return: iterator of lists of measurements
+        '''
+        first_pages = self.get_measurements_many(sensor_ids, start, end, chunk_size)
+        streams = [
+            itertools.chain.from_iterable(self._iter_pages(self._page_reader(self.get_measurements, sensor_id, end), page, chunk_size))
+            for sensor_id, page in first_pages.items()
+            ]
+        chunk: list[Measurement] = []
+        for measurement in heapq.merge(*streams, key=attrgetter('timestamp')):
+            chunk.append(measurement)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def iter_measurement_batches(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, page_size: int = 1000
+            ) -> Iterator[MeasurementBatch]:
+        '''
+        Streams the measurements of a sensor ordered by timestamp as columnar batches of up to `page_size`.
+
+        Batches are read one page at a time with `get_measurement_batch`, so only one is held in memory.
+
+        :param sensor_id: sensor id
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param page_size: maximum number of measurements per batch
+        :return: iterator of batches
+        '''
+        read = self._page_reader(self.get_measurement_batch, sensor_id, end)
+        return self._iter_pages(read, read(start, page_size), page_size)
+
+    @staticmethod
+    def _page_reader(
+            read: Callable[[str, Optional[float], Optional[float], Optional[int]], Page], sensor_id: str, end: Optional[float]
+            ) -> Callable[[Optional[float], int], Page]:
+        return lambda start, limit: read(sensor_id, start, end, limit)
+
+    @staticmethod
+    def _iter_pages(read: Callable[[Optional[float], int], Page], page: Page, page_size: int) -> Iterator[Page]:
+        '''
+        Yields the pages of a sensor from a first page on, reading the following pages with `read(start, limit)` as needed.
+
+        A page starts at the last timestamp of the previous one and skips the measurements already yielded at that timestamp.
+        '''
+        skip = 0
+        while True:
+            if len(page) > skip:
+                yield page[skip:]
+            if len(page) < page_size + skip:
+                return
+            last = page[-1].timestamp
+            skip = 0
+            for measurement in reversed(page):
+                if measurement.timestamp != last:
+                    break
+                skip += 1
+            page = read(last, page_size + skip)
+
+    async def async_add_measurement(self, measurement: Measurement) -> None:
+        '''
+        Adds a measurement to the repository from an event loop.
+        '''
+        await self.async_add_measurements([measurement])
+
+    async def async_add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Adds a batch of measurements to the repository from an event loop.
+
+        The blocking `add_measurements` is run in the loop's default executor.
+        Repositories with a non-blocking client should override this.
+        '''
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.add_measurements, list(measurements))
+
 
 class RedisRepository(AbstractRepository):
-    def __init__(self, redis_client: Redis) -> None:
+    '''
+    Repository storing measurements in redis.
+
+    Each sensor has a sorted set of measurements scored by timestamp, so range queries only touch the requested window.
+    Measurements are also pushed onto the `measurements` list, which is drained with `pop_measurement`.
+    Older measurements can be compacted into compressed chunks with `compact`, reads decode them transparently.
+
+    When an asyncio client is given the `async_` methods use it instead of blocking an executor thread.
+    Measurements are encoded as JSON unless another serializer is given.
+    '''
+    def __init__(
+            self, redis_client: 'Redis', async_client: Optional['AsyncRedis'] = None, serializer: Optional[AbstractSerializer] = None
+            ) -> None:
         self.redis_client = redis_client
+        self.async_client = async_client
+        self.serializer = JSONSerializer() if serializer is None else serializer
+
+    @classmethod
+    def from_url(
+            cls, url: str, max_connections: Optional[int] = None, serializer: Optional[AbstractSerializer] = None
+            ) -> 'RedisRepository':
+        '''
+        Creates a repository with pooled blocking and asyncio clients.
+
+        :param url: redis url, e.g. redis://localhost:6379/0
+        :param max_connections: maximum number of connections in each pool
+        :param serializer: serializer for measurements
+        :return: a repository
+        '''
+        from redis import Redis
+        from redis.asyncio import Redis as AsyncRedis
+
+        return cls(
+            Redis.from_url(url, max_connections=max_connections),
+            AsyncRedis.from_url(url, max_connections=max_connections),
+            serializer,
+            )
 
     def add_measurement(self, measurement: Measurement) -> None:
-        self.redis_client.rpush('measurements', json.dumps(asdict(measurement)))
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Adds a batch of measurements in a single pipelined round-trip.
+
+        :param measurements: measurements to add
+        '''
+        pipe = self.redis_client.pipeline()
+        if self._queue_measurements(pipe, measurements):
+            pipe.execute()
+
+    async def async_add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        if self.async_client is None:
+            await super().async_add_measurements(measurements)
+            return
+        pipe = self.async_client.pipeline()
+        if self._queue_measurements(pipe, measurements):
+            await pipe.execute()
+
+    def backfill(self, measurements: Iterable[Measurement]) -> int:
+        '''
+        Adds historical measurements in a single pipelined round-trip, without pushing them onto the `measurements` list.
+
+        :param measurements: measurements to add
+        :return: number of measurements added
+        '''
+        pipe = self.redis_client.pipeline(transaction=False)
+        encoded = self._queue_measurements(pipe, measurements, publish=False)
+        if encoded:
+            pipe.execute()
+        return encoded
+
+    def _queue_measurements(self, pipe: Any, measurements: Iterable[Measurement], publish: bool = True) -> int:
+        '''
+        Queues the commands adding measurements on a pipeline, one sorted set write per sensor.
+
+        :return: number of measurements queued
+        '''
+        encoded = []
+        entries: dict[str, dict[Union[str, bytes], float]] = {}
+        for measurement in measurements:
+            entry = self.serializer.dumps(measurement)
+            encoded.append(entry)
+            sensor_entries = entries.get(measurement.sensor_id)
+            if sensor_entries is None:
+                sensor_entries = entries[measurement.sensor_id] = {}
+            sensor_entries[entry] = measurement.timestamp
+        if not encoded:
+            return 0
+        for sensor_id, sensor_entries in entries.items():
+            pipe.zadd(sensor_key(sensor_id), sensor_entries)
+        if publish:
+            pipe.rpush(MEASUREMENTS_KEY, *encoded)
+        pipe.sadd(SENSORS_KEY, *entries)
+        return len(encoded)
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        '''
+        Returns the measurements of a sensor ordered by timestamp.
+
+        :param sensor_id: sensor id
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param limit: maximum number of measurements to return
+        :return: list of measurements
+        '''
+        encoded, chunks = self._queue_range(self.redis_client.pipeline(transaction=False), sensor_id, start, end, limit).execute()
+        return self._decode_range(sensor_id, encoded, chunks, start, end, limit)
+
+    def get_measurements_many(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> dict[str, list[Measurement]]:
+        '''
+        Returns the measurements of several sensors ordered by timestamp, read in a single pipelined round-trip.
+
+        :param sensor_ids: sensor ids
+        :param start: earliest timestamp to return (inclusive)
+        :param end: latest timestamp to return (inclusive)
+        :param limit: maximum number of measurements to return per sensor
+        :return: measurements by sensor id
+        '''
+        sensor_ids = list(dict.fromkeys(sensor_ids))
+        if not sensor_ids:
+            return {}
+        pipe = self.redis_client.pipeline(transaction=False)
+        for sensor_id in sensor_ids:
+            self._queue_range(pipe, sensor_id, start, end, limit)
+        replies = pipe.execute()
+        return {
+            sensor_id: self._decode_range(sensor_id, replies[2 * index], replies[2 * index + 1], start, end, limit)
+            for index, sensor_id in enumerate(sensor_ids)
+            }
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        '''
+        Returns the measurements of a sensor ordered by timestamp as a columnar batch.
+
+        Takes the same arguments as `get_measurements`.
+        '''
+        encoded, (span, chunks) = self._queue_range(self.redis_client.pipeline(transaction=False), sensor_id, start, end, limit).execute()
+        batch = self.serializer.loads_batch(encoded)
+        if not chunks:
+            return batch
+        return self._merge_chunks(sensor_id, self._iter_chunks(sensor_id, chunks, start, end, limit), span, batch, start, end, limit)
+
+    async def async_get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        '''
+        Returns the measurements of a sensor ordered by timestamp from an event loop.
+
+        Takes the same arguments as `get_measurements`.
+        '''
+        if self.async_client is None:
+            import asyncio
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.get_measurements, sensor_id, start, end, limit)
+        pipe = self._queue_range(self.async_client.pipeline(transaction=False), sensor_id, start, end, limit, paged=False)
+        encoded, chunks = await pipe.execute()
+        return self._decode_range(sensor_id, encoded, chunks, start, end, limit, paged=False)
+
+    def _decode_range(
+            self, sensor_id: str, encoded: list[bytes], chunk_reply: list[Any], start: Optional[float], end: Optional[float],
+            limit: Optional[int], paged: bool = True
+            ) -> list[Measurement]:
+        span, chunks = chunk_reply
+        if not chunks:
+            return self.serializer.loads_many(encoded)
+        if paged:
+            chunks = self._iter_chunks(sensor_id, chunks, start, end, limit)
+        return list(self._merge_chunks(sensor_id, chunks, span, self.serializer.loads_batch(encoded), start, end, limit))
+
+    def _queue_range(
+            self, pipe: Any, sensor_id: str, start: Optional[float], end: Optional[float], limit: Optional[int], paged: bool = True
+            ) -> Any:
+        '''
+        Queues the reads of the sorted set and of the chunks overlapping a range.
+
+        Limited reads fetch the first `CHUNK_PAGE` chunks, the following pages are read by `_iter_chunks` as needed.
+        '''
+        pipe.zrangebyscore(sensor_key(sensor_id), *_score_range(start, end, limit))
+        self._queue_chunks(pipe, sensor_id, start, end, 0, CHUNK_PAGE if paged and limit is not None else -1)
+        return pipe
+
+    @staticmethod
+    def _queue_chunks(pipe: Any, sensor_id: str, start: Optional[float], end: Optional[float], offset: int, count: int) -> Any:
+        return pipe.eval(
+            CHUNKS_SCRIPT, 2, chunk_key(sensor_id), chunk_span_key(sensor_id), '-inf' if start is None else start,
+            '+inf' if end is None else end, offset, count
+            )
+
+    def _iter_chunks(
+            self, sensor_id: str, chunks: list[bytes], start: Optional[float], end: Optional[float], limit: Optional[int]
+            ) -> Iterator[bytes]:
+        '''
+        Yields the chunks overlapping a range from a first page on, reading the following pages only when they are needed.
+        '''
+        offset = 0
+        while True:
+            yield from chunks
+            if limit is None or len(chunks) < CHUNK_PAGE:
+                return
+            offset += len(chunks)
+            _, chunks = self._queue_chunks(self.redis_client, sensor_id, start, end, offset, CHUNK_PAGE)
+
+    def _merge_chunks(
+            self, sensor_id: str, chunks: Iterable[bytes], span: Optional[bytes], batch: MeasurementBatch, start: Optional[float],
+            end: Optional[float], limit: Optional[int]
+            ) -> MeasurementBatch:
+        '''
+        Combines the measurements in compressed chunks with measurements read from the sorted set.
+
+        Chunks are ordered by their last timestamp, so chunks starting after `end` are skipped without decoding.
+        With a `limit`, chunks starting after the last measurement that can be returned are skipped too, and reading
+        stops at the first chunk whose last timestamp is more than the widest chunk span past it.
+        '''
+        timestamps: 'array[float]' = array('d')
+        values: 'array[float]' = array('d')
+        ordered = True
+        widest = None if span is None else float(span)
+        batch_cutoff = batch.timestamps[limit - 1] if limit is not None and len(batch) >= limit else None
+        for chunk in chunks:
+            first, last, _ = chunk_range(chunk)
+            if end is not None and first > end:
+                continue
+            if limit is not None:
+                cutoff = _limit_cutoff(timestamps, ordered, limit, batch_cutoff)
+                if cutoff is not None and widest is not None and last - widest > cutoff:
+                    break
+                if cutoff is not None and first > cutoff:
+                    continue
+            chunk_timestamps, chunk_values = decode_chunk(chunk)
+            lo = 0 if start is None else bisect.bisect_left(chunk_timestamps, start)
+            hi = len(chunk_timestamps) if end is None else bisect.bisect_right(chunk_timestamps, end)
+            if lo >= hi:
+                continue
+            ordered = ordered and (not timestamps or timestamps[-1] <= chunk_timestamps[lo])
+            timestamps.extend(chunk_timestamps[lo:hi])
+            values.extend(chunk_values[lo:hi])
+        if len(batch):
+            ordered = ordered and (not timestamps or timestamps[-1] <= batch.timestamps[0])
+            timestamps.extend(batch.timestamps)
+            values.extend(batch.values)
+        if not ordered:  # measurements that arrived late and were compacted into a later chunk
+            pairs = sorted(zip(timestamps, values), key=lambda pair: pair[0])
+            timestamps = array('d', (timestamp for timestamp, _ in pairs))
+            values = array('d', (value for _, value in pairs))
+        if limit is not None:
+            timestamps = timestamps[:limit]
+            values = values[:limit]
+        return MeasurementBatch.from_columns(sensor_id, timestamps, values)
+
+    def compact(self, older_than: float, chunk_size: int = 1000) -> int:
+        '''
+        Moves measurements older than a timestamp from the sorted sets into compressed chunks.
+
+        Each chunk holds up to `chunk_size` measurements of one sensor. Measurements are removed by value after
+        their chunk is written in the same transaction, so measurements added concurrently are never lost.
+        The `measurements` list is left untouched.
 
-    def get_measurements(self, sensor_id: str) -> list[Measurement]:
-        all_measurements = self.redis_client.lrange('measurements', 0, -1)
-        measurements = [Measurement(**json.loads(measurement)) for measurement in all_measurements]
-        return [measurement for measurement in measurements if measurement.sensor_id == sensor_id]
+        :param older_than: measurements with an earlier timestamp are compacted
+        :param chunk_size: maximum number of measurements per chunk
+        :return: number of measurements compacted
+        '''
+        compacted = 0
+        for sensor_id in self.sensor_ids():
+            key = sensor_key(sensor_id)
+            span = self._chunk_span(sensor_id)
+            while True:
+                encoded = self.redis_client.zrangebyscore(key, '-inf', '({}'.format(older_than), 0, chunk_size)
+                if not encoded:
+                    break
+                batch = self.serializer.loads_batch(encoded)
+                pipe = self.redis_client.pipeline()
+                pipe.zadd(chunk_key(sensor_id), {encode_chunk(batch.timestamps, batch.values): batch.timestamps[-1]})
+                pipe.zrem(key, *encoded)
+                if span is None or batch.timestamps[-1] - batch.timestamps[0] > span:
+                    span = batch.timestamps[-1] - batch.timestamps[0]
+                    pipe.set(chunk_span_key(sensor_id), repr(span))
+                pipe.execute()
+                compacted += len(encoded)
+            LOG.debug('Compacted measurements of sensor [%s] older than [%s]', sensor_id, older_than)
+        return compacted
+
+    def _chunk_span(self, sensor_id: str) -> Optional[float]:
+        '''
+        Returns the widest span of the chunks of a sensor, measured from the chunks if they were compacted before spans were recorded.
+        '''
+        span = self.redis_client.get(chunk_span_key(sensor_id))
+        if span is not None:
+            return float(span)
+        chunks = self.redis_client.zrange(chunk_key(sensor_id), 0, -1)
+        if not chunks:
+            return None
+        ranges = [chunk_range(chunk) for chunk in chunks]
+        widest = max(last - first for first, last, _ in ranges)
+        self.redis_client.set(chunk_span_key(sensor_id), repr(widest))
+        return widest
+
+    def sensor_ids(self) -> list[str]:
+        '''
+        Returns the ids of every sensor with stored measurements, in order.
+        '''
+        return sorted(sensor_id.decode() if isinstance(sensor_id, bytes) else sensor_id for sensor_id in self.redis_client.smembers(SENSORS_KEY))
+
+    def evict(self, sensor_id: str, older_than: float, batch_size: int = 1000) -> int:
+        '''
+        Removes up to `batch_size` measurements of a sensor older than a timestamp, and up to `batch_size`
+        compressed chunks holding only older measurements.
+
+        Measurements are removed by value, so measurements added or compacted concurrently are never lost.
+        Chunks that also hold newer measurements are kept until all of their measurements are older.
+        The `measurements` list is left untouched, see `trim_measurement_list`.
+
+        :param sensor_id: sensor id
+        :param older_than: measurements with an earlier timestamp are removed
+        :param batch_size: maximum number of measurements and chunks removed
+        :return: number of measurements removed
+        '''
+        cutoff = '({}'.format(older_than)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrangebyscore(sensor_key(sensor_id), '-inf', cutoff, 0, batch_size)
+        pipe.zrangebyscore(chunk_key(sensor_id), '-inf', cutoff, 0, batch_size)
+        encoded, chunks = pipe.execute()
+        if not encoded and not chunks:
+            return 0
+        pipe = self.redis_client.pipeline()
+        if encoded:
+            pipe.zrem(sensor_key(sensor_id), *encoded)
+        if chunks:
+            pipe.zrem(chunk_key(sensor_id), *chunks)
+        replies = pipe.execute()
+        return (replies[0] if encoded else 0) + sum(chunk_range(chunk)[2] for chunk in chunks)
+
+    def trim_measurement_list(self, expired: Callable[[Measurement], bool], start: int = 0, batch_size: int = 1000) -> tuple[int, int]:
+        '''
+        Removes expired measurements from a window of the `measurements` list.
+
+        Entries are removed by value, so entries pushed or popped concurrently are never lost, although
+        concurrent pops shift the window.
+
+        :param expired: returns whether a measurement should be removed
+        :param start: index of the first entry of the window
+        :param batch_size: number of entries in the window
+        :return: number of entries removed and number of entries kept
+        '''
+        encoded = self.redis_client.lrange(MEASUREMENTS_KEY, start, start + batch_size - 1)
+        removed = [entry for entry, measurement in zip(encoded, self.serializer.loads_many(encoded)) if expired(measurement)]
+        if removed:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for entry in removed:
+                pipe.lrem(MEASUREMENTS_KEY, 1, entry)
+            pipe.execute()
+        return len(removed), len(encoded) - len(removed)
 
     def pop_measurement(self) -> Union[Measurement, None]:
-        measurement = self.redis_client.lpop('measurements')
+        '''
+        Removes and returns the oldest measurement from the `measurements` list.
+
+        The measurement is lost if the caller crashes before handling it, use `consumer` for at-least-once delivery.
+        '''
+        measurement = self.redis_client.lpop(MEASUREMENTS_KEY)
         if measurement is None:
             return None
-        return Measurement(**json.loads(measurement))
+        return self.serializer.loads(measurement)
+
+    def migrate_measurements(self, batch_size: int = 1000) -> int:
+        '''
+        Copies measurements from the `measurements` list into the per sensor sorted sets.
+
+        Measurements are re-encoded with the repository's serializer.
+        The list is left untouched so it can still be drained with `pop_measurement`.
+        Running the migration more than once does not create duplicates.
+
+        :param batch_size: number of list entries read per round-trip
+        :return: number of measurements migrated
+        '''
+        migrated = 0
+        offset = 0
+        while True:
+            encoded = self.redis_client.lrange(MEASUREMENTS_KEY, offset, offset + batch_size - 1)
+            if not encoded:
+                break
+            pipe = self.redis_client.pipeline()
+            for measurement in self.serializer.loads_many(encoded):
+                entry = self.serializer.dumps(measurement)
+                pipe.zadd(sensor_key(measurement.sensor_id), {entry: measurement.timestamp})
+                pipe.sadd(SENSORS_KEY, measurement.sensor_id)
+            pipe.execute()
+            migrated += len(encoded)
+            offset += batch_size
+        return migrated
+
+    def consumer(self, name: str) -> 'RedisConsumer':
+        '''
+        Returns a consumer draining the `measurements` list with at-least-once delivery.
+
+        :param name: consumer name, unique among competing consumers and stable across restarts
+        :return: a consumer
+        '''
+        return RedisConsumer(self, name)
+
+    def consumer_names(self) -> list[str]:
+        '''
+        Returns the names of consumers that have unacknowledged measurements.
+        '''
+        names = []
+        for key in self.redis_client.scan_iter(match='{}*'.format(PENDING_KEY_PREFIX)):
+            key = key.decode() if isinstance(key, bytes) else key
+            names.append(key[len(PENDING_KEY_PREFIX):])
+        return sorted(names)
+
+
+class ShardedRedisRepository(AbstractRepository):
+    '''
+    Repository spreading sensors over several redis nodes.
+
+    Sensors are mapped to nodes by the cluster hash slot of their key, with the 16384 slots split into equal
+    ranges, one per node. Every node is a `RedisRepository` with its own `measurements` list and connection pool,
+    so no single key or server takes every write. Writes and reads touching several nodes are sent to the nodes
+    in parallel and their results merged.
+    '''
+    def __init__(self, nodes: Sequence[RedisRepository]) -> None:
+        '''
+        Initializes a new ShardedRedisRepository.
+
+        :param nodes: repositories of the nodes, in a fixed order as it decides which node holds a sensor
+        '''
+        if not nodes:
+            raise ValueError('A sharded repository needs at least one node')
+        self.nodes = list(nodes)
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+        self._next_pop = itertools.cycle(range(len(self.nodes)))
+
+    @classmethod
+    def from_urls(
+            cls, urls: Sequence[str], max_connections: Optional[int] = None, serializer: Optional[AbstractSerializer] = None
+            ) -> 'ShardedRedisRepository':
+        '''
+        Creates a repository with pooled blocking and asyncio clients for every node.
+
+        :param urls: redis url of every node, e.g. redis://node-1:6379/0
+        :param max_connections: maximum number of connections in each pool
+        :param serializer: serializer for measurements
+        :return: a repository
+        '''
+        return cls([RedisRepository.from_url(url, max_connections, serializer) for url in urls])
+
+    def node_index(self, sensor_id: str) -> int:
+        '''
+        Returns the index of the node holding the measurements of a sensor.
+
+        :param sensor_id: sensor id
+        :return: index into `nodes`
+        '''
+        return key_slot(sensor_key(sensor_id)) * len(self.nodes) // CLUSTER_SLOTS
+
+    def node_for(self, sensor_id: str) -> RedisRepository:
+        return self.nodes[self.node_index(sensor_id)]
+
+    def add_measurement(self, measurement: Measurement) -> None:
+        self.node_for(measurement.sensor_id).add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Adds a batch of measurements with one pipelined round-trip per node, sent to the nodes in parallel.
+
+        :param measurements: measurements to add
+        '''
+        groups: dict[int, list[Measurement]] = {}
+        for measurement in measurements:
+            groups.setdefault(self.node_index(measurement.sensor_id), []).append(measurement)
+        self._fan_out([(self.nodes[index].add_measurements, (group,)) for index, group in groups.items()])
+
+    async def async_add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        groups: dict[int, list[Measurement]] = {}
+        for measurement in measurements:
+            groups.setdefault(self.node_index(measurement.sensor_id), []).append(measurement)
+        import asyncio
+
+        await asyncio.gather(*(self.nodes[index].async_add_measurements(group) for index, group in groups.items()))
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        return self.node_for(sensor_id).get_measurements(sensor_id, start, end, limit)
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        return self.node_for(sensor_id).get_measurement_batch(sensor_id, start, end, limit)
+
+    async def async_get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        return await self.node_for(sensor_id).async_get_measurements(sensor_id, start, end, limit)
+
+    def get_measurements_many(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> dict[str, list[Measurement]]:
+        '''
+        Returns the measurements of several sensors, reading from every node involved in parallel.
+
+        Takes the same arguments as `RedisRepository.get_measurements_many`.
+        '''
+        groups: dict[int, list[str]] = {}
+        for sensor_id in dict.fromkeys(sensor_ids):
+            groups.setdefault(self.node_index(sensor_id), []).append(sensor_id)
+        result: dict[str, list[Measurement]] = {}
+        for measurements in self._fan_out(
+                [(self.nodes[index].get_measurements_many, (group, start, end, limit)) for index, group in groups.items()]
+                ):
+            result.update(measurements)
+        return result
+
+    def compact(self, older_than: float, chunk_size: int = 1000) -> int:
+        '''
+        Compacts the measurements of every node in parallel, see `RedisRepository.compact`.
+
+        :return: number of measurements compacted
+        '''
+        return sum(self._fan_out([(node.compact, (older_than, chunk_size)) for node in self.nodes]))
+
+    def backfill(self, measurements: Iterable[Measurement]) -> int:
+        '''
+        Adds historical measurements with one pipelined round-trip per node, see `RedisRepository.backfill`.
+
+        :param measurements: measurements to add
+        :return: number of measurements added
+        '''
+        groups: dict[int, list[Measurement]] = {}
+        for measurement in measurements:
+            groups.setdefault(self.node_index(measurement.sensor_id), []).append(measurement)
+        return sum(self._fan_out([(self.nodes[index].backfill, (group,)) for index, group in groups.items()]))
+
+    def sensor_ids(self) -> list[str]:
+        '''
+        Returns the ids of every sensor with stored measurements on any node, in order.
+        '''
+        return sorted(itertools.chain.from_iterable(self._fan_out([(node.sensor_ids, ()) for node in self.nodes])))
+
+    def evict(self, sensor_id: str, older_than: float, batch_size: int = 1000) -> int:
+        return self.node_for(sensor_id).evict(sensor_id, older_than, batch_size)
+
+    def pop_measurement(self) -> Union[Measurement, None]:
+        '''
+        Removes and returns the oldest measurement from the `measurements` list of the next node with one.
+
+        Nodes are taken in turn, so measurements of different nodes are not returned in timestamp order.
+        '''
+        for _ in range(len(self.nodes)):
+            with self._lock:
+                index = next(self._next_pop)
+            measurement = self.nodes[index].pop_measurement()
+            if measurement is not None:
+                return measurement
+        return None
+
+    def close(self) -> None:
+        '''
+        Shuts down the threads used to reach the nodes in parallel.
+        '''
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _fan_out(self, calls: list[tuple[Callable[..., T], tuple[Any, ...]]]) -> list[T]:
+        if len(calls) == 1:
+            function, args = calls[0]
+            return [function(*args)]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self.nodes), thread_name_prefix='monitor-shard')
+            executor = self._executor
+        futures = [executor.submit(function, *args) for function, args in calls]
+        return [future.result() for future in futures]
+
+
+class Delivery(NamedTuple):
+    '''
+    A measurement handed to a consumer, with the stored entry needed to acknowledge it.
+    '''
+    measurement: Measurement
+    entry: bytes
+
+
+class RedisConsumer:
+    '''
+    Drains the `measurements` list in batches with at-least-once delivery.
+
+    Read measurements are moved atomically onto a pending list owned by the consumer and stay there until
+    acknowledged. Any number of consumers can compete for the same list. If a consumer crashes its pending
+    measurements are pushed back onto the list by `recover`, called by the consumer on restart or by any other process.
+    '''
+    READ_SCRIPT = '''
+local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #entries > 0 then
+    redis.call('LTRIM', KEYS[1], #entries, -1)
+    for i = 1, #entries, 1000 do
+        redis.call('RPUSH', KEYS[2], unpack(entries, i, math.min(i + 999, #entries)))
+    end
+end
+return entries
+'''
+    RECOVER_SCRIPT = '''
+local count = 0
+while redis.call('RPOPLPUSH', KEYS[1], KEYS[2]) do
+    count = count + 1
+end
+return count
+'''
+
+    def __init__(self, repo: RedisRepository, name: str) -> None:
+        '''
+        Initializes a new RedisConsumer.
+
+        :param repo: repository to drain
+        :param name: consumer name, unique among competing consumers and stable across restarts
+        '''
+        self.repo = repo
+        self.name = name
+        self.pending_key = PENDING_KEY_PREFIX + name
+
+        self._read = repo.redis_client.register_script(self.READ_SCRIPT)
+        self._recover = repo.redis_client.register_script(self.RECOVER_SCRIPT)
+
+    def read(self, count: int = 100, block: Optional[float] = None) -> list[Delivery]:
+        '''
+        Takes up to `count` of the oldest measurements from the list.
+
+        :param count: maximum number of measurements to take
+        :param block: seconds to wait for a measurement when the list is empty, 0 waits forever
+        :return: list of deliveries, to be acknowledged with `ack`
+        '''
+        entries = self._read(keys=[MEASUREMENTS_KEY, self.pending_key], args=[count])
+        if not entries and block is not None:
+            entry = self.repo.redis_client.blmove(MEASUREMENTS_KEY, self.pending_key, block, 'LEFT', 'RIGHT')
+            if entry is None:
+                return []
+            entries = [entry]
+            if count > 1:
+                entries += self._read(keys=[MEASUREMENTS_KEY, self.pending_key], args=[count - 1])
+        return self._deliveries(entries)
+
+    def ack(self, deliveries: Iterable[Delivery]) -> int:
+        '''
+        Acknowledges handled measurements, removing them from the pending list.
+
+        :param deliveries: deliveries returned by `read`
+        :return: number of measurements acknowledged
+        '''
+        pipe = self.repo.redis_client.pipeline()
+        for delivery in deliveries:
+            pipe.lrem(self.pending_key, 1, delivery.entry)
+        return sum(pipe.execute())
+
+    def pending(self) -> list[Delivery]:
+        '''
+        Returns the measurements read by this consumer but not yet acknowledged.
+        '''
+        return self._deliveries(self.repo.redis_client.lrange(self.pending_key, 0, -1))
+
+    def recover(self) -> int:
+        '''
+        Pushes unacknowledged measurements back onto the front of the list, in their original order.
+
+        :return: number of measurements recovered
+        '''
+        return int(self._recover(keys=[self.pending_key, MEASUREMENTS_KEY]))
+
+    def _deliveries(self, entries: list[bytes]) -> list[Delivery]:
+        measurements = self.repo.serializer.loads_many(entries)
+        return [Delivery(measurement, entry) for measurement, entry in zip(measurements, entries)]
+
+
+class RedisSensorIdDictionary(SensorIdDictionary):
+    '''
+    Sensor id dictionary stored in redis so every process decodes the same codes.
+    '''
+    def __init__(self, redis_client: 'Redis') -> None:
+        super().__init__()
+        self.redis_client = redis_client
+
+    def _allocate(self, sensor_id: str) -> int:
+        code = self.redis_client.hget(SENSOR_CODES_KEY, sensor_id)
+        if code is not None:
+            return int(code)
+        code = self.redis_client.incr(SENSOR_CODE_COUNTER_KEY)
+        self.redis_client.hset(SENSOR_IDS_KEY, code, sensor_id)
+        if not self.redis_client.hsetnx(SENSOR_CODES_KEY, sensor_id, code):
+            code = self.redis_client.hget(SENSOR_CODES_KEY, sensor_id)  # another process allocated a code first
+        return int(code)
+
+    def _lookup(self, code: int) -> Union[str, None]:
+        sensor_id = self.redis_client.hget(SENSOR_IDS_KEY, code)
+        if sensor_id is None:
+            return None
+        return sensor_id.decode() if isinstance(sensor_id, bytes) else sensor_id
+
+
+def _limit_cutoff(timestamps: 'array[float]', ordered: bool, limit: int, batch_cutoff: Optional[float]) -> Optional[float]:
+    '''
+    Returns the latest timestamp a read limited to `limit` measurements can still return, if already known.
+    '''
+    cutoffs = [] if batch_cutoff is None else [batch_cutoff]
+    if len(timestamps) >= limit:
+        cutoffs.append(timestamps[limit - 1] if ordered else heapq.nsmallest(limit, timestamps)[-1])
+    return min(cutoffs) if cutoffs else None
+
+
+def _score_range(start: Optional[float], end: Optional[float], limit: Optional[int]) -> tuple[Any, ...]:
+    min_score = '-inf' if start is None else start
+    max_score = '+inf' if end is None else end
+    if limit is None:
+        return (min_score, max_score)
+    return (min_score, max_score, 0, limit)
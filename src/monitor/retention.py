@@ -0,0 +1,239 @@
+import logging
+import math
+from threading import Event, Thread
+import time
+from typing import Callable, NamedTuple, Optional, Union
+
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.repository import RedisRepository, ShardedRedisRepository
+from monitor.sensors import AbstractSensor, SensorType
+
+LOG = logging.getLogger('monitor_logger')
+
+
+class RetentionPolicy:
+    '''
+    How long measurements are kept, per sensor, per sensor type or by default.
+
+    A sensor's own retention wins over the retention of its type, which wins over the default.
+    Measurements of sensors without a retention are kept forever.
+    '''
+    def __init__(
+            self, default: Optional[float] = None, sensors: Optional[dict[str, Optional[float]]] = None,
+            types: Optional[dict[SensorType, Optional[float]]] = None
+            ) -> None:
+        '''
+        Initializes a new RetentionPolicy.
+
+        :param default: seconds measurements are kept for, forever by default
+        :param sensors: seconds measurements are kept for by sensor id, None keeps them forever
+        :param types: seconds measurements are kept for by sensor type, None keeps them forever
+        '''
+        self.default = default
+        self.sensors = {} if sensors is None else dict(sensors)
+        self.types = {} if types is None else dict(types)
+
+    def max_age(self, sensor_id: str, sensor_type: Optional[SensorType] = None) -> Optional[float]:
+        '''
+        Returns the seconds measurements of a sensor are kept for.
+
+        :param sensor_id: sensor id
+        :param sensor_type: sensor type, if known
+        :return: seconds, or None if measurements are kept forever
+        '''
+        if sensor_id in self.sensors:
+            return self.sensors[sensor_id]
+        if sensor_type is not None and sensor_type in self.types:
+            return self.types[sensor_type]
+        return self.default
+
+
+class EvictionReport(NamedTuple):
+    '''
+    What an eviction pass removed.
+    '''
+    measurements: dict[str, int]  # measurements removed by sensor id
+    list_entries: int  # entries removed from the `measurements` list
+    seconds: float
+
+
+class _Cutoffs:
+    '''
+    Cutoffs of the sensors seen in a pass, and the oldest measurement kept from the current window of the list.
+    '''
+    def __init__(self, cutoff: Callable[[str, float], Optional[float]], now: float) -> None:
+        self.newest: Optional[float] = None
+        self.oldest_kept = math.inf
+        self._cutoff = cutoff
+        self._now = now
+        self._cutoffs: dict[str, Optional[float]] = {}
+
+    def get(self, sensor_id: str) -> Optional[float]:
+        if sensor_id not in self._cutoffs:
+            cutoff = self._cutoffs[sensor_id] = self._cutoff(sensor_id, self._now)
+            if cutoff is not None and (self.newest is None or cutoff > self.newest):
+                self.newest = cutoff
+        return self._cutoffs[sensor_id]
+
+    def expired(self, measurement: Measurement) -> bool:
+        cutoff = self.get(measurement.sensor_id)
+        if cutoff is not None and measurement.timestamp < cutoff:
+            return True
+        self.oldest_kept = min(self.oldest_kept, measurement.timestamp)
+        return False
+
+
+class EvictionWorker:
+    '''
+    Removes measurements older than their retention from a redis repository in the background.
+
+    Every `interval` seconds the worker makes a pass over every sensor and the `measurements` list of every node.
+    Measurements are removed in batches of at most `batch_size`, with a pause of `pause` seconds between batches,
+    so redis is never busy with eviction for long and writers are not held up. A pass over a sensor with a large
+    backlog of expired measurements removes at most `max_batches` batches, the rest is removed by later passes.
+    '''
+    def __init__(
+            self, repo: Union[RedisRepository, ShardedRedisRepository], policy: RetentionPolicy,
+            get_sensor: Optional[Callable[[str], Optional[AbstractSensor]]] = None, interval: float = 60.0,
+            batch_size: int = 500, pause: float = 0.01, max_batches: int = 100, metrics: Optional[MetricsRegistry] = None,
+            clock: Callable[[], float] = time.time
+            ) -> None:
+        '''
+        Initializes a new EvictionWorker.
+
+        :param repo: repository to remove measurements from
+        :param policy: retention of the sensors
+        :param get_sensor: returns the sensor with an id, used to find its type, e.g. `controller.get_sensor`
+        :param interval: seconds between passes
+        :param batch_size: maximum number of measurements removed per round-trip
+        :param pause: seconds to wait between batches
+        :param max_batches: maximum number of batches per sensor and node in a pass
+        :param metrics: registry to record removed measurements in
+        :param clock: returns the current timestamp, comparable with measurement timestamps
+        '''
+        if batch_size < 1:
+            raise ValueError('Batch size must be at least 1')
+        self.repo = repo
+        self.policy = policy
+        self.get_sensor = get_sensor
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_batches = max_batches
+        self.metrics = metrics
+        self.clock = clock
+
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+
+        if metrics is not None:
+            self._evicted = metrics.counter('monitor_measurements_evicted_total', 'Measurements removed by retention', ['sensor_id'])
+            self._trimmed = metrics.counter('monitor_measurement_list_evicted_total', 'Entries removed from the measurements list by retention')
+            self._pass_seconds = metrics.histogram('monitor_eviction_seconds', 'Seconds taken by an eviction pass')
+
+    @property
+    def nodes(self) -> list[RedisRepository]:
+        return self.repo.nodes if isinstance(self.repo, ShardedRedisRepository) else [self.repo]
+
+    def cutoff(self, sensor_id: str, now: float) -> Optional[float]:
+        '''
+        Returns the timestamp measurements of a sensor older than are removed.
+
+        :param sensor_id: sensor id
+        :param now: current timestamp
+        :return: timestamp, or None if measurements of the sensor are kept forever
+        '''
+        sensor = None if self.get_sensor is None else self.get_sensor(sensor_id)
+        max_age = self.policy.max_age(sensor_id, None if sensor is None else sensor.type)
+        return None if max_age is None else now - max_age
+
+    def run_once(self) -> EvictionReport:
+        '''
+        Makes a single pass over every sensor and the `measurements` list.
+
+        :return: what was removed
+        '''
+        started = time.perf_counter()
+        cutoffs = _Cutoffs(self.cutoff, self.clock())
+        removed: dict[str, int] = {}
+        for node in self.nodes:
+            for sensor_id in node.sensor_ids():
+                if self._stop_event.is_set():
+                    break
+                cutoff = cutoffs.get(sensor_id)
+                if cutoff is None:
+                    continue
+                count = self._evict(node, sensor_id, cutoff)
+                if count:
+                    removed[sensor_id] = count
+        trimmed = sum(self._trim(node, cutoffs) for node in self.nodes)
+
+        report = EvictionReport(removed, trimmed, time.perf_counter() - started)
+        if self.metrics is not None:
+            for sensor_id, count in removed.items():
+                self._evicted.labels(sensor_id).inc(count)
+            self._trimmed.inc(trimmed)
+            self._pass_seconds.observe(report.seconds)
+        if removed or trimmed:
+            LOG.info('Evicted [{}] measurements of [{}] sensors and [{}] list entries in [{:.3f}] seconds'.format(
+                sum(removed.values()), len(removed), trimmed, report.seconds
+                ))
+        return report
+
+    def start(self) -> None:
+        '''
+        Start making passes in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, name='monitor-eviction', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop the background thread, a pass in progress ends after its current batch.
+        '''
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _evict(self, node: RedisRepository, sensor_id: str, cutoff: float) -> int:
+        removed = 0
+        for _ in range(self.max_batches):
+            count = node.evict(sensor_id, cutoff, self.batch_size)
+            removed += count
+            if count < self.batch_size or self._stop_event.wait(self.pause):
+                break
+        return removed
+
+    def _trim(self, node: RedisRepository, cutoffs: '_Cutoffs') -> int:
+        '''
+        Removes expired entries window by window from the head of the list, which holds the oldest measurements.
+
+        Stops at the end of the list, or at a window whose kept entries are all newer than every cutoff,
+        as the entries after it are newer still.
+        '''
+        removed = 0
+        start = 0
+        for _ in range(self.max_batches):
+            cutoffs.oldest_kept = math.inf
+            count, kept = node.trim_measurement_list(cutoffs.expired, start, self.batch_size)
+            removed += count
+            start += kept
+            if count + kept < self.batch_size or cutoffs.newest is None or cutoffs.oldest_kept >= cutoffs.newest:
+                break
+            if self._stop_event.wait(self.pause):
+                break
+        return removed
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                LOG.error('Error evicting measurements - [{}]'.format(e))
+            self._stop_event.wait(self.interval)
@@ -0,0 +1,449 @@
+from abc import ABC, abstractmethod
+from collections import deque
+import json
+import logging
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+import time
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.sensors import AbstractSensor, SensorType
+
+LOG = logging.getLogger('monitor_logger')
+
+FIRING = 'firing'
+RESOLVED = 'resolved'
+
+
+class Alert(NamedTuple):
+    '''
+    A rule starting or stopping to fire for a sensor.
+    '''
+    rule: str
+    sensor_id: str
+    state: str
+    timestamp: float
+    value: Optional[float]
+    message: str
+
+
+class RuleState:
+    '''
+    State of a rule for one sensor.
+    '''
+    __slots__ = ('firing', 'since', 'last', 'window')
+
+    def __init__(self) -> None:
+        self.firing = False
+        self.since: Optional[float] = None
+        self.last: Optional[float] = None
+        self.window: Optional[deque[tuple[float, float]]] = None
+
+
+class Rule(ABC):
+    '''
+    Base class for rules.
+
+    A rule applies to one sensor, every sensor of a type, or every sensor if neither is given. It keeps a
+    `RuleState` per sensor and raises an alert only when it starts or stops firing, not for every reading.
+    '''
+    timed = False  # whether `check` can fire without a new reading
+
+    def __init__(self, name: str, sensor_id: Optional[str] = None, sensor_type: Optional[SensorType] = None) -> None:
+        '''
+        Initializes a new Rule.
+
+        :param name: rule name, reported in alerts
+        :param sensor_id: only apply to this sensor
+        :param sensor_type: only apply to sensors of this type
+        '''
+        self.name = name
+        self.sensor_id = sensor_id
+        self.sensor_type = sensor_type
+
+    def matches(self, sensor: AbstractSensor) -> bool:
+        '''
+        Returns whether the rule applies to a sensor.
+        '''
+        if self.sensor_id is not None and sensor.sensor_id != self.sensor_id:
+            return False
+        return self.sensor_type is None or sensor.type == self.sensor_type
+
+    @abstractmethod
+    def evaluate(self, state: RuleState, measurement: Measurement) -> Optional[Alert]:
+        '''
+        Updates the state of a sensor with a new reading.
+
+        :param state: state of the rule for the sensor
+        :param measurement: the new reading
+        :return: an alert if the rule started or stopped firing
+        '''
+        pass
+
+    def check(self, state: RuleState, sensor_id: str, now: float) -> Optional[Alert]:
+        '''
+        Checks a sensor without a new reading, for rules that fire on the passing of time.
+
+        :param state: state of the rule for the sensor
+        :param sensor_id: sensor id
+        :param now: current timestamp
+        :return: an alert if the rule started or stopped firing
+        '''
+        return None
+
+    def _transition(self, state: RuleState, firing: bool, sensor_id: str, timestamp: float, value: Optional[float], message: str) -> Optional[Alert]:
+        if firing == state.firing:
+            return None
+        state.firing = firing
+        return Alert(self.name, sensor_id, FIRING if firing else RESOLVED, timestamp, value, message)
+
+
+class Threshold(Rule):
+    '''
+    Fires when a value is above or below a limit, optionally only once it has been for `duration` seconds.
+    '''
+    def __init__(
+            self, name: str, above: Optional[float] = None, below: Optional[float] = None, duration: float = 0.0,
+            sensor_id: Optional[str] = None, sensor_type: Optional[SensorType] = None
+            ) -> None:
+        '''
+        Initializes a new Threshold.
+
+        :param name: rule name
+        :param above: fire when a value is greater than this
+        :param below: fire when a value is less than this
+        :param duration: seconds the limit must be breached by every reading before the rule fires
+        :param sensor_id: only apply to this sensor
+        :param sensor_type: only apply to sensors of this type
+        '''
+        if above is None and below is None:
+            raise ValueError('A threshold needs an upper or lower limit')
+        super().__init__(name, sensor_id, sensor_type)
+        self.above = above
+        self.below = below
+        self.duration = duration
+
+    def evaluate(self, state: RuleState, measurement: Measurement) -> Optional[Alert]:
+        value = measurement.value
+        breached = (self.above is not None and value > self.above) or (self.below is not None and value < self.below)
+        if not breached:
+            state.since = None
+            return self._transition(state, False, measurement.sensor_id, measurement.timestamp, value, 'Value [{}] is back within limits'.format(value))
+        if state.since is None:
+            state.since = measurement.timestamp
+        if measurement.timestamp - state.since < self.duration:
+            return None
+        return self._transition(
+            state, True, measurement.sensor_id, measurement.timestamp, value,
+            'Value [{}] is outside [{}, {}] since [{}]'.format(value, self.below, self.above, state.since),
+            )
+
+
+class RateOfChange(Rule):
+    '''
+    Fires when a value changes faster than `max_rate` per second.
+
+    The rate is taken between a reading and the newest reading at least `window` seconds older,
+    or the previous reading if no window is given.
+
+    At most `max_readings` readings are kept per sensor: a reading less than `window / (max_readings - 1)` seconds
+    after the last one kept is not kept as a base, so the rate may be taken over up to that much more than `window`.
+    '''
+    def __init__(
+            self, name: str, max_rate: float, window: float = 0.0, sensor_id: Optional[str] = None, sensor_type: Optional[SensorType] = None,
+            max_readings: int = 256
+            ) -> None:
+        '''
+        Initializes a new RateOfChange.
+
+        :param name: rule name
+        :param max_rate: largest allowed change per second, in either direction
+        :param window: seconds of readings the rate is taken over
+        :param sensor_id: only apply to this sensor
+        :param sensor_type: only apply to sensors of this type
+        :param max_readings: largest number of readings kept per sensor, at least 2
+        '''
+        if max_readings < 2:
+            raise ValueError('A rate of change needs at least 2 readings, got [{}]'.format(max_readings))
+        super().__init__(name, sensor_id, sensor_type)
+        self.max_rate = max_rate
+        self.window = window
+        self.max_readings = max_readings
+
+    def evaluate(self, state: RuleState, measurement: Measurement) -> Optional[Alert]:
+        timestamp, value = measurement.timestamp, measurement.value
+        if state.window is None:
+            state.window = deque()
+        window = state.window
+        while len(window) > 1 and timestamp - window[1][0] >= self.window:
+            window.popleft()  # keep the newest reading at least `window` seconds old as the base
+        if not window or timestamp <= window[0][0]:
+            window.append((timestamp, value))
+            return None
+        base_timestamp, base_value = window[0]
+        if timestamp - window[-1][0] >= self.window / (self.max_readings - 1):
+            window.append((timestamp, value))
+        rate = (value - base_value) / (timestamp - base_timestamp)
+        return self._transition(
+            state, abs(rate) > self.max_rate, measurement.sensor_id, timestamp, value, 'Value is changing by [{:.4g}] per second'.format(rate)
+            )
+
+
+class MissingData(Rule):
+    '''
+    Fires when a sensor has not reported for `timeout` seconds.
+    '''
+    timed = True
+
+    def __init__(self, name: str, timeout: float, sensor_id: Optional[str] = None, sensor_type: Optional[SensorType] = None) -> None:
+        '''
+        Initializes a new MissingData.
+
+        :param name: rule name
+        :param timeout: seconds without a reading before the rule fires
+        :param sensor_id: only apply to this sensor
+        :param sensor_type: only apply to sensors of this type
+        '''
+        super().__init__(name, sensor_id, sensor_type)
+        self.timeout = timeout
+
+    def evaluate(self, state: RuleState, measurement: Measurement) -> Optional[Alert]:
+        state.last = measurement.timestamp
+        return self._transition(state, False, measurement.sensor_id, measurement.timestamp, measurement.value, 'Sensor is reporting again')
+
+    def check(self, state: RuleState, sensor_id: str, now: float) -> Optional[Alert]:
+        if state.last is None:
+            state.last = now  # watched sensors get `timeout` seconds for their first reading
+            return None
+        if now - state.last <= self.timeout:
+            return None
+        return self._transition(state, True, sensor_id, now, None, 'No reading since [{}]'.format(state.last))
+
+
+class AlertSink(ABC):
+    '''
+    Base class for destinations of alerts.
+    '''
+    @abstractmethod
+    def send(self, alert: Alert) -> None:
+        '''
+        Delivers an alert.
+        '''
+        pass
+
+
+class LogSink(AlertSink):
+    '''
+    Logs alerts.
+    '''
+    def send(self, alert: Alert) -> None:
+        LOG.warning('Alert [{}] {} for sensor - [{}] - {}'.format(alert.rule, alert.state, alert.sensor_id, alert.message))
+
+
+class CallbackSink(AlertSink):
+    '''
+    Passes alerts to a callable.
+    '''
+    def __init__(self, callback: Callable[[Alert], Any]) -> None:
+        self.callback = callback
+
+    def send(self, alert: Alert) -> None:
+        self.callback(alert)
+
+
+class WebhookSink(AlertSink):
+    '''
+    Posts alerts as JSON to a URL.
+    '''
+    def __init__(self, url: str, timeout: float = 5.0) -> None:
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert: Alert) -> None:
+        from urllib.request import Request, urlopen
+
+        request = Request(self.url, json.dumps(alert._asdict()).encode(), {'Content-Type': 'application/json'})
+        with urlopen(request, timeout=self.timeout):
+            pass
+
+
+class RuleEngine:
+    '''
+    Evaluates rules against readings as they are ingested.
+
+    Readings are handed over with `submit`, which never blocks: they are queued for a background thread and
+    dropped if the queue is full, so evaluating rules adds no latency to polling. Every rule keeps a small state
+    per sensor, so a reading costs a constant amount of work per matching rule. Rules that fire on the passing
+    of time, such as `MissingData`, are checked every `check_interval` seconds for every watched sensor.
+    '''
+    def __init__(
+            self, rules: Iterable[Rule], sinks: Optional[Iterable[AlertSink]] = None, max_queued: int = 100000,
+            check_interval: float = 1.0, metrics: Optional[MetricsRegistry] = None, clock: Callable[[], float] = time.time
+            ) -> None:
+        '''
+        Initializes a new RuleEngine.
+
+        :param rules: rules to evaluate
+        :param sinks: destinations of alerts, alerts are logged by default
+        :param max_queued: number of readings waiting to be evaluated before new readings are dropped
+        :param check_interval: seconds between checks of time based rules
+        :param metrics: registry to record evaluated and dropped readings and alerts in
+        :param clock: returns the current timestamp, comparable with measurement timestamps
+        raises: ValueError if two rules have the same name
+        '''
+        self.rules = list(rules)
+        names = [rule.name for rule in self.rules]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError('Rule names must be unique, found [{}] more than once'.format(', '.join(duplicates)))
+        self.sinks = [LogSink()] if sinks is None else list(sinks)
+        self.check_interval = check_interval
+        self.metrics = metrics
+        self.clock = clock
+
+        self._queue: 'Queue[Optional[tuple[AbstractSensor, Measurement]]]' = Queue(max_queued)
+        self._sensors: dict[str, AbstractSensor] = {}
+        self._matching: dict[str, list[Rule]] = {}
+        self._states: dict[tuple[str, str], RuleState] = {}
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+
+        if metrics is not None:
+            self._evaluated = metrics.counter('monitor_rule_readings_total', 'Readings evaluated by the rule engine')
+            self._dropped = metrics.counter('monitor_rule_readings_dropped_total', 'Readings not evaluated because the rule queue was full')
+            self._alerts = metrics.counter('monitor_alerts_total', 'Alerts raised', ['rule', 'state'])
+            metrics.gauge('monitor_rule_queue_pending', 'Readings waiting to be evaluated by the rule engine').set_function(self._queue.qsize)
+
+    def watch(self, sensors: Iterable[AbstractSensor]) -> None:
+        '''
+        Registers sensors, so time based rules also fire for sensors that never report.
+
+        :param sensors: sensors to watch
+        '''
+        with self._lock:
+            for sensor in sensors:
+                self._register(sensor)
+
+    def forget(self, sensor_ids: Iterable[str]) -> None:
+        '''
+        Drops the state of sensors that were removed.
+
+        :param sensor_ids: sensor ids
+        '''
+        with self._lock:
+            for sensor_id in sensor_ids:
+                self._sensors.pop(sensor_id, None)
+                for rule in self._matching.pop(sensor_id, []):
+                    self._states.pop((rule.name, sensor_id), None)
+
+    def submit(self, sensor: AbstractSensor, measurement: Measurement) -> None:
+        '''
+        Queues a reading for evaluation without waiting.
+
+        :param sensor: sensor the reading was taken from
+        :param measurement: the reading
+        '''
+        try:
+            self._queue.put_nowait((sensor, measurement))
+        except Full:
+            if self.metrics is not None:
+                self._dropped.inc()
+
+    def evaluate(self, sensor: AbstractSensor, measurement: Measurement) -> list[Alert]:
+        '''
+        Evaluates a reading against every matching rule and sends the resulting alerts.
+
+        :param sensor: sensor the reading was taken from
+        :param measurement: the reading
+        :return: alerts raised
+        '''
+        alerts = []
+        with self._lock:
+            rules = self._matching.get(sensor.sensor_id)
+            if rules is None:
+                rules = self._register(sensor)
+            for rule in rules:
+                alert = rule.evaluate(self._states[(rule.name, sensor.sensor_id)], measurement)
+                if alert is not None:
+                    alerts.append(alert)
+        if self.metrics is not None:
+            self._evaluated.inc()
+        self._send(alerts)
+        return alerts
+
+    def check(self, now: Optional[float] = None) -> list[Alert]:
+        '''
+        Checks time based rules for every watched sensor and sends the resulting alerts.
+
+        :param now: current timestamp, the engine's clock by default
+        :return: alerts raised
+        '''
+        now = self.clock() if now is None else now
+        alerts = []
+        with self._lock:
+            for sensor_id, rules in self._matching.items():
+                for rule in rules:
+                    if not rule.timed:
+                        continue
+                    alert = rule.check(self._states[(rule.name, sensor_id)], sensor_id, now)
+                    if alert is not None:
+                        alerts.append(alert)
+        self._send(alerts)
+        return alerts
+
+    def start(self) -> None:
+        '''
+        Start evaluating queued readings in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name='monitor-rules', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''
+        Evaluate the readings still queued and stop the background thread.
+        '''
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _register(self, sensor: AbstractSensor) -> list[Rule]:
+        self._sensors[sensor.sensor_id] = sensor
+        rules = [rule for rule in self.rules if rule.matches(sensor)]
+        self._matching[sensor.sensor_id] = rules
+        for rule in rules:
+            self._states.setdefault((rule.name, sensor.sensor_id), RuleState())
+        return rules
+
+    def _send(self, alerts: list[Alert]) -> None:
+        for alert in alerts:
+            if self.metrics is not None:
+                self._alerts.labels(alert.rule, alert.state).inc()
+            for sink in self.sinks:
+                try:
+                    sink.send(alert)
+                except Exception as e:
+                    LOG.error('Error sending alert [{}] to [{}] - [{}]'.format(alert.rule, type(sink).__name__, e))
+
+    def _run(self) -> None:
+        next_check = time.monotonic() + self.check_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_check - time.monotonic()))
+            except Empty:
+                pass
+            else:
+                if item is None:
+                    return
+                try:
+                    self.evaluate(*item)
+                except Exception as e:
+                    LOG.error('Error evaluating rules for sensor - [{}] - [{}]'.format(item[0].sensor_id, e))
+            if time.monotonic() >= next_check:
+                self.check()
+                next_check = time.monotonic() + self.check_interval
@@ -0,0 +1,206 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import logging
+import math
+from threading import Condition, Thread
+import time
+from typing import Callable, Optional
+
+from monitor.metrics import MetricsRegistry
+from monitor.sensors import AbstractSensor
+
+LOG = logging.getLogger('monitor_logger')
+
+
+def next_deadline(deadline: float, interval: float, now: float) -> float:
+    '''
+    Returns the next polling deadline after `deadline`.
+
+    Deadlines stay on the grid `deadline + n * interval` so polling does not drift.
+    If the last poll overran one or more intervals the missed slots are skipped
+    instead of being polled back to back.
+
+    :param deadline: deadline of the last poll
+    :param interval: polling interval in seconds
+    :param now: current monotonic time
+    :return: next deadline
+    '''
+    following = deadline + interval
+    if following > now:
+        return following
+    missed = math.floor((now - deadline) / interval)
+    return deadline + (missed + 1) * interval
+
+
+class PollMetrics:
+    '''
+    Deadline metrics recorded for every poll, shared by per-sensor polling threads and the scheduler.
+    '''
+    def __init__(self, registry: MetricsRegistry) -> None:
+        self.lateness = registry.histogram(
+            'monitor_poll_lateness_seconds', 'Seconds a poll started after its deadline', ['sensor_id']
+            )
+        self.missed = registry.counter(
+            'monitor_missed_deadlines_total', 'Polling deadlines skipped because the previous poll overran', ['sensor_id']
+            )
+
+    def record(self, sensor_id: str, deadline: float, started: float, following: float, interval: float) -> None:
+        '''
+        Records a poll.
+
+        :param sensor_id: sensor id
+        :param deadline: deadline of the poll
+        :param started: monotonic time the poll started
+        :param following: deadline of the next poll
+        :param interval: polling interval in seconds
+        '''
+        self.lateness.labels(sensor_id).observe(max(0.0, started - deadline))
+        missed = int(round((following - deadline) / interval)) - 1
+        if missed > 0:
+            self.missed.labels(sensor_id).inc(missed)
+
+
+class PollingScheduler:
+    '''
+    Polls sensors from a single scheduling thread.
+
+    Sensors are kept in a heap ordered by their next deadline, and due sensors are dispatched to a bounded
+    worker pool. A sensor is rescheduled once its poll completes, so it is never polled twice at once.
+    '''
+    def __init__(
+            self, poll: Callable[[AbstractSensor], None], max_workers: int = 4, metrics: Optional[MetricsRegistry] = None,
+            interval: Optional[Callable[[AbstractSensor], float]] = None
+            ) -> None:
+        '''
+        Initializes a new PollingScheduler.
+
+        :param poll: callable taking a measurement from a sensor
+        :param max_workers: number of worker threads polling sensors
+        :param metrics: registry to record poll lateness and missed deadlines in
+        :param interval: callable returning the seconds until the next poll of a sensor, its polling interval by default
+        '''
+        self.max_workers = max_workers
+        self.metrics = metrics
+
+        self._poll = poll
+        self._interval = interval
+        self._heap: list[tuple[float, int, int, AbstractSensor]] = []
+        self._generations: dict[AbstractSensor, int] = {}
+        self._polling: set[AbstractSensor] = set()
+        self._releases: dict[AbstractSensor, Callable[[AbstractSensor], None]] = {}
+        self._deferred: dict[AbstractSensor, float] = {}
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._running = False
+        self._thread: Optional[Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._poll_metrics = None if metrics is None else PollMetrics(metrics)
+
+    def add_sensor(self, sensor: AbstractSensor, deadline: Optional[float] = None) -> None:
+        '''
+        Schedule a sensor for polling. A sensor with a poll in progress is scheduled once that poll finishes.
+
+        :param sensor: sensor to poll
+        :param deadline: monotonic time of the first poll, defaults to now
+        '''
+        with self._condition:
+            generation = next(self._counter)
+            self._generations[sensor] = generation
+            first = time.monotonic() if deadline is None else deadline
+            if sensor in self._polling:
+                self._releases.pop(sensor, None)  # polled again, so not released
+                self._deferred[sensor] = first
+                return
+            self._push(first, generation, sensor)
+
+    def remove_sensor(self, sensor: AbstractSensor, release: Optional[Callable[[AbstractSensor], None]] = None) -> None:
+        '''
+        Stop polling a sensor. A poll already in progress is allowed to finish.
+
+        :param sensor: sensor to remove
+        :param release: called with the sensor once no poll of it is in progress, straight away if none is
+        '''
+        with self._condition:
+            self._generations.pop(sensor, None)
+            if release is not None and sensor in self._polling:
+                self._releases[sensor] = release
+                return
+        if release is not None:
+            release(sensor)
+
+    def start(self) -> None:
+        '''
+        Start the scheduling thread and worker pool.
+        '''
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='monitor-poll')
+        self._thread = Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop scheduling and wait for polls in progress to finish.
+        '''
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _push(self, deadline: float, generation: int, sensor: AbstractSensor) -> None:
+        heapq.heappush(self._heap, (deadline, next(self._counter), generation, sensor))
+        self._condition.notify()
+
+    def _dispatch(self) -> None:
+        executor = self._executor
+        if executor is None:
+            return
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline = self._heap[0][0]
+                now = time.monotonic()
+                if deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+                _, _, generation, sensor = heapq.heappop(self._heap)
+                if self._generations.get(sensor) != generation:
+                    continue
+                executor.submit(self._run, sensor, deadline, generation)
+
+    def _run(self, sensor: AbstractSensor, deadline: float, generation: int) -> None:
+        with self._condition:
+            if not self._running or self._generations.get(sensor) != generation:
+                return
+            self._polling.add(sensor)
+        started = time.monotonic()
+        try:
+            self._poll(sensor)
+        except Exception as e:
+            LOG.error('Error polling sensor - [{}] - [{}]'.format(sensor.sensor_id, e))
+        finally:
+            interval = sensor.polling_interval if self._interval is None else self._interval(sensor)
+            following = next_deadline(deadline, interval, time.monotonic())
+            if self._poll_metrics is not None:
+                self._poll_metrics.record(sensor.sensor_id, deadline, started, following, interval)
+            with self._condition:
+                self._polling.discard(sensor)
+                release = self._releases.pop(sensor, None)
+                deferred = self._deferred.pop(sensor, None)
+                current = self._generations.get(sensor)
+                if self._running and current is not None and deferred is not None:
+                    self._push(deferred, current, sensor)
+                elif self._running and current == generation:
+                    self._push(following, generation, sensor)
+            if release is not None:
+                release(sensor)
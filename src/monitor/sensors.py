@@ -1,14 +1,21 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum, auto
+import json
 import logging
+import os
 from pathlib import Path
+from typing import Any, Optional, Union
 
 from monitor.measurements import Measurement
 
 
 LOG = logging.getLogger('monitor_logger')
 
+W1_DEVICES_DIR = Path('/sys/bus/w1/devices')
+DS18B20_FAMILY_CODES = ('28',)  # 1-Wire family code, the part of the device name before the dash
+
 
 class SensorInitError(Exception):
     '''
@@ -54,6 +61,18 @@ class AbstractSensor(ABC):
         '''
         pass
 
+    async def async_get_measurement(self) -> Measurement:
+        '''
+        Returns the current measurement from an event loop.
+
+        The blocking `get_measurement` is run in the loop's default executor.
+        Sensors with a non-blocking driver should override this.
+        '''
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_measurement)
+
     @property
     @abstractmethod
     def type(self) -> SensorType:
@@ -62,6 +81,12 @@ class AbstractSensor(ABC):
         '''
         pass
 
+    def close(self) -> None:
+        '''
+        Releases resources held between measurements. The sensor can still be measured afterwards.
+        '''
+        pass
+
     @property
     def polling_interval(self) -> float:
         '''
@@ -112,23 +137,29 @@ class DS18B20Sensor(AbstractSensor):
     '''
     A sensor that measures the temperature of a DS18B20 sensor.
     '''
+    READ_SIZE = 256  # the w1_slave file is two lines of about 40 bytes
 
-    def __init__(self, sensor_id: str, device_file: Path):
+    def __init__(self, sensor_id: str, device_file: Path, keep_open: bool = False, verify: bool = True):
         '''
         Initializes a new DS18B20Sensor.
 
         :param sensor_id: sensor id
         :param device_file: path to the device file
+        :param keep_open: keep the device file open between reads and read it into a reusable buffer
+        :param verify: check the device file exists, skipped when the caller has just listed the device
 
         '''
         self.sensor_id = sensor_id
         self.device_file = device_file
+        self.keep_open = keep_open
 
-        if not device_file.is_file():
+        if verify and not device_file.is_file():
             raise SensorInitError('Device file does not exist')
 
         self._polling_interval = 1.0
         self._measurement_delay = 1.0
+        self._fd: Optional[int] = None
+        self._buffer = bytearray(self.READ_SIZE)
 
     @property
     def type(self) -> SensorType:
@@ -139,10 +170,38 @@ class DS18B20Sensor(AbstractSensor):
         '''
         return SensorType.TEMPERATURE
 
-    def _read_device_file(self):
-        with open(self.device_file, 'r') as f:
-            lines = f.readlines()
-        return lines
+    def close(self) -> None:
+        '''
+        Closes the device file if it is kept open. It is opened again by the next measurement.
+        '''
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        '''
+        Drops the open file descriptor when the sensor is pickled, e.g. to be polled in a worker process.
+        '''
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        return state
+
+    def _read_device_file(self) -> tuple[Union[bytes, bytearray], int]:
+        '''
+        Reads the device file.
+
+        :return: a buffer holding the contents and the length of the contents
+        '''
+        if not self.keep_open:
+            with open(self.device_file, 'rb') as f:
+                contents = f.read(self.READ_SIZE)
+            return contents, len(contents)
+        if self._fd is None:
+            self._fd = os.open(self.device_file, os.O_RDONLY)
+        if hasattr(os, 'preadv'):
+            return self._buffer, os.preadv(self._fd, [self._buffer], 0)
+        contents = os.pread(self._fd, self.READ_SIZE, 0)
+        return contents, len(contents)
 
     def get_measurement(self) -> Measurement:
         '''
@@ -151,28 +210,184 @@ class DS18B20Sensor(AbstractSensor):
         :return: a measurement
         raises: SensorMeasurementError
         '''
-        raw_measurement = self._read_device_file()
-        if raw_measurement[0].strip()[-3:] != 'YES':  # check CRC
+        raw_measurement, length = self._read_device_file()
+        return Measurement(self.sensor_id, get_timestamp_now(), self._parse(raw_measurement, length))
+
+    def _parse(self, raw_measurement: Union[bytes, bytearray], length: int) -> float:
+        '''
+        Parses the temperature in celsius from the contents of the device file.
+
+        The buffer is searched in place so no line strings are built.
+        '''
+        first_line_end = raw_measurement.find(b'\n', 0, length)
+        if first_line_end == -1:
+            first_line_end = length
+        crc_end = first_line_end
+        while crc_end > 0 and raw_measurement[crc_end - 1] in b' \t\r':
+            crc_end -= 1
+        if crc_end < 3 or not raw_measurement.startswith(b'YES', crc_end - 3, crc_end):  # check CRC
             raise SensorMeasurementError(
                 'Error reading sensor [{}] from device file [{}] bad CRC'.format(self.sensor_id, self.device_file)
                 )
 
-        equals_pos = raw_measurement[1].find('t=')  # find temperature
+        equals_pos = raw_measurement.find(b't=', first_line_end, length)  # find temperature
         if equals_pos == -1:
             raise SensorMeasurementError(
                 'Error reading sensor [{}] from device file [{}] cannot determine temperature value'.format(self.sensor_id, self.device_file)
                 )
 
-        temp_string = raw_measurement[1][equals_pos+2:]
+        temp_string = raw_measurement[equals_pos + 2:length]
 
         try:
-            temp_c = round(float(temp_string) / 1000.0, 1)  # convert to celsius
+            return round(int(temp_string) / 1000.0, 1)  # convert to celsius
         except ValueError:
             raise SensorMeasurementError(
-                'Error reading sensor [{}] from device file [{}] cannot convert [{}] to celcius'.format(self.sensor_id, self.device_file, temp_string)
+                'Error reading sensor [{}] from device file [{}] cannot convert [{!r}] to celcius'.format(self.sensor_id, self.device_file, temp_string)
                 )
 
-        return Measurement(self.sensor_id, get_timestamp_now(), temp_c)
+
+class DS18B20Bus:
+    '''
+    Reads a group of DS18B20 sensors on the same 1-Wire bus together.
+
+    If the bus master supports bulk reads, writing `trigger` to its `therm_bulk_read` file starts the
+    temperature conversion on every probe at once so the probes do not each wait for their own conversion.
+    The device files are then read concurrently.
+    '''
+    def __init__(self, sensors: list[DS18B20Sensor], bulk_read_file: Optional[Path] = None, max_workers: Optional[int] = None):
+        '''
+        Initializes a new DS18B20Bus.
+
+        :param sensors: sensors on the bus
+        :param bulk_read_file: path to the bus master's therm_bulk_read file, e.g. /sys/bus/w1/devices/w1_bus_master1/therm_bulk_read
+        :param max_workers: number of threads reading device files, one per sensor by default
+        '''
+        self.sensors = sensors
+        self.bulk_read_file = bulk_read_file
+        self.max_workers = max_workers
+
+    def trigger(self) -> None:
+        '''
+        Starts a temperature conversion on every probe on the bus.
+        '''
+        if self.bulk_read_file is None:
+            return
+        with open(self.bulk_read_file, 'wb') as f:
+            f.write(b'trigger\n')
+
+    def get_measurements(self) -> list[Measurement]:
+        '''
+        Returns a measurement from every sensor on the bus.
+
+        Sensors that fail to read are logged and left out.
+
+        :return: list of measurements
+        '''
+        if not self.sensors:
+            return []
+        self.trigger()
+        max_workers = self.max_workers or len(self.sensors)
+        measurements = []
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='monitor-w1') as executor:
+            futures = [executor.submit(sensor.get_measurement) for sensor in self.sensors]
+            for sensor, future in zip(self.sensors, futures):
+                try:
+                    measurements.append(future.result())
+                except SensorMeasurementError as e:
+                    LOG.error('Error reading sensor [{}] - [{}]'.format(sensor.sensor_id, e))
+        return measurements
+
+
+def discover_ds18b20_sensors(
+        devices_dir: Path = W1_DEVICES_DIR, keep_open: bool = False, polling_interval: Optional[float] = None,
+        measurement_delay: Optional[float] = None, family_codes: tuple[str, ...] = DS18B20_FAMILY_CODES
+        ) -> list[DS18B20Sensor]:
+    '''
+    Builds a sensor for every DS18B20 probe in a 1-Wire devices directory.
+
+    The directory is listed once and entries are picked by their family code prefix alone. Every probe's `w1_slave`
+    file is assumed to exist, as the w1_therm driver creates it with the device, so no entry is stat-ed, opened or
+    checked. An entry that is not a device fails when it is measured.
+    Sensors are named after their device, e.g. 28-0316a2793aff.
+
+    :param devices_dir: 1-Wire devices directory
+    :param keep_open: keep the device files open between reads
+    :param polling_interval: polling interval of every sensor, the sensor default if not given
+    :param measurement_delay: measurement delay of every sensor, the sensor default if not given
+    :param family_codes: 1-Wire family codes of the probes to include
+    :return: list of sensors ordered by device name
+    '''
+    prefixes = tuple(code + '-' for code in family_codes)
+    sensors = []
+    with os.scandir(devices_dir) as entries:
+        for entry in entries:
+            if not entry.name.startswith(prefixes):
+                continue
+            sensor = DS18B20Sensor(entry.name, Path(entry.path) / 'w1_slave', keep_open=keep_open, verify=False)
+            _configure(sensor, polling_interval, measurement_delay)
+            sensors.append(sensor)
+    sensors.sort(key=lambda sensor: sensor.sensor_id)
+    LOG.info('Discovered [{}] sensors in [{}]'.format(len(sensors), devices_dir))
+    return sensors
+
+
+def load_sensors(config_file: Path) -> list[AbstractSensor]:
+    '''
+    Builds the sensors described by a JSON config file.
+
+    The file holds defaults for every sensor, an optional 1-Wire devices directory to discover probes in and
+    a list of sensors, which override discovered sensors with the same id::
+
+        {
+            "polling_interval": 5.0,
+            "measurement_delay": 1.0,
+            "keep_open": true,
+            "w1_devices_dir": "/sys/bus/w1/devices",
+            "sensors": [
+                {"type": "ds18b20", "sensor_id": "tank", "device_file": "/sys/bus/w1/devices/28-0316a2793aff/w1_slave",
+                 "polling_interval": 10.0}
+            ]
+        }
+
+    :param config_file: path to the config file
+    :return: list of sensors
+    raises: SensorConfigError
+    '''
+    try:
+        with open(config_file) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SensorConfigError('Cannot read sensor config [{}] - [{}]'.format(config_file, e)) from e
+    if not isinstance(config, dict):
+        raise SensorConfigError('Sensor config [{}] must be a JSON object'.format(config_file))
+
+    defaults = {key: config[key] for key in ('polling_interval', 'measurement_delay', 'keep_open') if key in config}
+    sensors: dict[str, AbstractSensor] = {}
+    if config.get('w1_devices_dir'):
+        for sensor in discover_ds18b20_sensors(
+                Path(config['w1_devices_dir']), defaults.get('keep_open', False), defaults.get('polling_interval'),
+                defaults.get('measurement_delay')
+                ):
+            sensors[sensor.sensor_id] = sensor
+    for entry in config.get('sensors', []):
+        options = dict(defaults, **entry)
+        sensor_type = str(options.get('type', 'ds18b20')).lower()
+        if sensor_type != 'ds18b20':
+            raise SensorConfigError('Unknown sensor type [{}]'.format(sensor_type))
+        try:
+            sensor = DS18B20Sensor(options['sensor_id'], Path(options['device_file']), keep_open=options.get('keep_open', False))
+        except KeyError as e:
+            raise SensorConfigError('Sensor config entry is missing [{}]'.format(e.args[0])) from e
+        _configure(sensor, options.get('polling_interval'), options.get('measurement_delay'))
+        sensors[sensor.sensor_id] = sensor
+    return list(sensors.values())
+
+
+def _configure(sensor: AbstractSensor, polling_interval: Optional[float], measurement_delay: Optional[float]) -> None:
+    if measurement_delay is not None:
+        sensor.measurement_delay = measurement_delay
+    if polling_interval is not None:
+        sensor.polling_interval = polling_interval
 
 
 def get_timestamp_now() -> float:
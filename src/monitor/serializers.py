@@ -0,0 +1,198 @@
+from abc import ABC, abstractmethod
+from dataclasses import asdict
+import json
+import struct
+from threading import Lock
+from typing import Iterable, Union
+
+from monitor.measurements import Measurement, MeasurementBatch
+
+
+class SerializationError(Exception):
+    '''
+    Exception for measurements that cannot be encoded or decoded.
+    '''
+    pass
+
+
+class AbstractSerializer(ABC):
+    '''
+    Abstract base class for measurement serializers.
+    '''
+
+    @abstractmethod
+    def dumps(self, measurement: Measurement) -> Union[str, bytes]:
+        '''
+        Encodes a measurement.
+        '''
+        pass
+
+    @abstractmethod
+    def loads(self, data: Union[str, bytes]) -> Measurement:
+        '''
+        Decodes a measurement.
+        '''
+        pass
+
+    def loads_many(self, data: Iterable[Union[str, bytes]]) -> list[Measurement]:
+        '''
+        Decodes a list of measurements.
+
+        Serializers with a faster bulk path should override this.
+        '''
+        return [self.loads(entry) for entry in data]
+
+    def loads_batch(self, data: Iterable[Union[str, bytes]]) -> MeasurementBatch:
+        '''
+        Decodes a list of measurements into a columnar batch.
+
+        Serializers that can fill the columns without creating measurements should override this.
+        '''
+        return MeasurementBatch(self.loads(entry) for entry in data)
+
+
+class JSONSerializer(AbstractSerializer):
+    '''
+    Encodes measurements as JSON objects.
+    '''
+
+    def dumps(self, measurement: Measurement) -> str:
+        return json.dumps(asdict(measurement))
+
+    def loads(self, data: Union[str, bytes]) -> Measurement:
+        try:
+            return Measurement(**json.loads(data))
+        except (ValueError, TypeError) as e:
+            raise SerializationError('Cannot decode measurement [{!r}]'.format(data)) from e
+
+    def loads_batch(self, data: Iterable[Union[str, bytes]]) -> MeasurementBatch:
+        batch = MeasurementBatch()
+        for entry in data:
+            try:
+                fields = json.loads(entry)
+                batch.append_values(fields['sensor_id'], fields['timestamp'], fields['value'])
+            except (ValueError, TypeError, KeyError) as e:
+                raise SerializationError('Cannot decode measurement [{!r}]'.format(entry)) from e
+        return batch
+
+
+class SensorIdDictionary:
+    '''
+    Maps sensor ids to compact integer codes and back.
+
+    Codes only live in memory, so data encoded with this dictionary can only be decoded by the same process.
+    Subclasses can persist the mapping by overriding `_allocate` and `_lookup`.
+    '''
+    def __init__(self) -> None:
+        self._codes: dict[str, int] = {}
+        self._sensor_ids: dict[int, str] = {}
+        self._lock = Lock()
+
+    def code(self, sensor_id: str) -> int:
+        '''
+        Returns the code of a sensor id, allocating a new one if needed.
+
+        :param sensor_id: sensor id
+        :return: code
+        '''
+        try:
+            return self._codes[sensor_id]
+        except KeyError:
+            pass
+        with self._lock:
+            if sensor_id not in self._codes:
+                self._remember(sensor_id, self._allocate(sensor_id))
+            return self._codes[sensor_id]
+
+    def sensor_id(self, code: int) -> str:
+        '''
+        Returns the sensor id of a code.
+
+        :param code: code
+        :return: sensor id
+        raises: SerializationError
+        '''
+        try:
+            return self._sensor_ids[code]
+        except KeyError:
+            pass
+        with self._lock:
+            if code not in self._sensor_ids:
+                sensor_id = self._lookup(code)
+                if sensor_id is None:
+                    raise SerializationError('Unknown sensor code [{}]'.format(code))
+                self._remember(sensor_id, code)
+            return self._sensor_ids[code]
+
+    def _remember(self, sensor_id: str, code: int) -> None:
+        self._codes[sensor_id] = code
+        self._sensor_ids[code] = sensor_id
+
+    def _allocate(self, sensor_id: str) -> int:
+        return len(self._codes)
+
+    def _lookup(self, code: int) -> Union[str, None]:
+        return None
+
+
+class BinarySerializer(AbstractSerializer):
+    '''
+    Encodes measurements as fixed size binary records.
+
+    A record is a format version byte, the sensor code from a `SensorIdDictionary`, the timestamp and the value,
+    21 bytes in total. JSON encoded measurements are still decoded so existing data stays readable.
+    '''
+    VERSION = 1
+    RECORD = struct.Struct('<BIdd')
+
+    def __init__(self, sensor_ids: SensorIdDictionary) -> None:
+        '''
+        Initializes a new BinarySerializer.
+
+        Stored data must be encoded with a persistent dictionary such as `RedisSensorIdDictionary`, an in-memory
+        `SensorIdDictionary` allocates codes from 0 again in every process.
+
+        :param sensor_ids: dictionary of sensor codes
+        '''
+        self.sensor_ids = sensor_ids
+        self._json = JSONSerializer()
+
+    def dumps(self, measurement: Measurement) -> bytes:
+        return self.RECORD.pack(self.VERSION, self.sensor_ids.code(measurement.sensor_id), measurement.timestamp, measurement.value)
+
+    def loads(self, data: Union[str, bytes]) -> Measurement:
+        if isinstance(data, str) or data[:1] == b'{':
+            return self._json.loads(data)
+        if len(data) != self.RECORD.size or data[0] != self.VERSION:
+            raise SerializationError('Unsupported measurement format [{!r}]'.format(data[:1]))
+        _, code, timestamp, value = self.RECORD.unpack(data)
+        return Measurement(self.sensor_ids.sensor_id(code), timestamp, value)
+
+    def loads_many(self, data: Iterable[Union[str, bytes]]) -> list[Measurement]:
+        '''
+        Decodes a list of measurements.
+
+        Lists made up only of current binary records are unpacked in a single pass.
+        '''
+        entries = list(data)
+        if not self._all_current(entries):
+            return [self.loads(entry) for entry in entries]
+        sensor_id = self.sensor_ids.sensor_id
+        return [
+            Measurement(sensor_id(code), timestamp, value)
+            for _, code, timestamp, value in self.RECORD.iter_unpack(b''.join(entries))  # type: ignore
+            ]
+
+    def loads_batch(self, data: Iterable[Union[str, bytes]]) -> MeasurementBatch:
+        entries = list(data)
+        if not self._all_current(entries):
+            return super().loads_batch(entries)
+        batch = MeasurementBatch()
+        sensor_id = self.sensor_ids.sensor_id
+        for _, code, timestamp, value in self.RECORD.iter_unpack(b''.join(entries)):  # type: ignore
+            batch.append_values(sensor_id(code), timestamp, value)
+        return batch
+
+    def _all_current(self, entries: list[Union[str, bytes]]) -> bool:
+        size = self.RECORD.size
+        return all(isinstance(entry, bytes) and len(entry) == size and entry[0] == self.VERSION for entry in entries)
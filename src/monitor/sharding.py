@@ -0,0 +1,299 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Iterable, Optional
+
+from monitor.controller import Controller
+from monitor.policy import PollingPolicy
+from monitor.repository import AbstractRepository
+from monitor.sensors import AbstractSensor
+
+LOG = logging.getLogger('monitor_logger')
+
+ADD = 'add'
+REMOVE = 'remove'
+STOP = 'stop'
+
+
+def _hash(key: str) -> int:
+    '''
+    Returns a 64 bit hash of a key that is the same in every process, unlike the built-in `hash`.
+    '''
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    '''
+    Consistent hash ring mapping keys to nodes.
+
+    Each node is placed on the ring `replicas` times, and a key belongs to the first node clockwise from its hash.
+    Adding or removing a node only moves the keys of that node.
+    '''
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 100) -> None:
+        '''
+        Initializes a new HashRing.
+
+        :param nodes: names of the nodes
+        :param replicas: number of points per node, more points spread keys more evenly
+        '''
+        self.replicas = replicas
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> list[str]:
+        return sorted(set(self._owners))
+
+    def add_node(self, node: str) -> None:
+        '''
+        Places a node on the ring.
+
+        :param node: node name
+        '''
+        if node in self._owners:
+            return
+        for replica in range(self.replicas):
+            point = _hash('{}#{}'.format(node, replica))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: str) -> None:
+        '''
+        Removes a node from the ring, its keys move to the following nodes.
+
+        :param node: node name
+        '''
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key: str) -> str:
+        '''
+        Returns the node a key belongs to.
+
+        :param key: key, e.g. a sensor id
+        :return: node name
+        '''
+        if not self._points:
+            raise LookupError('Hash ring has no nodes')
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def _run_worker(
+        shard: str, commands: Connection, repo_factory: Callable[[], AbstractRepository], sensors: list[AbstractSensor],
+        controller_kwargs: dict[str, Any]
+        ) -> None:
+    '''
+    Entry point of a worker process, polls its sensors until told to stop or the supervisor goes away.
+    '''
+    controller = Controller(repo_factory(), **controller_kwargs)
+    controller.add_sensors(sensors)
+    controller.start_polling()
+    LOG.info('Started shard - [{}] with [{}] sensors'.format(shard, len(sensors)))
+    try:
+        while True:
+            try:
+                command, argument = commands.recv()
+            except EOFError:
+                LOG.error('Supervisor of shard - [{}] went away'.format(shard))
+                break
+            if command == ADD:
+                controller.add_sensor(argument)
+            elif command == REMOVE:
+                sensor = controller.get_sensor(argument)
+                if sensor is not None:
+                    controller.remove_sensor(sensor)
+            elif command == STOP:
+                break
+    finally:
+        controller.stop_polling()
+        LOG.info('Stopped shard - [{}]'.format(shard))
+
+
+class _Worker:
+    __slots__ = ('process', 'commands')
+
+    def __init__(self, process: Any, commands: Connection) -> None:
+        self.process = process
+        self.commands = commands
+
+
+class ShardedController:
+    '''
+    Controller that polls sensors from several worker processes, so CPU-heavy sensor drivers can use every core.
+
+    Sensors are assigned to shards by a consistent hash of their id. Each shard is a worker process running
+    its own `Controller` with a repository created by `repo_factory`, so connections are never shared between
+    processes. Sensors and the factory are pickled to the workers.
+
+    While polling, sensors added or removed are routed to their shard, workers that die are restarted with
+    their sensors, and `stop_polling` stops every worker once its pending measurements are written.
+    Metrics are recorded per worker process.
+    '''
+    def __init__(
+            self, repo_factory: Callable[[], AbstractRepository], shards: Optional[int] = None, batch_size: int = 100,
+            flush_interval: float = 1.0, max_workers: int = 4, policy: Optional[PollingPolicy] = None,
+            check_interval: float = 1.0, stop_timeout: float = 10.0, start_method: str = 'spawn'
+            ) -> None:
+        '''
+        Initializes a new ShardedController.
+
+        :param repo_factory: picklable callable creating the repository of a worker,
+            e.g. `functools.partial(RedisRepository.from_url, url)`
+        :param shards: number of worker processes, the number of CPUs by default
+        :param batch_size: number of buffered measurements that triggers a write to the repository
+        :param flush_interval: maximum seconds a measurement is buffered before it is written
+        :param max_workers: number of polling threads in each worker process
+        :param policy: polling policy, each worker gets its own copy
+        :param check_interval: seconds between checks for workers that died
+        :param stop_timeout: seconds to wait for a worker to stop before it is terminated
+        :param start_method: multiprocessing start method of the workers
+        '''
+        self.repo_factory = repo_factory
+        self.shards = multiprocessing.cpu_count() if shards is None else shards
+        self.check_interval = check_interval
+        self.stop_timeout = stop_timeout
+        self.ring = HashRing('shard-{}'.format(index) for index in range(self.shards))
+        self.running = False
+
+        self._controller_kwargs = {'batch_size': batch_size, 'flush_interval': flush_interval, 'max_workers': max_workers, 'policy': policy}
+        self._context: Any = multiprocessing.get_context(start_method)
+        self._sensors: dict[str, AbstractSensor] = {}
+        self._workers: dict[str, _Worker] = {}
+        self._lock = Lock()
+        self._stopping = Event()
+        self._supervisor: Optional[Thread] = None
+
+    @property
+    def sensors(self) -> list[AbstractSensor]:
+        return list(self._sensors.values())
+
+    def shard_of(self, sensor_id: str) -> str:
+        '''
+        Returns the shard a sensor is polled by.
+
+        :param sensor_id: sensor id
+        :return: shard name
+        '''
+        return self.ring.node_for(sensor_id)
+
+    def worker_pids(self) -> dict[str, Optional[int]]:
+        '''
+        Returns the process id of the worker of every shard.
+        '''
+        with self._lock:
+            return {shard: worker.process.pid for shard, worker in self._workers.items()}
+
+    def add_sensor(self, sensor: AbstractSensor) -> None:
+        '''
+        Add a sensor, it is polled by its shard straight away when polling.
+        :param sensor: sensor to add
+        '''
+        with self._lock:
+            self._sensors[sensor.sensor_id] = sensor
+            self._send(self.shard_of(sensor.sensor_id), ADD, sensor)
+        LOG.info('Added sensor - [{}]'.format(sensor.sensor_id))
+
+    def remove_sensor(self, sensor: AbstractSensor) -> None:
+        '''
+        Remove a sensor.
+        :param sensor: sensor to remove
+        '''
+        with self._lock:
+            if self._sensors.pop(sensor.sensor_id, None) is None:
+                LOG.error('Sensor not found - [{}]'.format(sensor.sensor_id))
+                return
+            self._send(self.shard_of(sensor.sensor_id), REMOVE, sensor.sensor_id)
+        LOG.info('Removed sensor - [{}]'.format(sensor.sensor_id))
+
+    def start_polling(self) -> None:
+        '''
+        Start a worker process for every shard and a thread restarting workers that die.
+        '''
+        LOG.info('Starting polling sensors with [{}] shards'.format(self.shards))
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            for shard in self.ring.nodes:
+                self._start_worker(shard)
+        self._stopping.clear()
+        self._supervisor = Thread(target=self._supervise, name='monitor-supervisor', daemon=True)
+        self._supervisor.start()
+
+    def check_workers(self) -> list[str]:
+        '''
+        Restarts the workers that died.
+
+        :return: shards that were restarted
+        '''
+        restarted: list[str] = []
+        with self._lock:
+            if not self.running:
+                return restarted
+            for shard, worker in list(self._workers.items()):
+                if worker.process.is_alive():
+                    continue
+                LOG.error('Worker of shard - [{}] exited with code [{}], restarting'.format(shard, worker.process.exitcode))
+                worker.commands.close()
+                self._start_worker(shard)
+                restarted.append(shard)
+        return restarted
+
+    def stop_polling(self) -> None:
+        '''
+        Stop every worker once it has written its pending measurements.
+        '''
+        LOG.info('Stopping polling sensors')
+        self._stopping.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        with self._lock:
+            self.running = False
+            workers = self._workers
+            self._workers = {}
+        for shard, worker in workers.items():
+            try:
+                worker.commands.send((STOP, None))
+            except (BrokenPipeError, OSError):
+                pass
+        for shard, worker in workers.items():
+            worker.process.join(self.stop_timeout)
+            if worker.process.is_alive():
+                LOG.error('Worker of shard - [{}] did not stop, terminating'.format(shard))
+                worker.process.terminate()
+                worker.process.join()
+            worker.commands.close()
+        LOG.info('Polling sensors stopped')
+
+    def _start_worker(self, shard: str) -> None:
+        sensors = [sensor for sensor_id, sensor in self._sensors.items() if self.shard_of(sensor_id) == shard]
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_worker, name='monitor-{}'.format(shard), daemon=True,
+            args=(shard, receiver, self.repo_factory, sensors, self._controller_kwargs),
+            )
+        process.start()
+        receiver.close()
+        self._workers[shard] = _Worker(process, sender)
+
+    def _send(self, shard: str, command: str, argument: Any) -> None:
+        worker = self._workers.get(shard)
+        if worker is None:
+            return
+        try:
+            worker.commands.send((command, argument))
+        except (BrokenPipeError, OSError) as e:  # the worker died, it gets its sensors when it is restarted
+            LOG.error('Error sending to shard - [{}] - [{}]'.format(shard, e))
+
+    def _supervise(self) -> None:
+        while not self._stopping.wait(self.check_interval):
+            self.check_workers()
@@ -0,0 +1,404 @@
+import logging
+import os
+from pathlib import Path
+import struct
+from threading import Event, Lock, Thread
+import time
+from typing import BinaryIO, Iterable, Optional, Union
+import zlib
+
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.metrics import MetricsRegistry
+from monitor.repository import AbstractRepository
+from monitor.serializers import JSONSerializer, SerializationError
+
+LOG = logging.getLogger('monitor_logger')
+
+RECORD_HEADER = struct.Struct('<II')  # payload length, crc32 of the payload
+SEGMENT_SUFFIX = '.log'
+OFFSET_SUFFIX = '.offset'
+
+
+class SegmentLog:
+    '''
+    Durable append-only log of measurements, split into numbered segment files.
+
+    Records are appended to the open segment, which is fsynced once `fsync_batch` records are unsynced, by the
+    first append `fsync_interval` seconds after the last fsync, and when it is sealed. A segment is sealed once
+    it grows past `segment_bytes`, or when `seal` is called, and only sealed segments are read back. Segments
+    left by a previous process are sealed, and a record torn by a crash ends its segment.
+    '''
+    def __init__(
+            self, directory: Union[str, Path], segment_bytes: int = 8 * 1024 * 1024, fsync_batch: int = 1000, fsync_interval: float = 0.5
+            ) -> None:
+        '''
+        Initializes a new SegmentLog.
+
+        :param directory: directory holding the segment files
+        :param segment_bytes: size a segment is sealed at
+        :param fsync_batch: number of unsynced records that triggers an fsync
+        :param fsync_interval: maximum seconds between an append and its fsync
+        '''
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._serializer = JSONSerializer()
+        self._lock = Lock()
+        self._file: Optional[BinaryIO] = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        existing = self._numbers()
+        self._next = existing[-1] + 1 if existing else 0
+
+    @property
+    def empty(self) -> bool:
+        '''
+        Returns whether the log holds no records, sealed or not.
+        '''
+        with self._lock:
+            return self._size == 0 and not self.sealed()
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Returns the size of every segment on disk.
+        '''
+        return sum(path.stat().st_size for path in self.directory.glob('*' + SEGMENT_SUFFIX))
+
+    def append(self, measurements: Iterable[Measurement]) -> int:
+        '''
+        Appends measurements to the open segment.
+
+        :param measurements: measurements to append
+        :return: number of measurements appended
+        '''
+        records = []
+        for measurement in measurements:
+            payload = self._serializer.dumps(measurement).encode()
+            records.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        if not records:
+            return 0
+        data = b''.join(records)
+        with self._lock:
+            if self._file is None:
+                self._path = self.directory / '{:016d}{}'.format(self._next, SEGMENT_SUFFIX)
+                self._next += 1
+                self._file = open(self._path, 'ab')
+            self._file.write(data)
+            self._size += len(data)
+            self._unsynced += len(records)
+            if self._size >= self.segment_bytes:
+                self._close()
+            elif self._unsynced >= self.fsync_batch or time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+        return len(records)
+
+    def sync(self) -> None:
+        '''
+        Fsyncs the open segment.
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+
+    def seal(self) -> None:
+        '''
+        Fsyncs and closes the open segment so it can be read back.
+        '''
+        with self._lock:
+            if self._file is not None:
+                self._close()
+
+    def sealed(self) -> list[Path]:
+        '''
+        Returns the sealed segments, oldest first.
+        '''
+        current = self._path if self._file is not None else None
+        return [path for path in self._paths() if path != current]
+
+    def read(self, path: Path) -> list[Measurement]:
+        '''
+        Reads the measurements of a sealed segment, stopping at a torn or corrupt record.
+
+        :param path: segment
+        :return: measurements in the order they were appended
+        '''
+        with open(path, 'rb') as f:
+            data = f.read()
+        measurements = []
+        offset = 0
+        while offset < len(data):
+            if offset + RECORD_HEADER.size > len(data):
+                LOG.error('Truncated record at offset [{}] of spool segment [{}]'.format(offset, path))
+                break
+            length, checksum = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                LOG.error('Corrupt record at offset [{}] of spool segment [{}]'.format(offset, path))
+                break
+            try:
+                measurements.append(self._serializer.loads(payload.decode()))
+            except SerializationError as e:
+                LOG.error('Error reading spooled measurement - [{}]'.format(e))
+            offset += RECORD_HEADER.size + length
+        return measurements
+
+    def offset(self, path: Path) -> int:
+        '''
+        Returns the number of measurements of a segment already replayed.
+        '''
+        try:
+            return int(path.with_suffix(OFFSET_SUFFIX).read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def checkpoint(self, path: Path, offset: int) -> None:
+        '''
+        Records the number of measurements of a segment replayed, replacing the checkpoint atomically.
+        '''
+        partial = path.with_suffix(OFFSET_SUFFIX + '.tmp')
+        partial.write_text(str(offset))
+        os.replace(partial, path.with_suffix(OFFSET_SUFFIX))
+
+    def remove(self, path: Path) -> None:
+        '''
+        Removes a replayed segment and its checkpoint.
+        '''
+        path.unlink(missing_ok=True)
+        path.with_suffix(OFFSET_SUFFIX).unlink(missing_ok=True)
+
+    def close(self) -> None:
+        '''
+        Fsyncs and closes the open segment.
+        '''
+        self.seal()
+
+    def _sync(self) -> None:
+        assert self._file is not None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def _close(self) -> None:
+        assert self._file is not None
+        self._sync()
+        self._file.close()
+        self._file = None
+        self._path = None
+        self._size = 0
+
+    def _numbers(self) -> list[int]:
+        return sorted(int(path.stem) for path in self.directory.glob('*' + SEGMENT_SUFFIX) if path.stem.isdigit())
+
+    def _paths(self) -> list[Path]:
+        return [self.directory / '{:016d}{}'.format(number, SEGMENT_SUFFIX) for number in self._numbers()]
+
+
+class SpoolingRepository(AbstractRepository):
+    '''
+    Store-and-forward buffer in front of a repository that is down or slow.
+
+    Writes go straight to the repository until one fails or takes longer than `slow_write` seconds. From then on
+    writes are appended to a durable `SegmentLog` in `path` instead, and a replayer thread drains the log into the
+    repository once it recovers, backing off between failed attempts. Every segment is replayed in timestamp order
+    in batches of `batch_size`, with a checkpoint after every batch, so a restart resumes where the replay stopped.
+    A replayed batch that is slow to write also makes the replayer back off.
+    Exact duplicates within a segment are written once. Writes go straight to the repository again once the log
+    is empty, so later measurements never overtake spooled ones.
+
+    Reads are served by the repository and do not see spooled measurements until they are replayed.
+    '''
+    def __init__(
+            self, repo: AbstractRepository, path: Union[str, Path], batch_size: int = 1000, slow_write: float = 1.0,
+            segment_bytes: int = 8 * 1024 * 1024, fsync_batch: int = 1000, fsync_interval: float = 0.5, backoff: float = 0.5,
+            max_backoff: float = 30.0, metrics: Optional[MetricsRegistry] = None
+            ) -> None:
+        '''
+        Initializes a new SpoolingRepository.
+
+        :param repo: primary repository
+        :param path: directory of the spool
+        :param batch_size: maximum number of measurements per replayed write
+        :param slow_write: seconds after which a successful write still diverts the following writes to the spool
+        :param segment_bytes: size a spool segment is sealed at
+        :param fsync_batch: number of unsynced spooled measurements that triggers an fsync
+        :param fsync_interval: maximum seconds between spooling a measurement and its fsync
+        :param backoff: seconds before the first retry of a failed replay, doubled for every following retry
+        :param max_backoff: longest wait between replay attempts
+        :param metrics: registry to record spooled and replayed measurements and the size of the spool in
+        '''
+        self.repo = repo
+        self.batch_size = batch_size
+        self.slow_write = slow_write
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        self.log = SegmentLog(path, segment_bytes, fsync_batch, fsync_interval)
+
+        self._lock = Lock()
+        self._replay_lock = Lock()
+        self._spooling = not self.log.empty  # a previous process left measurements to replay
+        self._wake = Event()
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+
+        if metrics is not None:
+            self._spooled = metrics.counter('monitor_measurements_spooled_total', 'Measurements written to the local spool')
+            self._replayed = metrics.counter('monitor_measurements_replayed_total', 'Spooled measurements replayed into the repository')
+            metrics.gauge('monitor_spool_bytes', 'Bytes held in the local spool').set_function(lambda: self.log.nbytes)
+            metrics.gauge('monitor_spool_active', 'Whether writes are diverted to the local spool').set_function(lambda: float(self.spooling))
+
+    @property
+    def spooling(self) -> bool:
+        '''
+        Returns whether writes are currently diverted to the spool.
+        '''
+        return self._spooling
+
+    def add_measurement(self, measurement: Measurement) -> None:
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements: Iterable[Measurement]) -> None:
+        '''
+        Writes measurements to the repository, or to the spool while the repository is down, slow or being caught up.
+
+        :param measurements: measurements to add
+        '''
+        measurements = list(measurements)
+        if not measurements:
+            return
+        with self._lock:
+            if self._spooling:
+                self._spool(measurements)
+                return
+        start = time.perf_counter()
+        try:
+            self.repo.add_measurements(measurements)
+        except Exception as e:
+            LOG.error('Error writing measurements, spooling to [{}] - [{}]'.format(self.log.directory, e))
+            with self._lock:
+                self._spooling = True
+                self._spool(measurements)
+            self._wake.set()
+            return
+        elapsed = time.perf_counter() - start
+        if elapsed > self.slow_write:
+            LOG.warning('Writing measurements took [{:.3f}] seconds, spooling to [{}]'.format(elapsed, self.log.directory))
+            with self._lock:
+                self._spooling = True
+            self._wake.set()
+
+    def get_measurements(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> list[Measurement]:
+        return self.repo.get_measurements(sensor_id, start, end, limit)
+
+    def get_measurement_batch(
+            self, sensor_id: str, start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> MeasurementBatch:
+        return self.repo.get_measurement_batch(sensor_id, start, end, limit)
+
+    def get_measurements_many(
+            self, sensor_ids: Iterable[str], start: Optional[float] = None, end: Optional[float] = None, limit: Optional[int] = None
+            ) -> dict[str, list[Measurement]]:
+        return self.repo.get_measurements_many(sensor_ids, start, end, limit)
+
+    def sensor_ids(self) -> list[str]:
+        return self.repo.sensor_ids()
+
+    def replay(self) -> int:
+        '''
+        Drains the spool into the repository from the calling thread.
+
+        Writes go straight to the repository again once the spool is empty. If a write fails the replay stops at
+        the last checkpoint and the error is raised.
+
+        :return: number of measurements replayed
+        '''
+        replayed = 0
+        with self._replay_lock:
+            while True:
+                self.log.seal()
+                segments = self.log.sealed()
+                if not segments:
+                    with self._lock:
+                        if self.log.empty:
+                            self._spooling = False
+                            break
+                    continue
+                for path in segments:
+                    replayed += self._replay_segment(path)
+        if replayed:
+            LOG.info('Replayed [{}] spooled measurements'.format(replayed))
+        return replayed
+
+    def start(self) -> None:
+        '''
+        Start replaying the spool in a background thread whenever it holds measurements.
+        '''
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._replay_loop, name='monitor-spool', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''
+        Stop the replayer and fsync the spool, spooled measurements are replayed after a restart.
+        '''
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.log.close()
+
+    def _spool(self, measurements: list[Measurement]) -> None:
+        self.log.append(measurements)
+        if self.metrics is not None:
+            self._spooled.inc(len(measurements))
+
+    def _replay_segment(self, path: Path) -> int:
+        measurements = list({
+            (m.sensor_id, m.timestamp, m.value): m for m in self.log.read(path)
+            }.values())
+        measurements.sort(key=lambda m: m.timestamp)
+        offset = self.log.offset(path)
+        replayed = 0
+        while offset < len(measurements):
+            batch = measurements[offset:offset + self.batch_size]
+            start = time.perf_counter()
+            self.repo.add_measurements(batch)
+            elapsed = time.perf_counter() - start
+            offset += len(batch)
+            replayed += len(batch)
+            self.log.checkpoint(path, offset)
+            if self.metrics is not None:
+                self._replayed.inc(len(batch))
+            if elapsed > self.slow_write:
+                raise TimeoutError('Replaying [{}] measurements took [{:.3f}] seconds'.format(len(batch), elapsed))
+        self.log.remove(path)
+        return replayed
+
+    def _replay_loop(self) -> None:
+        delay = self.backoff
+        while not self._stopping.is_set():
+            if not self._spooling:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if self._stopping.wait(delay):  # give the repository time to recover and the spool time to fill a batch
+                break
+            try:
+                self.replay()
+            except Exception as e:
+                delay = min(delay * 2, self.max_backoff)
+                LOG.error('Error replaying spooled measurements, retrying in [{}] seconds - [{}]'.format(delay, e))
+                continue
+            delay = self.backoff
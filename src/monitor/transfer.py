@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Any, Iterable, Iterator, Optional, Sequence, Union
+import zipfile
+
+import numpy as np
+
+from monitor.measurements import MeasurementBatch
+from monitor.repository import AbstractRepository, RedisRepository, ShardedRedisRepository
+
+LOG = logging.getLogger('monitor_logger')
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest'
+CHUNK_SIZE = 100000
+IMPORT_BATCH_SIZE = 10000
+
+
+def export_measurements(
+        repo: AbstractRepository, path: Union[str, Path], sensor_ids: Optional[Iterable[str]] = None, start: Optional[float] = None,
+        end: Optional[float] = None, chunk_size: int = CHUNK_SIZE
+        ) -> int:
+    '''
+    Exports measurements to a compressed `.npz` archive.
+
+    Each sensor is read `chunk_size` measurements at a time and every chunk is written as a pair of timestamp and
+    value arrays, so at most one chunk is held in memory whatever the size of the history. A manifest listing the
+    chunks is written last, and the archive only appears at `path` once it is complete.
+
+    :param repo: repository to read from
+    :param path: archive to write
+    :param sensor_ids: sensors to export, every sensor of the repository by default
+    :param start: earliest timestamp to export (inclusive)
+    :param end: latest timestamp to export (inclusive)
+    :param chunk_size: maximum number of measurements per chunk
+    :return: number of measurements exported
+    '''
+    if chunk_size < 1:
+        raise ValueError('Chunk size must be at least 1')
+    path = Path(path)
+    sensor_ids = repo.sensor_ids() if sensor_ids is None else list(dict.fromkeys(sensor_ids))
+    chunks: list[dict[str, Any]] = []
+    exported = 0
+    partial = path.with_name(path.name + '.partial')
+    try:
+        with zipfile.ZipFile(partial, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for sensor_id in sensor_ids:
+                for batch in repo.iter_measurement_batches(sensor_id, start, end, chunk_size):
+                    index = len(chunks)
+                    _write_array(archive, _chunk_name(index, 'timestamps'), np.asarray(batch.timestamps, dtype=np.float64))
+                    _write_array(archive, _chunk_name(index, 'values'), np.asarray(batch.values, dtype=np.float64))
+                    chunks.append({'sensor_id': sensor_id, 'count': len(batch), 'first': batch.timestamps[0], 'last': batch.timestamps[-1]})
+                    exported += len(batch)
+                LOG.debug('Exported sensor [%s]', sensor_id)
+            manifest = {'version': FORMAT_VERSION, 'count': exported, 'chunks': chunks}
+            _write_array(archive, MANIFEST, np.array(json.dumps(manifest)))
+        os.replace(partial, path)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    LOG.info('Exported [{}] measurements of [{}] sensors to [{}]'.format(exported, len(sensor_ids), path))
+    return exported
+
+
+def read_archive(path: Union[str, Path], sensor_ids: Optional[Iterable[str]] = None) -> Iterator[MeasurementBatch]:
+    '''
+    Streams the chunks of an archive created by `export_measurements`, one chunk in memory at a time.
+
+    :param path: archive to read
+    :param sensor_ids: only read the chunks of these sensors
+    :return: iterator of batches, one per chunk
+    raises: ValueError if the file is not an archive of measurements
+    '''
+    wanted = None if sensor_ids is None else set(sensor_ids)
+    with np.load(path, allow_pickle=False) as archive:
+        if MANIFEST not in archive.files:
+            raise ValueError('[{}] is not an archive of measurements'.format(path))
+        manifest = json.loads(str(archive[MANIFEST]))
+        if manifest.get('version') != FORMAT_VERSION:
+            raise ValueError('Unsupported archive version [{}]'.format(manifest.get('version')))
+        for index, chunk in enumerate(manifest['chunks']):
+            if wanted is not None and chunk['sensor_id'] not in wanted:
+                continue
+            timestamps = archive[_chunk_name(index, 'timestamps')]
+            values = archive[_chunk_name(index, 'values')]
+            yield MeasurementBatch.from_columns(chunk['sensor_id'], memoryview(timestamps), memoryview(values))
+
+
+def import_measurements(
+        repo: AbstractRepository, path: Union[str, Path], sensor_ids: Optional[Iterable[str]] = None, batch_size: int = IMPORT_BATCH_SIZE
+        ) -> int:
+    '''
+    Imports measurements from an archive created by `export_measurements`.
+
+    Measurements are written `batch_size` at a time. Redis repositories write each batch in one pipelined round-trip
+    with `backfill`, so imported history is not pushed onto the `measurements` list. Importing the same archive again
+    does not create duplicates in redis.
+
+    :param repo: repository to write to
+    :param path: archive to read
+    :param sensor_ids: only import the measurements of these sensors
+    :param batch_size: number of measurements per write
+    :return: number of measurements imported
+    '''
+    if batch_size < 1:
+        raise ValueError('Batch size must be at least 1')
+    imported = 0
+    for batch in read_archive(path, sensor_ids):
+        for offset in range(0, len(batch), batch_size):
+            measurements = list(batch[offset:offset + batch_size])
+            if isinstance(repo, (RedisRepository, ShardedRedisRepository)):
+                repo.backfill(measurements)
+            else:
+                repo.add_measurements(measurements)
+            imported += len(measurements)
+    LOG.info('Imported [{}] measurements from [{}]'.format(imported, path))
+    return imported
+
+
+def _chunk_name(index: int, column: str) -> str:
+    return 'chunk-{:08d}-{}'.format(index, column)
+
+
+def _write_array(archive: zipfile.ZipFile, name: str, array: 'np.ndarray') -> None:
+    with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def _repository(urls: Sequence[str]) -> AbstractRepository:
+    if len(urls) == 1:
+        return RedisRepository.from_url(urls[0])
+    return ShardedRedisRepository.from_urls(urls)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    '''
+    Exports or imports measurements from the command line.
+
+        python -m monitor.transfer export --url redis://localhost:6379/0 history.npz --start 1600000000
+        python -m monitor.transfer import --url redis://node-1:6379/0 --url redis://node-2:6379/0 history.npz
+
+    :param argv: arguments, the process arguments by default
+    :return: exit code
+    '''
+    parser = argparse.ArgumentParser(prog='monitor.transfer', description='Export or import measurements as compressed .npz archives')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help in (('export', 'export measurements to an archive'), ('import', 'import measurements from an archive')):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('path', type=Path, help='archive file')
+        command.add_argument(
+            '--url', action='append', required=True, help='redis url, repeat for every node of a sharded repository'
+            )
+        command.add_argument('--sensor', action='append', dest='sensor_ids', help='sensor id, repeat for several, every sensor by default')
+    export = commands.choices['export']
+    export.add_argument('--start', type=float, help='earliest timestamp to export')
+    export.add_argument('--end', type=float, help='latest timestamp to export')
+    export.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='measurements per chunk')
+    commands.choices['import'].add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='measurements per write')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    repo = _repository(args.url)
+    started = time.perf_counter()
+    try:
+        if args.command == 'export':
+            count = export_measurements(repo, args.path, args.sensor_ids, args.start, args.end, args.chunk_size)
+        else:
+            count = import_measurements(repo, args.path, args.sensor_ids, args.batch_size)
+    except (OSError, ValueError) as e:
+        LOG.error('Error during {} - [{}]'.format(args.command, e))
+        return 1
+    finally:
+        if isinstance(repo, ShardedRedisRepository):
+            repo.close()
+    print('{} {} measurements in {:.1f} seconds'.format(args.command.capitalize() + 'ed', count, time.perf_counter() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
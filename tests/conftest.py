@@ -1,12 +1,27 @@
 from datetime import datetime
+import sys
 import time
 
 import pytest
+from pytest_redis import factories
 
 from monitor.measurements import Measurement
 from monitor.sensors import AbstractSensor, SensorType
 
 
+if sys.platform == 'darwin':  # local testing on mac, every node of a sharded repository is its own redis-server
+    redis_my_proc = factories.redis_proc(executable='/usr/local/bin/redis-server', port=None, datadir='/tmp/pytest')
+    fake_redis_db = factories.redisdb('redis_my_proc')
+    redis_node_1_proc = factories.redis_proc(executable='/usr/local/bin/redis-server', port=None, datadir='/tmp/pytest')
+    redis_node_1 = factories.redisdb('redis_node_1_proc')
+    redis_node_2_proc = factories.redis_proc(executable='/usr/local/bin/redis-server', port=None, datadir='/tmp/pytest')
+    redis_node_2 = factories.redisdb('redis_node_2_proc')
+else:  # CI testing. Redis is already running on port 6379, other databases stand in for the other nodes
+    fake_redis_db = factories.redisdb('redis_nooproc')
+    redis_node_1 = factories.redisdb('redis_nooproc', dbnum=1)
+    redis_node_2 = factories.redisdb('redis_nooproc', dbnum=2)
+
+
 now = datetime.now()
 
 
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from monitor.aggregation import HOUR, MINUTE, RedisRollupStore, RollupRepository, aggregate, rollup
+from monitor.measurements import Measurement
+from monitor.repository import AbstractRepository, RedisRepository
+
+MINUTE_START = 1_600_000_020.0
+START = MINUTE_START + 20  # 20 seconds into a minute
+
+
+def readings(count, step=10.0, sensor_id='sensor_id'):
+    return [Measurement(sensor_id, START + i * step, float(i)) for i in range(count)]
+
+
+def test_aggregate_buckets():
+    measurements = readings(12)  # 2 minutes of readings every 10 seconds, starting 20 seconds into a minute
+    result = aggregate('sensor_id', [m.timestamp for m in measurements], [m.value for m in measurements], MINUTE)
+
+    assert list(result.starts) == [MINUTE_START, MINUTE_START + 60, MINUTE_START + 120]
+    assert list(result.count) == [4, 6, 2]
+    assert list(result.min) == [0.0, 4.0, 10.0]
+    assert list(result.max) == [3.0, 9.0, 11.0]
+    assert list(result.mean) == [1.5, 6.5, 10.5]
+
+
+def test_aggregate_percentiles_match_numpy():
+    rng = np.random.default_rng(0)
+    timestamps = START + np.arange(1000) * 7.0
+    values = rng.normal(20.0, 2.0, size=1000)
+    result = aggregate('sensor_id', timestamps, values, HOUR, percentiles=(50, 95))
+
+    for i, bucket_start in enumerate(result.starts):
+        in_bucket = values[(timestamps >= bucket_start) & (timestamps < bucket_start + HOUR)]
+        assert result.percentiles[50][i] == pytest.approx(np.percentile(in_bucket, 50))
+        assert result.percentiles[95][i] == pytest.approx(np.percentile(in_bucket, 95))
+
+
+def test_aggregate_unsorted_input():
+    result = aggregate('sensor_id', [START + 70, START, START + 10], [3.0, 1.0, 2.0], MINUTE)
+    assert list(result.count) == [2, 1]
+    assert list(result.sum) == [3.0, 3.0]
+
+
+def test_aggregate_empty():
+    result = aggregate('sensor_id', [], [], MINUTE, percentiles=(50,))
+    assert len(result) == 0
+    assert len(result.percentiles[50]) == 0
+
+
+class FakeRepo(AbstractRepository):
+    def __init__(self) -> None:
+        self.measurements = []
+
+    def add_measurement(self, measurement):
+        self.measurements.append(measurement)
+
+    def get_measurements(self, sensor_id, start=None, end=None, limit=None):
+        return [
+            m for m in self.measurements
+            if m.sensor_id == sensor_id and (start is None or m.timestamp >= start) and (end is None or m.timestamp <= end)
+            ]
+
+
+def test_rollup_reads_repository():
+    repo = FakeRepo()
+    repo.add_measurements(readings(12))
+    result = rollup(repo, 'sensor_id', START + 40, None, MINUTE)
+    assert list(result.count) == [6, 2]
+
+
+def test_rollup_repository_matches_aggregate():
+    repo = RollupRepository(FakeRepo(), resolutions=(MINUTE, HOUR))
+    measurements = readings(500)
+    for i in range(0, 500, 50):
+        repo.add_measurements(measurements[i:i + 50])
+
+    expected = rollup(repo, 'sensor_id', None, None, MINUTE)
+    result = repo.get_rollup('sensor_id', MINUTE)
+    assert list(result.starts) == list(expected.starts)
+    assert list(result.count) == list(expected.count)
+    assert list(result.min) == list(expected.min)
+    assert list(result.max) == list(expected.max)
+    assert list(result.mean) == pytest.approx(list(expected.mean))
+    assert sum(repo.get_rollup('sensor_id', HOUR).count) == 500
+    assert len(repo.get_measurements('sensor_id')) == 500
+
+
+def test_rollup_repository_range():
+    repo = RollupRepository(FakeRepo(), resolutions=(MINUTE,))
+    repo.add_measurements(readings(12))
+    assert list(repo.get_rollup('sensor_id', MINUTE, start=MINUTE_START + 60).count) == [6, 2]
+
+
+def test_rollup_repository_unknown_resolution():
+    repo = RollupRepository(FakeRepo(), resolutions=(MINUTE,))
+    with pytest.raises(ValueError):
+        repo.get_rollup('sensor_id', HOUR)
+
+
+def test_rollup_repository_in_background():
+    repo = RollupRepository(FakeRepo(), resolutions=(MINUTE,), background=True)
+    repo.add_measurements(readings(12))
+    repo.join()
+    assert list(repo.get_rollup('sensor_id', MINUTE).count) == [4, 6, 2]
+    repo.close()
+
+
+def test_redis_rollup_store(fake_redis_db):
+    repo = RollupRepository(RedisRepository(fake_redis_db), RedisRollupStore(fake_redis_db), resolutions=(MINUTE,))
+    measurements = readings(12)
+    repo.add_measurements(measurements[:5])
+    repo.add_measurements(measurements[5:])
+
+    result = RedisRollupStore(fake_redis_db).get('sensor_id', MINUTE)
+    assert list(result.starts) == [MINUTE_START, MINUTE_START + 60, MINUTE_START + 120]
+    assert list(result.count) == [4, 6, 2]
+    assert list(result.min) == [0.0, 4.0, 10.0]
+    assert list(result.max) == [3.0, 9.0, 11.0]
+    assert list(RedisRollupStore(fake_redis_db).get('sensor_id', MINUTE, start=MINUTE_START + 60).count) == [6, 2]
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from monitor.async_controller import AsyncController
+from monitor.measurements import Measurement
+from monitor.repository import AbstractRepository
+
+
+class FakeRepo(AbstractRepository):
+    def __init__(self) -> None:
+        self.measurements = []
+
+    def add_measurement(self, measurement):
+        self.measurements.append(measurement)
+
+    def get_measurements(self, sensor_id):
+        return [measurement for measurement in self.measurements if measurement.sensor_id == sensor_id]
+
+
+class FakeAsyncRepo(FakeRepo):
+    def __init__(self) -> None:
+        super().__init__()
+        self.batches = []
+
+    async def async_add_measurements(self, measurements):
+        measurements = list(measurements)
+        self.batches.append(measurements)
+        self.measurements.extend(measurements)
+
+
+class DownRepo(FakeRepo):
+    async def async_add_measurements(self, measurements):
+        raise ConnectionError('repository is down')
+
+
+def run_controller(controller, duration):
+    async def run():
+        await controller.start_polling()
+        await asyncio.sleep(duration)
+        await controller.stop_polling()
+    asyncio.run(run())
+
+
+def test_async_controller_polls_blocking_sensors(temperature_sensor_fixture, timestamp_fixture):
+    sensor1 = temperature_sensor_fixture('sensor_id_1')
+    sensor2 = temperature_sensor_fixture('sensor_id_2')
+    repo = FakeRepo()
+    c = AsyncController(repo)
+    c.add_sensor(sensor1)
+    c.add_sensor(sensor2)
+    run_controller(c, 0.6)  # time for 1 measurement for each sensor
+
+    for sensor in (sensor1, sensor2):
+        results = repo.get_measurements(sensor.sensor_id)
+        assert len(results) == 1
+        assert results[0].timestamp == timestamp_fixture
+
+
+def test_async_controller_polling_interval_includes_time_to_take_measurement(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    sensor.measurement_delay = 0.5  # time to take a measurement
+    sensor.polling_interval = 1.0  # polling interval
+    repo = FakeRepo()
+    c = AsyncController(repo)
+    c.add_sensor(sensor)
+    run_controller(c, 1.1)  # time for 2 measurements
+
+    assert len(repo.get_measurements(sensor.sensor_id)) == 2
+
+
+def test_async_controller_polls_many_async_sensors_in_batches(temperature_sensor_fixture, timestamp_fixture):
+    class AsyncSensor(temperature_sensor_fixture):
+        async def async_get_measurement(self):
+            await asyncio.sleep(self.measurement_delay)
+            return Measurement(self.sensor_id, timestamp_fixture, 1.0)
+
+    sensors = [AsyncSensor('sensor_id_{}'.format(i)) for i in range(1000)]
+    repo = FakeAsyncRepo()
+    c = AsyncController(repo, batch_size=250)
+    for sensor in sensors:
+        c.add_sensor(sensor)
+    run_controller(c, 0.6)  # time for 1 measurement for each sensor
+
+    assert len(repo.measurements) == 1000
+    assert max(len(batch) for batch in repo.batches) >= 250
+
+
+def test_async_controller_can_remove_sensors(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    c = AsyncController(FakeRepo())
+    c.add_sensor(sensor)
+    c.remove_sensor(sensor)
+    c.remove_sensor(sensor)
+    assert c.sensors == []
+
+
+def test_async_controller_stops_and_closes_removed_sensor(temperature_sensor_fixture, timestamp_fixture):
+    class ClosingSensor(temperature_sensor_fixture):
+        closed = 0
+
+        async def async_get_measurement(self):
+            return Measurement(self.sensor_id, timestamp_fixture, 1.0)
+
+        def close(self):
+            self.closed += 1
+
+    sensors = [ClosingSensor('sensor_id_{}'.format(i)) for i in range(2)]
+    for sensor in sensors:
+        sensor.measurement_delay = 0.0
+        sensor.polling_interval = 0.1
+    repo = FakeAsyncRepo()
+    c = AsyncController(repo, batch_size=1)
+
+    async def run():
+        for sensor in sensors:
+            c.add_sensor(sensor)
+        await c.start_polling()
+        await asyncio.sleep(0.05)
+        c.remove_sensor(sensors[0])
+        await asyncio.sleep(0.01)
+        assert [sensor.closed for sensor in sensors] == [1, 0]
+        await asyncio.sleep(0.2)
+        await c.stop_polling()
+
+    asyncio.run(run())
+    assert len(repo.get_measurements('sensor_id_0')) == 1
+    assert len(repo.get_measurements('sensor_id_1')) == 3
+    assert [sensor.closed for sensor in sensors] == [1, 1]
+
+
+@pytest.mark.parametrize('overflow', ['block', 'drop-oldest'])
+def test_async_controller_bounds_buffer_while_repository_is_down(temperature_sensor_fixture, timestamp_fixture, overflow):
+    class AsyncSensor(temperature_sensor_fixture):
+        async def async_get_measurement(self):
+            return Measurement(self.sensor_id, timestamp_fixture, 1.0)
+
+    sensors = [AsyncSensor('sensor_id_{}'.format(i)) for i in range(3)]
+    for sensor in sensors:
+        sensor.measurement_delay = 0.0
+        sensor.polling_interval = 0.01
+    c = AsyncController(DownRepo(), batch_size=2, flush_interval=0.01, queue_size=5, overflow=overflow)
+    for sensor in sensors:
+        c.add_sensor(sensor)
+
+    async def run():
+        await c.start_polling()
+        await asyncio.sleep(0.3)
+        assert len(c._pending) <= 5
+        await asyncio.wait_for(c.stop_polling(), timeout=1.0)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert 5 <= len(c._pending) <= 5 + len(sensors)  # polls waiting for room add their measurements when stopped
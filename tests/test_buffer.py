@@ -0,0 +1,202 @@
+import threading
+import time
+
+import pytest
+
+from monitor.buffer import QueuedRepository
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.repository import AbstractRepository
+
+
+class FakeRepo(AbstractRepository):
+    def __init__(self) -> None:
+        self.batches = []
+
+    def add_measurement(self, measurement):
+        self.batches.append([measurement])
+
+    def add_measurements(self, measurements):
+        self.batches.append(list(measurements))
+
+
+class FailingRepo(AbstractRepository):
+    def add_measurement(self, measurement):
+        raise ConnectionError('repository unavailable')
+
+
+class FlakyRepo(FakeRepo):
+    '''
+    Fails until `failures` writes have been attempted.
+    '''
+    def __init__(self, failures) -> None:
+        super().__init__()
+        self.failures = failures
+
+    def add_measurements(self, measurements):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('repository unavailable')
+        super().add_measurements(measurements)
+
+
+class GatedRepo(FakeRepo):
+    '''
+    Blocks every write until the gate is opened.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.gate = threading.Event()
+
+    def add_measurements(self, measurements):
+        self.gate.wait()
+        super().add_measurements(measurements)
+
+
+def written(repo):
+    return [measurement for batch in repo.batches for measurement in batch]
+
+
+def counter(metrics, name):
+    return metrics.get(name).labels().value
+
+
+def test_abstract_repository_add_measurements_adds_each_measurement(timestamp_fixture):
+    class SingleRepo(AbstractRepository):
+        def __init__(self):
+            self.measurements = []
+
+        def add_measurement(self, measurement):
+            self.measurements.append(measurement)
+
+    repo = SingleRepo()
+    measurements = [Measurement('sensor_id', timestamp_fixture, float(i)) for i in range(3)]
+    repo.add_measurements(measurements)
+    assert repo.measurements == measurements
+
+
+def test_queue_writes_batches_from_writer_thread(timestamp_fixture):
+    repo = FakeRepo()
+    queue = QueuedRepository(repo, batch_size=3, max_age=60)
+    queue.start()
+    measurements = [Measurement('sensor_id', timestamp_fixture, float(i)) for i in range(4)]
+    queue.add_measurements(measurements)
+    time.sleep(0.1)
+    assert repo.batches == [measurements[:3]]
+    queue.stop()
+    assert repo.batches == [measurements[:3], measurements[3:]]
+
+
+def test_queue_writes_aged_measurements(timestamp_fixture):
+    repo = FakeRepo()
+    queue = QueuedRepository(repo, batch_size=100, max_age=0.1)
+    queue.start()
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.0)
+    queue.add_measurement(measurement)
+    time.sleep(0.3)
+    assert repo.batches == [[measurement]]
+    queue.stop()
+
+
+def test_queue_retries_failed_writes(timestamp_fixture):
+    metrics = MetricsRegistry()
+    repo = FlakyRepo(failures=2)
+    queue = QueuedRepository(repo, batch_size=1, backoff=0.01, metrics=metrics)
+    queue.start()
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.0)
+    queue.add_measurement(measurement)
+    time.sleep(0.2)
+    queue.stop()
+
+    assert repo.batches == [[measurement]]
+    assert counter(metrics, 'monitor_repository_write_errors_total') == 2
+    assert counter(metrics, 'monitor_measurements_delayed_total') == 1
+
+
+def test_queue_blocks_producer_when_full(timestamp_fixture):
+    metrics = MetricsRegistry()
+    repo = GatedRepo()
+    queue = QueuedRepository(repo, max_size=2, batch_size=1, metrics=metrics)
+    queue.start()
+    measurements = [Measurement('sensor_id', timestamp_fixture, float(i)) for i in range(4)]
+    queue.add_measurements(measurements[:1])  # taken by the writer, which waits at the gate
+    time.sleep(0.1)
+    queue.add_measurements(measurements[1:3])
+    producer = threading.Thread(target=queue.add_measurement, args=(measurements[3],))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()
+
+    repo.gate.set()
+    producer.join(1)
+    assert not producer.is_alive()
+    queue.stop()
+    assert written(repo) == measurements
+    assert counter(metrics, 'monitor_measurements_delayed_total') == 1
+
+
+def test_queue_drops_oldest_when_full(timestamp_fixture):
+    metrics = MetricsRegistry()
+    repo = FakeRepo()
+    queue = QueuedRepository(repo, max_size=2, batch_size=10, overflow='drop-oldest', metrics=metrics)
+    measurements = [Measurement('sensor_id', timestamp_fixture, float(i)) for i in range(5)]
+    queue.add_measurements(measurements)
+    queue.flush()
+
+    assert written(repo) == measurements[3:]
+    assert counter(metrics, 'monitor_measurements_dropped_total') == 3
+
+
+def test_queue_spills_when_full_and_replays(timestamp_fixture, tmp_path):
+    metrics = MetricsRegistry()
+    repo = FakeRepo()
+    spill_path = tmp_path / 'spill.jsonl'
+    queue = QueuedRepository(repo, max_size=2, batch_size=2, max_age=0.05, overflow='spill', spill_path=spill_path, metrics=metrics)
+    measurements = [Measurement('sensor_id', timestamp_fixture, float(i)) for i in range(5)]
+    queue.add_measurements(measurements)
+    assert counter(metrics, 'monitor_measurements_spilled_total') == 3
+    assert len(spill_path.read_text().splitlines()) == 3
+
+    queue.start()
+    time.sleep(0.3)
+    queue.stop()
+    assert sorted(written(repo), key=lambda measurement: measurement.value) == measurements
+    assert not spill_path.exists()
+
+
+def test_queue_spills_batches_that_cannot_be_written_on_stop(timestamp_fixture, tmp_path):
+    spill_path = tmp_path / 'spill.jsonl'
+    queue = QueuedRepository(FailingRepo(), retries=1, backoff=0.01, overflow='spill', spill_path=spill_path)
+    queue.start()
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.0)
+    queue.add_measurement(measurement)
+    queue.stop()
+
+    assert queue.pending == 0
+    repo = FakeRepo()
+    replay = QueuedRepository(repo, overflow='spill', spill_path=spill_path)
+    replay.start()
+    time.sleep(0.1)
+    replay.stop()
+    assert written(repo) == [measurement]
+
+
+def test_queue_keeps_batches_that_cannot_be_written_on_stop(timestamp_fixture):
+    repo = FlakyRepo(failures=100)
+    queue = QueuedRepository(repo, batch_size=2, retries=1, backoff=0.01)
+    queue.start()
+    measurements = [Measurement('sensor_id', timestamp_fixture, float(i)) for i in range(5)]
+    queue.add_measurements(measurements)
+    queue.stop()
+
+    assert queue.pending == 5
+    repo.failures = 0
+    queue.flush()
+    assert written(repo) == measurements
+
+
+def test_queue_rejects_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        QueuedRepository(FakeRepo(), overflow='ignore')
+    with pytest.raises(ValueError):
+        QueuedRepository(FakeRepo(), overflow='spill')
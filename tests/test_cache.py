@@ -0,0 +1,176 @@
+import pytest
+
+from monitor.cache import CachedRepository
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.metrics import MetricsRegistry
+from monitor.repository import AbstractRepository, RedisRepository
+
+
+class MemoryRepo(AbstractRepository):
+    def __init__(self) -> None:
+        self.measurements = []
+        self.reads = 0
+
+    def add_measurement(self, measurement):
+        self.measurements.append(measurement)
+
+    def get_measurements(self, sensor_id, start=None, end=None, limit=None):
+        self.reads += 1
+        result = sorted(
+            (m for m in self.measurements
+             if m.sensor_id == sensor_id and (start is None or m.timestamp >= start) and (end is None or m.timestamp <= end)),
+            key=lambda m: m.timestamp,
+            )
+        return result if limit is None else result[:limit]
+
+
+class FailingRepo(AbstractRepository):
+    def add_measurement(self, measurement):
+        raise ConnectionError('repository unavailable')
+
+
+def measurements_of(sensor_id, timestamp, count):
+    return [Measurement(sensor_id, timestamp + i, float(i)) for i in range(count)]
+
+
+def test_cache_serves_recent_reads_from_memory(timestamp_fixture):
+    repo = MemoryRepo()
+    cache = CachedRepository(repo, max_size=5)
+    measurements = measurements_of('sensor_id', timestamp_fixture, 8)
+    cache.add_measurements(measurements)
+
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture + 3) == measurements[3:]
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture + 4, end=timestamp_fixture + 6) == measurements[4:7]
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture + 4, limit=2) == measurements[4:6]
+    assert isinstance(cache.get_measurement_batch('sensor_id', start=timestamp_fixture + 7), MeasurementBatch)
+    assert repo.reads == 0
+    assert cache.entries == 5
+
+
+def test_cache_falls_back_to_repository_for_older_ranges(timestamp_fixture):
+    repo = MemoryRepo()
+    cache = CachedRepository(repo, max_size=5)
+    measurements = measurements_of('sensor_id', timestamp_fixture, 8)
+    cache.add_measurements(measurements)
+
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture + 1, end=timestamp_fixture + 4) == measurements[1:5]
+    assert cache.get_measurements('sensor_id') == measurements
+    assert repo.reads == 2
+
+
+def test_cache_does_not_serve_history_written_before_it(timestamp_fixture):
+    repo = MemoryRepo()
+    measurements = measurements_of('sensor_id', timestamp_fixture, 4)
+    repo.add_measurements(measurements[:2])
+    cache = CachedRepository(repo)
+    cache.add_measurements(measurements[2:])
+
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture) == measurements
+    assert repo.reads == 1
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture) == measurements
+    assert repo.reads == 1  # the miss filled the cache from the start of the window
+
+
+def test_cache_keeps_late_measurements_in_order(timestamp_fixture):
+    repo = MemoryRepo()
+    cache = CachedRepository(repo)
+    measurements = measurements_of('sensor_id', timestamp_fixture, 4)
+    cache.add_measurements([measurements[0], measurements[2], measurements[3]])
+    cache.add_measurement(measurements[1])
+
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture) == measurements
+    assert repo.reads == 0
+
+
+def test_cache_adds_measurements_once_when_a_fill_reads_them_first(timestamp_fixture):
+    class ReadDuringWriteRepo(MemoryRepo):
+        def add_measurements(self, measurements):
+            super().add_measurements(measurements)
+            cache.get_measurements('sensor_id', start=timestamp_fixture)  # a reader filling the cache before the write returns
+
+    cache = CachedRepository(ReadDuringWriteRepo())
+    measurements = measurements_of('sensor_id', timestamp_fixture, 4)
+    cache.add_measurements(measurements[:2])
+    cache.add_measurements(measurements[2:] + [Measurement('sensor_id', timestamp_fixture + 3, 7.0)])
+
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture) == measurements + [Measurement('sensor_id', timestamp_fixture + 3, 7.0)]
+    assert cache.entries == 5
+
+
+def test_cache_evicts_least_recently_used_sensors(timestamp_fixture):
+    repo = MemoryRepo()
+    cache = CachedRepository(repo, max_size=10, max_entries=20)
+    cache.add_measurements(measurements_of('sensor_0', timestamp_fixture, 10))
+    cache.add_measurements(measurements_of('sensor_1', timestamp_fixture, 10))
+    cache.get_measurements('sensor_0', start=timestamp_fixture)
+    cache.add_measurements(measurements_of('sensor_2', timestamp_fixture, 10))
+    assert repo.reads == 0
+    assert cache.entries == 20
+
+    cache.get_measurements('sensor_0', start=timestamp_fixture)
+    cache.get_measurements('sensor_2', start=timestamp_fixture)
+    assert repo.reads == 0
+    cache.get_measurements('sensor_1', start=timestamp_fixture)
+    assert repo.reads == 1
+
+
+def test_cache_limits_bytes(timestamp_fixture):
+    cache = CachedRepository(MemoryRepo(), max_size=100, max_bytes=16 * 150)
+    cache.add_measurements(measurements_of('sensor_0', timestamp_fixture, 100))
+    cache.add_measurements(measurements_of('sensor_1', timestamp_fixture, 100))
+    assert cache.entries == 100
+    assert cache.nbytes <= 16 * 150
+
+
+def test_cache_is_unchanged_when_write_fails(timestamp_fixture):
+    cache = CachedRepository(FailingRepo())
+    with pytest.raises(ConnectionError):
+        cache.add_measurement(Measurement('sensor_id', timestamp_fixture, 1.0))
+    assert cache.entries == 0
+
+
+def test_cache_invalidate(timestamp_fixture):
+    repo = MemoryRepo()
+    cache = CachedRepository(repo)
+    cache.add_measurements(measurements_of('sensor_id', timestamp_fixture, 3))
+    cache.invalidate('sensor_id')
+    assert cache.entries == 0
+    assert len(cache.get_measurements('sensor_id', start=timestamp_fixture)) == 3
+    assert repo.reads == 1
+
+
+def test_cache_metrics(timestamp_fixture):
+    metrics = MetricsRegistry()
+    cache = CachedRepository(MemoryRepo(), metrics=metrics)
+    cache.add_measurements(measurements_of('sensor_id', timestamp_fixture, 3))
+    cache.get_measurements('sensor_id', start=timestamp_fixture)
+    cache.get_measurements('sensor_id')
+
+    assert metrics.get('monitor_cache_hits_total').labels().value == 1
+    assert metrics.get('monitor_cache_misses_total').labels().value == 1
+    assert metrics.get('monitor_cache_entries').labels().value == 3
+
+
+def test_cache_in_front_of_redis(timestamp_fixture, fake_redis_db):
+    cache = CachedRepository(RedisRepository(fake_redis_db), max_size=2)
+    measurements = measurements_of('sensor_id', timestamp_fixture, 4)
+    cache.add_measurements(measurements)
+
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture + 2) == measurements[2:]
+    assert cache.get_measurements('sensor_id', start=timestamp_fixture) == measurements
+
+
+def test_cache_get_measurements_many_reads_only_misses(timestamp_fixture):
+    repo = MemoryRepo()
+    cache = CachedRepository(repo)
+    cached = measurements_of('cached', timestamp_fixture, 3)
+    uncached = measurements_of('uncached', timestamp_fixture, 3)
+    repo.add_measurements(uncached)
+    cache.add_measurements(cached)
+
+    result = cache.get_measurements_many(['uncached', 'cached'], start=timestamp_fixture)
+    assert list(result) == ['uncached', 'cached']
+    assert result == {'uncached': uncached, 'cached': cached}
+    assert repo.reads == 1
+    cache.get_measurements_many(['uncached', 'cached'], start=timestamp_fixture)
+    assert repo.reads == 1
@@ -0,0 +1,109 @@
+import json
+from pathlib import Path
+import subprocess
+import sys
+from threading import Event, Timer
+
+import pytest
+
+import monitor
+from monitor.cli import ConfigError, build_controller, build_repository, load_config, main, poll_once, run
+from monitor.filestore import FileRepository
+from monitor.repository import RedisRepository, ShardedRedisRepository
+
+GOOD_MEASUREMENT = '''bd 00 4b 46 ff ff ff ff ff ff : crc=ff YES
+bd 00 4b 46 ff ff ff ff ff ff t=27772'''
+
+
+def redis_url(client):
+    kwargs = client.connection_pool.connection_kwargs
+    return 'redis://{}:{}/{}'.format(kwargs['host'], kwargs['port'], kwargs.get('db', 0))
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    def write(**sections):
+        devices = tmp_path / 'devices'
+        for name in ('28-0000000000a1', '28-0000000000b2'):
+            (devices / name).mkdir(parents=True, exist_ok=True)
+            (devices / name / 'w1_slave').write_text(GOOD_MEASUREMENT)
+        path = tmp_path / 'monitor.json'
+        path.write_text(json.dumps(dict({'w1_devices_dir': str(devices)}, **sections)))
+        return path
+    return write
+
+
+@pytest.mark.parametrize('module', ['monitor.measurements', 'monitor.sensors', 'monitor.controller', 'monitor.cli'])
+def test_import_does_not_load_heavy_backends(module):
+    source = Path(monitor.__file__).parent.parent
+    code = 'import sys, {}; print(sorted(m for m in ("redis", "numpy", "asyncio", "http.server") if m in sys.modules))'.format(module)
+    output = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True, env={'PYTHONPATH': str(source)}
+        ).stdout
+    assert output.strip() == '[]'
+
+
+@pytest.mark.parametrize('config', [
+    'not json',
+    '[]',
+    '{"repository": "redis://localhost"}',
+    '{"controller": {"batch_size": 10, "colour": "red"}}',
+    ])
+def test_load_config_errors(tmp_path, config):
+    path = tmp_path / 'monitor.json'
+    path.write_text(config)
+    with pytest.raises(ConfigError):
+        load_config(path)
+
+
+def test_build_repository(tmp_path, fake_redis_db, redis_node_1):
+    assert isinstance(build_repository({'repository': {'path': str(tmp_path)}}), FileRepository)
+    assert isinstance(build_repository({'repository': {'url': redis_url(fake_redis_db)}}), RedisRepository)
+    repo = build_repository({'repository': {'urls': [redis_url(fake_redis_db), redis_url(redis_node_1)]}})
+    assert isinstance(repo, ShardedRedisRepository) and len(repo.nodes) == 2
+    repo.close()
+
+
+def test_build_controller(tmp_path):
+    repo = FileRepository(tmp_path / 'store')
+    controller = build_controller({'controller': {'batch_size': 7, 'spool_path': str(tmp_path / 'spool')}}, repo)
+    assert controller._spool is not None and controller._spool.log.directory == tmp_path / 'spool'
+    controller.stop_polling()
+
+
+def test_poll_once_and_read(config_file, tmp_path, capsys, timestamp_fixture):
+    path = config_file(repository={'path': str(tmp_path / 'store')})
+    assert poll_once(path) == 0
+    assert main(['read', str(path), '28-0000000000a1']) == 0
+    assert capsys.readouterr().out == '{}\t27.8\n'.format(timestamp_fixture)
+
+
+def test_poll_counts_failed_sensors(config_file, tmp_path, fake_redis_db):
+    path = config_file(repository={'url': redis_url(fake_redis_db)})
+    (tmp_path / 'devices' / '28-0000000000b2' / 'w1_slave').write_text('bd 00 4b 46 : crc=00 NO')
+    assert main(['poll', str(path)]) == 1
+    repo = RedisRepository(fake_redis_db)
+    assert len(repo.get_measurements('28-0000000000a1')) == 1
+    assert repo.get_measurements('28-0000000000b2') == []
+
+
+def test_run_until_stopped(config_file, tmp_path):
+    path = config_file(repository={'path': str(tmp_path / 'store')}, controller={'batch_size': 1, 'max_workers': 2})
+    stop = Event()
+    Timer(0.5, stop.set).start()
+    run(path, stop)
+    repo = FileRepository(tmp_path / 'store')
+    assert repo.sensor_ids() == ['28-0000000000a1', '28-0000000000b2']
+
+
+def test_main_reports_config_errors(tmp_path, caplog):
+    assert main(['poll', str(tmp_path / 'missing.json')]) == 1
+    assert 'Cannot read config' in caplog.text
+
+
+def test_main_forwards_transfer_commands(config_file, tmp_path, fake_redis_db):
+    path = config_file(repository={'url': redis_url(fake_redis_db)})
+    main(['poll', str(path)])
+    archive = tmp_path / 'history.npz'
+    assert main(['export', '--url', redis_url(fake_redis_db), str(archive)]) == 0
+    assert archive.exists()
@@ -0,0 +1,59 @@
+from datetime import datetime
+import math
+
+import pytest
+
+from monitor.compression import chunk_range, decode_chunk, encode_chunk
+from monitor.serializers import SerializationError
+
+
+def timestamps(count, interval=2.0):
+    start = datetime(2022, 3, 1, 12, 0, 0, 123456).timestamp()
+    return [datetime.fromtimestamp(start + i * interval).timestamp() for i in range(count)]
+
+
+def test_chunk_round_trip():
+    ts = timestamps(500)
+    values = [round(20.0 + (i % 7) * 0.1, 1) for i in range(500)]
+    chunk = encode_chunk(ts, values)
+
+    decoded_timestamps, decoded_values = decode_chunk(chunk)
+    assert list(decoded_timestamps) == ts
+    assert list(decoded_values) == values
+    assert chunk_range(chunk) == (ts[0], ts[-1], 500)
+
+
+def test_chunk_compresses_fixed_interval_stable_values():
+    chunk = encode_chunk(timestamps(1000), [21.5] * 1000)
+    assert len(chunk) < 300  # about 2 bits per measurement after the header
+
+
+def test_chunk_round_trip_of_irregular_timestamps():
+    ts = [1600000000.123456789 + i * 1.37 for i in range(100)]
+    values = [i / 3.0 for i in range(100)]
+    decoded_timestamps, decoded_values = decode_chunk(encode_chunk(ts, values))
+    assert list(decoded_timestamps) == ts
+    assert list(decoded_values) == values
+
+
+def test_chunk_round_trip_of_special_values():
+    values = [math.inf, -math.inf, -0.0, 5e-324, 1e308, 0.0]
+    _, decoded_values = decode_chunk(encode_chunk(timestamps(6), values))
+    assert [repr(value) for value in decoded_values] == [repr(value) for value in values]
+    _, decoded_values = decode_chunk(encode_chunk(timestamps(1), [math.nan]))
+    assert math.isnan(decoded_values[0])
+
+
+def test_empty_chunk():
+    assert [list(column) for column in decode_chunk(encode_chunk([], []))] == [[], []]
+
+
+def test_decode_truncated_chunk():
+    chunk = encode_chunk(timestamps(100), [float(i) for i in range(100)])
+    with pytest.raises(SerializationError):
+        decode_chunk(chunk[:40])
+
+
+def test_decode_unknown_format():
+    with pytest.raises(SerializationError):
+        decode_chunk(b'{"sensor_id": "sensor_id"}')
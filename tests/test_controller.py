@@ -1,7 +1,12 @@
+import threading
 import time
 
+import pytest
+
 from monitor.controller import Controller
+from monitor.policy import DeadbandPolicy
 from monitor.repository import AbstractRepository
+from monitor.rules import CallbackSink, MissingData, RuleEngine, Threshold
 
 
 class FakeRepo(AbstractRepository):
@@ -15,6 +20,18 @@ class FakeRepo(AbstractRepository):
         return [measurement for measurement in self.measurements if measurement.sensor_id == sensor_id]
 
 
+class DownRepo(AbstractRepository):
+    def add_measurement(self, measurement):
+        raise ConnectionError('repository unavailable')
+
+
+def finishes(func, timeout=5.0):
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
 def test_can_add_sensors(temperature_sensor_fixture, humidity_sensor_fixture):
     sensor = temperature_sensor_fixture('sensor_id_1')
     sensor2 = humidity_sensor_fixture('sensor_id_2')
@@ -126,3 +143,281 @@ def test_polling_interval_includes_time_to_take_measurement(temperature_sensor_f
 
     results = repo.get_measurements(sensor.sensor_id)
     assert len(results) == 2
+
+
+def test_measurements_are_buffered_until_stop(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    repo = FakeRepo()
+    c = Controller(repo, batch_size=100, flush_interval=60)
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.6)  # time for 1 measurement
+    assert repo.get_measurements(sensor.sensor_id) == []
+    c.stop_polling()
+
+    assert len(repo.get_measurements(sensor.sensor_id)) == 1
+
+
+def test_can_poll_multiple_sensors_with_scheduler(temperature_sensor_fixture, timestamp_fixture):
+    sensors = [temperature_sensor_fixture('sensor_id_{}'.format(i)) for i in range(4)]
+    repo = FakeRepo()
+    c = Controller(repo, max_workers=4)
+    for sensor in sensors:
+        c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.6)  # time for 1 measurement for each sensor
+    c.stop_polling()
+
+    for sensor in sensors:
+        results = repo.get_measurements(sensor.sensor_id)
+        assert len(results) == 1
+        assert results[0].timestamp == timestamp_fixture
+
+
+def test_can_add_and_remove_sensors_while_polling_with_scheduler(temperature_sensor_fixture):
+    sensor1 = temperature_sensor_fixture('sensor_id_1')
+    sensor2 = temperature_sensor_fixture('sensor_id_2')
+    repo = FakeRepo()
+    c = Controller(repo, max_workers=2)
+    c.add_sensor(sensor1)
+    c.start_polling()
+    c.add_sensor(sensor2)
+    c.remove_sensor(sensor1)
+    time.sleep(0.6)  # time for 1 measurement
+    c.stop_polling()
+
+    assert len(repo.get_measurements(sensor1.sensor_id)) <= 1  # a poll in progress is allowed to finish
+    assert len(repo.get_measurements(sensor2.sensor_id)) == 1
+
+
+def test_scheduler_polling_interval_includes_time_to_take_measurement(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    sensor.measurement_delay = 0.5  # time to take a measurement
+    sensor.polling_interval = 1.0  # polling interval
+    repo = FakeRepo()
+    c = Controller(repo, max_workers=1)
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(1.1)  # time for 2 measurements
+    c.stop_polling()
+
+    results = repo.get_measurements(sensor.sensor_id)
+    assert len(results) == 2
+
+
+def test_polling_skips_missed_polls_when_measurement_overruns(temperature_sensor_fixture):
+    class SlowSensor(temperature_sensor_fixture):
+        def get_measurement(self):
+            time.sleep(0.7)  # takes longer than the polling interval
+            return super().get_measurement()
+
+    sensor = SlowSensor('sensor_id_1')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.5
+    repo = FakeRepo()
+    c = Controller(repo)
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(1.1)  # first poll at 0s, second at 1.0s after skipping the 0.5s slot
+    c.stop_polling()
+
+    results = repo.get_measurements(sensor.sensor_id)
+    assert len(results) == 2
+
+
+def test_controller_records_metrics(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    c = Controller(FakeRepo(), batch_size=1)
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.25)
+    c.stop_polling()
+
+    assert c.metrics.counter('monitor_polls_total', '', ['sensor_id']).labels('sensor_id_1').value == 3
+    assert c.metrics.histogram('monitor_measurement_seconds', '', ['sensor_id']).labels('sensor_id_1').count == 3
+    assert c.metrics.histogram('monitor_repository_write_seconds', '').labels().count == 3
+    assert 'monitor_poll_lateness_seconds_count{sensor_id="sensor_id_1"} 3.0' in c.metrics.exposition()
+
+
+def test_controller_policy_suppresses_unchanged_measurements(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    repo = FakeRepo()
+    c = Controller(repo, batch_size=1, policy=DeadbandPolicy(deadband=0.5))
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.25)
+    c.stop_polling()
+
+    assert len(repo.get_measurements(sensor.sensor_id)) == 1
+    assert c.metrics.counter('monitor_measurements_suppressed_total', '', ['sensor_id']).labels('sensor_id_1').value == 2
+
+
+def test_slow_repository_does_not_delay_polling(temperature_sensor_fixture):
+    class SlowRepo(FakeRepo):
+        def add_measurements(self, measurements):
+            time.sleep(0.5)  # a slow or unreachable repository
+            super().add_measurements(measurements)
+
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    repo = SlowRepo()
+    c = Controller(repo, batch_size=1)
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.55)  # time for 6 polls
+    polls = c.metrics.get('monitor_polls_total').labels(sensor.sensor_id).value
+    c.stop_polling()
+
+    assert polls == 6
+    assert len(repo.get_measurements(sensor.sensor_id)) == 6
+
+
+def test_polling_thread_survives_sensor_errors(temperature_sensor_fixture):
+    class BrokenSensor(temperature_sensor_fixture):
+        def get_measurement(self):
+            raise ConnectionError('sensor unavailable')
+
+    sensor = BrokenSensor('sensor_id_1')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    c = Controller(FakeRepo())
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.35)
+    c.stop_polling()
+
+    assert c.metrics.get('monitor_poll_errors_total').labels(sensor.sensor_id).value == 4
+
+
+def test_can_add_and_remove_sensors_in_bulk(temperature_sensor_fixture):
+    sensors = [temperature_sensor_fixture('sensor_id_{}'.format(i)) for i in range(1000)]
+    c = Controller(FakeRepo())
+    c.add_sensors(sensors)
+    assert c.sensors == sensors
+    assert c.get_sensor('sensor_id_10') is sensors[10]
+
+    assert c.remove_sensors(sensors[:500] + [temperature_sensor_fixture('unknown')]) == 500
+    assert c.sensors == sensors[500:]
+    assert c.get_sensor('sensor_id_10') is None
+
+
+def test_adding_sensor_with_same_id_replaces_it(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    replacement = temperature_sensor_fixture('sensor_id_1')
+    c = Controller(FakeRepo())
+    c.add_sensor(sensor)
+    c.add_sensor(replacement)
+    assert c.sensors == [replacement]
+
+
+def test_can_add_and_remove_sensors_while_polling_with_threads(temperature_sensor_fixture):
+    sensor1 = temperature_sensor_fixture('sensor_id_1')
+    sensor2 = temperature_sensor_fixture('sensor_id_2')
+    for sensor in (sensor1, sensor2):
+        sensor.measurement_delay = 0.0
+        sensor.polling_interval = 0.1
+    repo = FakeRepo()
+    c = Controller(repo)
+    c.add_sensor(sensor1)
+    c.start_polling()
+    time.sleep(0.05)
+    c.remove_sensor(sensor1)
+    c.add_sensor(sensor2)
+    time.sleep(0.25)  # time for 3 measurements of the added sensor
+    c.stop_polling()
+
+    assert len(repo.get_measurements(sensor1.sensor_id)) == 1
+    assert len(repo.get_measurements(sensor2.sensor_id)) == 3
+    assert c.sensors == [sensor2]
+
+
+def test_rules_see_every_measurement_including_suppressed(temperature_sensor_fixture):
+    alerts = []
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    rules = RuleEngine([Threshold('hot', above=0.5), MissingData('stale', timeout=60.0)], [CallbackSink(alerts.append)])
+    c = Controller(FakeRepo(), policy=DeadbandPolicy(deadband=1.0), rules=rules)
+    c.add_sensor(sensor)
+    c.take_measurement(sensor)
+    c.take_measurement(sensor)
+    rules.start()
+    rules.stop()
+    assert c.metrics.counter('monitor_measurements_suppressed_total', '', ['sensor_id']).labels('sensor_id_1').value == 1
+    assert [alert.rule for alert in alerts] == ['hot']
+    assert rules.check(now=time.time() + 120)[0].rule == 'stale'
+    c.remove_sensor(sensor)
+    assert rules.check(now=time.time() + 240) == []
+
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_stop_polling_with_repository_down_and_full_queue(temperature_sensor_fixture, max_workers):
+    sensors = [temperature_sensor_fixture('sensor_id_{}'.format(i)) for i in range(3)]
+    for sensor in sensors:
+        sensor.measurement_delay = 0.0
+        sensor.polling_interval = 0.01
+    c = Controller(DownRepo(), batch_size=4, queue_size=4, max_workers=max_workers)
+    c.add_sensors(sensors)
+    c.start_polling()
+    time.sleep(0.2)  # pollers are waiting for room in the full queue
+    assert finishes(lambda: c.remove_sensor(sensors[0]))
+    assert finishes(c.stop_polling)
+
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_removed_and_stopped_sensors_are_closed(temperature_sensor_fixture, max_workers):
+    class ClosingSensor(temperature_sensor_fixture):
+        closed = 0
+
+        def close(self):
+            self.closed += 1
+
+    sensors = [ClosingSensor('sensor_id_{}'.format(i)) for i in range(2)]
+    for sensor in sensors:
+        sensor.measurement_delay = 0.0
+        sensor.polling_interval = 0.05
+    c = Controller(FakeRepo(), max_workers=max_workers)
+    c.add_sensors(sensors)
+    c.start_polling()
+    time.sleep(0.1)
+    c.remove_sensor(sensors[0])
+    time.sleep(0.1)
+    assert [sensor.closed for sensor in sensors] == [1, 0]
+    c.stop_polling()
+    assert [sensor.closed for sensor in sensors] == [1, 1]
+
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_adding_same_sensor_again_keeps_polling_it_once(temperature_sensor_fixture, max_workers):
+    class CountingSensor(temperature_sensor_fixture):
+        closed = 0
+        active = 0
+        most_active = 0
+
+        def get_measurement(self):
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+            try:
+                return super().get_measurement()
+            finally:
+                self.active -= 1
+
+        def close(self):
+            self.closed += 1
+
+    sensor = CountingSensor('sensor_id_1')
+    sensor.measurement_delay = 0.1
+    sensor.polling_interval = 0.1
+    c = Controller(FakeRepo(), max_workers=max_workers)
+    c.add_sensor(sensor)
+    c.start_polling()
+    time.sleep(0.05)
+    c.add_sensor(sensor)
+    time.sleep(0.3)
+    assert sensor.closed == 0
+    c.stop_polling()
+    assert sensor.most_active == 1
+    assert sensor.closed == 1
@@ -0,0 +1,159 @@
+from pathlib import Path
+
+import pytest
+
+from monitor.filestore import FileRepository
+from monitor.measurements import Measurement
+
+START = 1_600_000_000.0
+
+
+def readings(count, step=1.0, sensor_id='sensor_id', start=START):
+    return [Measurement(sensor_id, start + i * step, float(i)) for i in range(count)]
+
+
+@pytest.fixture
+def repo(tmpdir):
+    repo = FileRepository(Path(tmpdir), window=100.0, buffer_size=10, index_interval=4)
+    yield repo
+    repo.close()
+
+
+def test_file_repository_get_measurements(repo):
+    measurements = readings(25)
+    repo.add_measurements(measurements)
+    assert repo.get_measurements('sensor_id') == measurements
+
+
+def test_file_repository_only_returns_sensor(repo):
+    measurements1 = readings(5, sensor_id='sensor_id_1')
+    measurements2 = readings(5, sensor_id='sensor_id_2')
+    for m1, m2 in zip(measurements1, measurements2):
+        repo.add_measurement(m1)
+        repo.add_measurement(m2)
+    assert repo.get_measurements('sensor_id_1') == measurements1
+    assert repo.get_measurements('sensor_id_2') == measurements2
+    assert repo.sensor_ids() == ['sensor_id_1', 'sensor_id_2']
+
+
+@pytest.mark.parametrize('start, end', [(None, None), (3, None), (None, 17), (4, 12), (4.5, 12.5), (-5, 500), (30, 40), (0, 0)])
+def test_file_repository_range(repo, start, end):
+    measurements = readings(30)
+    repo.add_measurements(measurements)
+    repo.flush()
+    start_ts = None if start is None else START + start
+    end_ts = None if end is None else START + end
+    expected = [m for m in measurements if (start_ts is None or m.timestamp >= start_ts) and (end_ts is None or m.timestamp <= end_ts)]
+    assert repo.get_measurements('sensor_id', start_ts, end_ts) == expected
+
+
+def test_file_repository_limit(repo):
+    measurements = readings(30)
+    repo.add_measurements(measurements)
+    assert repo.get_measurements('sensor_id', START + 5, limit=10) == measurements[5:15]
+
+
+def test_file_repository_spans_segments(tmpdir):
+    repo = FileRepository(Path(tmpdir), window=10.0, buffer_size=1000)
+    measurements = readings(35)
+    repo.add_measurements(measurements)
+    assert repo.get_measurements('sensor_id', START + 8, START + 22) == measurements[8:23]
+    repo.close()
+    assert len(list((Path(tmpdir) / 'sensor_id').iterdir())) == 4
+
+
+def test_file_repository_bounds_open_segments(tmpdir):
+    repo = FileRepository(Path(tmpdir), window=1.0, max_open_segments=3)
+    measurements = readings(20)
+    repo.add_measurements(measurements)
+    assert repo.get_measurements('sensor_id') == measurements
+    assert len(repo._segments) == 3
+    assert repo.get_measurements('sensor_id', START + 17) == measurements[17:]
+    assert list(repo._segments) == [Path(tmpdir) / 'sensor_id' / '{}.seg'.format(int(START) + i) for i in (17, 18, 19)]
+    repo.close()
+
+
+def test_file_repository_batch_is_view_over_segment(repo):
+    repo.add_measurements(readings(30))
+    batch = repo.get_measurement_batch('sensor_id', START + 5, START + 9)
+    assert isinstance(batch.timestamps, memoryview)
+    assert list(batch.values) == [5.0, 6.0, 7.0, 8.0, 9.0]
+
+
+def test_file_repository_out_of_order_writes(repo):
+    measurements = readings(20)
+    repo.add_measurements(measurements[10:])
+    repo.flush()
+    repo.add_measurements(measurements[:10])
+    repo.flush()
+    assert repo.get_measurements('sensor_id') == measurements
+
+
+def test_file_repository_reads_buffered_measurements(tmpdir):
+    repo = FileRepository(Path(tmpdir), buffer_size=1000)
+    measurement = Measurement('sensor_id', START, 1.0)
+    repo.add_measurement(measurement)
+    assert repo.get_measurements('sensor_id') == [measurement]
+
+
+def test_file_repository_persists(tmpdir):
+    measurements = readings(15)
+    repo = FileRepository(Path(tmpdir), buffer_size=1000)
+    repo.add_measurements(measurements)
+    repo.close()
+
+    assert FileRepository(Path(tmpdir)).get_measurements('sensor_id') == measurements
+
+
+def test_file_repository_ignores_partial_record(tmpdir):
+    measurements = readings(3)
+    repo = FileRepository(Path(tmpdir))
+    repo.add_measurements(measurements)
+    repo.close()
+    segment = next((Path(tmpdir) / 'sensor_id').iterdir())
+    with open(segment, 'ab') as f:
+        f.write(b'\x00' * 5)
+
+    repo = FileRepository(Path(tmpdir))
+    assert repo.get_measurements('sensor_id') == measurements
+
+    more = readings(3, start=START + 3)
+    repo.add_measurements(more)
+    assert repo.get_measurements('sensor_id') == measurements + more
+
+
+@pytest.mark.parametrize('window', [0.5, 90.5, 0.0, -60.0])
+def test_file_repository_rejects_fractional_window(tmpdir, window):
+    with pytest.raises(ValueError):
+        FileRepository(Path(tmpdir), window=window)
+
+
+def test_file_repository_sensor_ids_are_escaped(tmpdir):
+    repo = FileRepository(Path(tmpdir))
+    measurement = Measurement('bus/28-0000', START, 1.0)
+    repo.add_measurement(measurement)
+    repo.flush()
+    assert repo.get_measurements('bus/28-0000') == [measurement]
+    assert repo.sensor_ids() == ['bus/28-0000']
+
+
+def test_file_repository_get_measurements_many(repo):
+    measurements = {sensor_id: readings(20, sensor_id=sensor_id) for sensor_id in ('sensor_id_1', 'sensor_id_2', 'sensor_id_3')}
+    for sensor_measurements in measurements.values():
+        repo.add_measurements(sensor_measurements)
+
+    result = repo.get_measurements_many(['sensor_id_3', 'sensor_id_1', 'sensor_id_2', 'sensor_id_1'], start=START + 5, limit=10)
+    assert list(result) == ['sensor_id_3', 'sensor_id_1', 'sensor_id_2']
+    assert all(result[sensor_id] == measurements[sensor_id][5:15] for sensor_id in result)
+
+
+def test_file_repository_iter_measurements(repo):
+    measurements = readings(30, step=2.0, sensor_id='sensor_id_1') + readings(30, step=3.0, sensor_id='sensor_id_2')
+    repo.add_measurements(measurements)
+
+    chunks = list(repo.iter_measurements(['sensor_id_1', 'sensor_id_2'], start=START + 10, end=START + 80, chunk_size=7))
+    expected = sorted(
+        (m for m in measurements if START + 10 <= m.timestamp <= START + 80), key=lambda m: (m.timestamp, m.sensor_id)
+        )
+    assert all(len(chunk) == 7 for chunk in chunks[:-1])
+    assert [m for chunk in chunks for m in chunk] == expected
@@ -1,4 +1,8 @@
-from monitor.measurements import Measurement
+from array import array
+
+import pytest
+
+from monitor.measurements import Measurement, MeasurementBatch
 
 
 def test_measurement_init(timestamp_fixture):
@@ -18,3 +22,50 @@ def test_measurement_ne(timestamp_fixture):
     m1 = Measurement('sensor_id', timestamp_fixture, 1.0)
     m2 = Measurement('sensor_id', timestamp_fixture, 2.0)
     assert m1 != m2
+
+
+def test_measurement_has_no_dict(timestamp_fixture):
+    m = Measurement('sensor_id', timestamp_fixture, 1.0)
+    assert not hasattr(m, '__dict__')
+
+
+def test_measurement_batch_iterates_as_measurements(timestamp_fixture):
+    measurements = [Measurement('sensor_id_{}'.format(i % 2), timestamp_fixture + i, float(i)) for i in range(4)]
+    batch = MeasurementBatch(measurements)
+    assert len(batch) == 4
+    assert list(batch) == measurements
+    assert batch[1] == measurements[1]
+    assert batch[-1] == measurements[-1]
+    assert batch == measurements
+    assert batch.dictionary == ['sensor_id_0', 'sensor_id_1']
+
+
+def test_measurement_batch_slice(timestamp_fixture):
+    measurements = [Measurement('sensor_id_{}'.format(i % 2), timestamp_fixture + i, float(i)) for i in range(4)]
+    batch = MeasurementBatch(measurements)
+    assert batch[1:3] == measurements[1:3]
+
+
+def test_measurement_batch_from_columns(timestamp_fixture):
+    timestamps = array('d', [timestamp_fixture, timestamp_fixture + 1])
+    values = array('d', [1.0, 2.0])
+    batch = MeasurementBatch.from_columns('sensor_id', timestamps, values)
+    assert batch.timestamps is timestamps
+    assert batch == [Measurement('sensor_id', timestamp_fixture, 1.0), Measurement('sensor_id', timestamp_fixture + 1, 2.0)]
+
+    batch.append(Measurement('sensor_id_2', timestamp_fixture + 2, 3.0))
+    assert batch[2] == Measurement('sensor_id_2', timestamp_fixture + 2, 3.0)
+    assert batch.sensor_id(0) == 'sensor_id'
+
+
+def test_measurement_batch_from_columns_length_mismatch(timestamp_fixture):
+    with pytest.raises(ValueError):
+        MeasurementBatch.from_columns('sensor_id', array('d', [timestamp_fixture]), array('d'))
+
+
+def test_measurement_batch_to_numpy(timestamp_fixture):
+    batch = MeasurementBatch([Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(3)])
+    columns = batch.to_numpy()
+    assert list(columns['timestamps']) == [timestamp_fixture, timestamp_fixture + 1, timestamp_fixture + 2]
+    assert list(columns['values']) == [0.0, 1.0, 2.0]
+    assert list(columns['codes']) == [0, 0, 0]
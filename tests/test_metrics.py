@@ -0,0 +1,83 @@
+from urllib.request import urlopen
+
+import pytest
+
+from monitor.metrics import MetricsRegistry, MetricsServer
+
+
+def test_counter_counts_per_label():
+    registry = MetricsRegistry()
+    counter = registry.counter('polls_total', 'Polls', ['sensor_id'])
+    counter.labels('sensor_1').inc()
+    counter.labels('sensor_1').inc(2)
+    counter.labels('sensor_2').inc()
+
+    assert counter.labels('sensor_1').value == 3
+    assert [(s.labels, s.value) for s in registry.collect()] == [({'sensor_id': 'sensor_1'}, 3), ({'sensor_id': 'sensor_2'}, 1)]
+
+
+def test_counter_cannot_decrease():
+    counter = MetricsRegistry().counter('polls_total', 'Polls')
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+
+
+def test_registry_returns_existing_metric():
+    registry = MetricsRegistry()
+    assert registry.counter('polls_total', 'Polls') is registry.counter('polls_total', 'Polls')
+    with pytest.raises(ValueError):
+        registry.histogram('polls_total', 'Polls')
+
+
+def test_histogram_buckets():
+    histogram = MetricsRegistry().histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    with histogram.time():
+        pass
+
+    samples = {(s.name, s.labels.get('le')): s.value for s in histogram.collect()}
+    assert samples[('latency_seconds_bucket', '0.1')] == 3
+    assert samples[('latency_seconds_bucket', '1.0')] == 4
+    assert samples[('latency_seconds_bucket', '+Inf')] == 5
+    assert samples[('latency_seconds_count', None)] == 5
+    assert samples[('latency_seconds_sum', None)] == pytest.approx(2.65, abs=0.01)
+
+
+def test_gauge_reads_function():
+    queue = [1, 2, 3]
+    gauge = MetricsRegistry().gauge('queue_depth', 'Queue depth')
+    gauge.set_function(lambda: len(queue))
+    queue.pop()
+    assert gauge.labels().value == 2
+
+
+def test_exposition_format():
+    registry = MetricsRegistry()
+    registry.counter('polls_total', 'Polls', ['sensor_id']).labels('a"b').inc()
+    registry.histogram('latency_seconds', 'Latency', buckets=(1.0,)).observe(0.5)
+
+    assert registry.exposition() == '\n'.join([
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="1.0"} 1.0',
+        'latency_seconds_bucket{le="+Inf"} 1.0',
+        'latency_seconds_sum 0.5',
+        'latency_seconds_count 1.0',
+        '# HELP polls_total Polls',
+        '# TYPE polls_total counter',
+        'polls_total{sensor_id="a\\"b"} 1.0',
+        ]) + '\n'
+
+
+def test_metrics_server_serves_exposition():
+    registry = MetricsRegistry()
+    registry.counter('polls_total', 'Polls').inc()
+    server = MetricsServer(registry, port=0)
+    server.start()
+    try:
+        with urlopen('http://127.0.0.1:{}/metrics'.format(server.port)) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert response.read().decode() == registry.exposition()
+    finally:
+        server.stop()
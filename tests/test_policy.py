@@ -0,0 +1,59 @@
+import pytest
+
+from monitor.measurements import Measurement
+from monitor.policy import DeadbandPolicy, PollingPolicy
+
+
+@pytest.fixture
+def sensor(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    sensor.measurement_delay = 0.5
+    sensor.polling_interval = 1.0
+    yield sensor
+
+
+def test_polling_policy_stores_everything(sensor, timestamp_fixture):
+    policy = PollingPolicy()
+    decision = policy.observe(sensor, Measurement('sensor_id', timestamp_fixture, 1.0))
+    assert decision.store
+    assert decision.interval == 1.0
+
+
+def test_deadband_suppresses_small_changes(sensor, timestamp_fixture):
+    policy = DeadbandPolicy(deadband=0.5)
+    values = [20.0, 20.2, 20.4, 20.6, 20.1, 19.9]
+    stored = [
+        value for i, value in enumerate(values)
+        if policy.observe(sensor, Measurement('sensor_id', timestamp_fixture + i, value)).store
+        ]
+    assert stored == [20.0, 20.6, 19.9]
+
+
+def test_deadband_sends_heartbeat(sensor, timestamp_fixture):
+    policy = DeadbandPolicy(deadband=0.5, max_silence=10.0)
+    stored = [i for i in range(25) if policy.observe(sensor, Measurement('sensor_id', timestamp_fixture + i, 20.0)).store]
+    assert stored == [0, 10, 20]
+
+
+def test_deadband_backs_off_when_stable_and_speeds_up_on_change(sensor, timestamp_fixture):
+    policy = DeadbandPolicy(deadband=0.5, max_interval=6.0)
+    intervals = [
+        policy.observe(sensor, Measurement('sensor_id', timestamp_fixture + i, value)).interval
+        for i, value in enumerate([20.0, 20.0, 20.0, 20.0, 20.0, 25.0, 25.0])
+        ]
+    assert intervals == [1.0, 2.0, 4.0, 6.0, 6.0, 1.0, 2.0]
+    assert policy.interval(sensor) == 2.0
+
+    policy.reset('sensor_id')
+    assert policy.interval(sensor) == 1.0
+
+
+def test_deadband_interval_is_not_less_than_measurement_delay(sensor, timestamp_fixture):
+    policy = DeadbandPolicy(min_interval=0.1)
+    assert policy.observe(sensor, Measurement('sensor_id', timestamp_fixture, 20.0)).interval == 0.5
+
+
+def test_deadband_interval_does_not_exceed_max_silence(sensor, timestamp_fixture):
+    policy = DeadbandPolicy(max_interval=60.0, max_silence=3.0)
+    intervals = [policy.observe(sensor, Measurement('sensor_id', timestamp_fixture + i, 20.0)).interval for i in range(4)]
+    assert intervals == [1.0, 2.0, 3.0, 3.0]
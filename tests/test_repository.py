@@ -1,15 +1,16 @@
-import sys
+import asyncio
+from dataclasses import asdict
+import json
+import threading
 
-from pytest_redis import factories
+import pytest
+from redis.asyncio import Redis as AsyncRedis
 
-from monitor.repository import RedisRepository
+from monitor import repository
+from monitor.compression import decode_chunk
+from monitor.repository import chunk_key, key_slot, RedisRepository, RedisSensorIdDictionary, sensor_key, ShardedRedisRepository
 from monitor.measurements import Measurement
-
-if sys.platform == 'darwin':  # local testing on mac
-    redis_my_proc = factories.redis_proc(executable='/usr/local/bin/redis-server', port=None, datadir='/tmp/pytest')
-    fake_redis_db = factories.redisdb('redis_my_proc')
-else:  # CI testing. Redis is already running on port 6379
-    fake_redis_db = factories.redisdb('redis_nooproc')
+from monitor.serializers import BinarySerializer
 
 
 def test_redis_repository_get_measurements(timestamp_fixture, fake_redis_db):
@@ -36,3 +37,354 @@ def test_redis_repository_pop_measurements(timestamp_fixture, fake_redis_db):
 
     popped3 = repo.pop_measurement()
     assert popped3 is None
+
+
+def test_redis_repository_get_measurements_only_returns_sensor(timestamp_fixture, fake_redis_db):
+    measurement1 = Measurement('sensor_id_1', timestamp_fixture, 1.0)
+    measurement2 = Measurement('sensor_id_2', timestamp_fixture, 2.0)
+    repo = RedisRepository(fake_redis_db)
+
+    repo.add_measurement(measurement1)
+    repo.add_measurement(measurement2)
+    assert repo.get_measurements('sensor_id_1') == [measurement1]
+    assert repo.get_measurements('sensor_id_2') == [measurement2]
+
+
+def test_redis_repository_get_measurements_in_range(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(10)]
+    repo = RedisRepository(fake_redis_db)
+    for measurement in reversed(measurements):
+        repo.add_measurement(measurement)
+
+    assert repo.get_measurements('sensor_id') == measurements
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 3) == measurements[3:]
+    assert repo.get_measurements('sensor_id', end=timestamp_fixture + 3) == measurements[:4]
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 2, end=timestamp_fixture + 5) == measurements[2:6]
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 2, limit=3) == measurements[2:5]
+
+
+def test_redis_repository_pop_does_not_remove_history(timestamp_fixture, fake_redis_db):
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.0)
+    repo = RedisRepository(fake_redis_db)
+
+    repo.add_measurement(measurement)
+    assert repo.pop_measurement() == measurement
+    assert repo.get_measurements('sensor_id') == [measurement]
+
+
+def test_redis_repository_migrate_measurements(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id_{}'.format(i % 2), timestamp_fixture + i, float(i)) for i in range(5)]
+    for measurement in measurements:
+        fake_redis_db.rpush('measurements', json.dumps(asdict(measurement)))
+    repo = RedisRepository(fake_redis_db)
+
+    assert repo.migrate_measurements(batch_size=2) == 5
+    assert repo.migrate_measurements(batch_size=2) == 5
+    assert repo.get_measurements('sensor_id_0') == measurements[0::2]
+    assert repo.get_measurements('sensor_id_1') == measurements[1::2]
+    assert fake_redis_db.llen('measurements') == 5
+
+
+def test_redis_repository_add_measurements(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id_{}'.format(i % 2), timestamp_fixture + i, float(i)) for i in range(4)]
+    repo = RedisRepository(fake_redis_db)
+
+    repo.add_measurements(measurements)
+    assert repo.get_measurements('sensor_id_0') == measurements[0::2]
+    assert repo.get_measurements('sensor_id_1') == measurements[1::2]
+    assert [repo.pop_measurement() for _ in range(4)] == measurements
+
+
+def test_redis_repository_async_add_and_get_measurements(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(3)]
+    kwargs = fake_redis_db.connection_pool.connection_kwargs
+
+    async def run():
+        async_client = AsyncRedis(host=kwargs['host'], port=kwargs['port'], db=kwargs['db'])
+        repo = RedisRepository(fake_redis_db, async_client)
+        await repo.async_add_measurements(measurements)
+        result = await repo.async_get_measurements('sensor_id', start=timestamp_fixture + 1)
+        await async_client.close()
+        return result
+
+    assert asyncio.run(run()) == measurements[1:]
+    assert RedisRepository(fake_redis_db).get_measurements('sensor_id') == measurements
+
+
+def test_redis_repository_async_add_measurement_without_async_client(timestamp_fixture, fake_redis_db):
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.0)
+    repo = RedisRepository(fake_redis_db)
+
+    asyncio.run(repo.async_add_measurement(measurement))
+    assert repo.get_measurements('sensor_id') == [measurement]
+
+
+def test_redis_repository_binary_serializer(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id_{}'.format(i % 2), timestamp_fixture + i, float(i)) for i in range(4)]
+    writer = RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db)))
+    writer.add_measurements(measurements)
+
+    reader = RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db)))
+    assert reader.get_measurements('sensor_id_0') == measurements[0::2]
+    assert reader.get_measurements('sensor_id_1') == measurements[1::2]
+    assert reader.pop_measurement() == measurements[0]
+
+
+def test_redis_repository_binary_serializer_reads_data_after_restart(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id_{}'.format(i % 3), timestamp_fixture + i, float(i)) for i in range(6)]
+    RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db))).add_measurements(measurements[:4])
+
+    restarted = RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db)))
+    restarted.add_measurements(measurements[4:] + [Measurement('sensor_id_3', timestamp_fixture, 1.0)])
+    assert restarted.get_measurements('sensor_id_3') == [Measurement('sensor_id_3', timestamp_fixture, 1.0)]
+    assert restarted.get_measurements('sensor_id_0') == measurements[0::3]
+    assert restarted.get_measurements('sensor_id_1') == measurements[1::3]
+    assert restarted.get_measurements('sensor_id_2') == measurements[2::3]
+
+
+def test_redis_repository_binary_serializer_reads_json_data(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(4)]
+    RedisRepository(fake_redis_db).add_measurements(measurements[:2])
+    repo = RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db)))
+    repo.add_measurements(measurements[2:])
+
+    assert repo.get_measurements('sensor_id') == measurements
+
+
+def test_redis_repository_get_measurement_batch(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(5)]
+    repo = RedisRepository(fake_redis_db, serializer=BinarySerializer(RedisSensorIdDictionary(fake_redis_db)))
+    repo.add_measurements(measurements)
+
+    batch = repo.get_measurement_batch('sensor_id', start=timestamp_fixture + 1, limit=3)
+    assert batch == measurements[1:4]
+    assert list(batch.values) == [1.0, 2.0, 3.0]
+
+
+def test_redis_consumer_reads_in_batches(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(5)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+    consumer = repo.consumer('worker_1')
+
+    assert [d.measurement for d in consumer.read(count=3)] == measurements[:3]
+    assert [d.measurement for d in consumer.read(count=3)] == measurements[3:]
+    assert consumer.read(count=3) == []
+
+
+def test_redis_consumer_ack(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(3)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+    consumer = repo.consumer('worker_1')
+
+    deliveries = consumer.read(count=3)
+    assert [d.measurement for d in consumer.pending()] == measurements
+    assert consumer.ack(deliveries[:2]) == 2
+    assert [d.measurement for d in consumer.pending()] == measurements[2:]
+    assert repo.consumer_names() == ['worker_1']
+    consumer.ack(deliveries[2:])
+    assert repo.consumer_names() == []
+
+
+def test_redis_consumer_recover_after_crash(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(4)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+
+    repo.consumer('worker_1').read(count=2)  # crashes before acknowledging
+    assert repo.consumer('worker_1').recover() == 2
+
+    deliveries = repo.consumer('worker_2').read(count=10)
+    assert [d.measurement for d in deliveries] == measurements
+
+
+def test_redis_consumers_compete(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(10)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+    consumers = [repo.consumer('worker_{}'.format(i)) for i in range(3)]
+
+    received = []
+    while True:
+        batches = [consumer.read(count=2) for consumer in consumers]
+        if not any(batches):
+            break
+        for consumer, batch in zip(consumers, batches):
+            received.extend(d.measurement for d in batch)
+            consumer.ack(batch)
+    assert sorted(received, key=lambda m: m.timestamp) == measurements
+
+
+def test_redis_consumer_blocking_read(timestamp_fixture, fake_redis_db):
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.0)
+    repo = RedisRepository(fake_redis_db)
+    consumer = repo.consumer('worker_1')
+    assert consumer.read(count=10, block=0.1) == []
+
+    timer = threading.Timer(0.1, repo.add_measurement, args=(measurement,))
+    timer.start()
+    deliveries = consumer.read(count=10, block=2)
+    timer.join()
+    assert [d.measurement for d in deliveries] == [measurement]
+
+
+def test_redis_repository_compact_keeps_measurements_readable(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i % 3)) for i in range(25)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+
+    assert repo.compact(older_than=timestamp_fixture + 20, chunk_size=8) == 20
+    assert fake_redis_db.zcard(sensor_key('sensor_id')) == 5
+    assert fake_redis_db.zcard(chunk_key('sensor_id')) == 3
+    assert repo.get_measurements('sensor_id') == measurements
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 6, end=timestamp_fixture + 21) == measurements[6:22]
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 18, limit=4) == measurements[18:22]
+    assert repo.get_measurement_batch('sensor_id', end=timestamp_fixture + 9) == measurements[:10]
+    assert repo.compact(older_than=timestamp_fixture + 20) == 0
+
+
+def test_redis_repository_reads_late_measurements_after_compaction(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(10)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements[:4] + measurements[5:])
+    repo.compact(older_than=timestamp_fixture + 100)
+    repo.add_measurement(measurements[4])
+    repo.compact(older_than=timestamp_fixture + 100)
+
+    assert repo.get_measurements('sensor_id') == measurements
+    assert repo.get_measurements('sensor_id', limit=6) == measurements[:6]
+
+
+def test_redis_repository_decodes_only_chunks_needed(timestamp_fixture, fake_redis_db, monkeypatch):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(1000)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements[:500] + measurements[501:])
+    repo.compact(older_than=timestamp_fixture + 1000, chunk_size=10)
+    repo.add_measurement(measurements[500])  # late, compacted into a chunk spanning the whole history
+    repo.compact(older_than=timestamp_fixture + 1000)
+    decoded = []
+    monkeypatch.setattr(repository, 'decode_chunk', lambda chunk: decoded.append(chunk) or decode_chunk(chunk))
+
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 100, limit=10) == measurements[100:110]
+    assert len(decoded) == 1
+    decoded.clear()
+    assert repo.get_measurements('sensor_id', start=timestamp_fixture + 495, end=timestamp_fixture + 504) == measurements[495:505]
+    assert len(decoded) == 3
+    decoded.clear()
+    assert repo.get_measurement_batch('sensor_id', start=timestamp_fixture + 495, limit=10) == measurements[495:505]
+    assert len(decoded) == 3
+
+
+def test_redis_repository_async_get_measurements_reads_chunks(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, 1.0) for i in range(5)]
+    kwargs = fake_redis_db.connection_pool.connection_kwargs
+    RedisRepository(fake_redis_db).add_measurements(measurements)
+    RedisRepository(fake_redis_db).compact(older_than=timestamp_fixture + 3)
+
+    async def run():
+        async_client = AsyncRedis(host=kwargs['host'], port=kwargs['port'], db=kwargs['db'])
+        repo = RedisRepository(fake_redis_db, async_client)
+        result = await repo.async_get_measurements('sensor_id', start=timestamp_fixture + 1)
+        await async_client.close()
+        return result
+
+    assert asyncio.run(run()) == measurements[1:]
+
+
+def test_key_slot_matches_redis_cluster():
+    assert key_slot('123456789') == 12739
+    assert key_slot('{user1000}.following') == key_slot('{user1000}.followers') == key_slot('user1000')
+    assert key_slot('foo{}{bar}') != key_slot('bar')  # an empty hash tag hashes the whole key
+    assert key_slot(sensor_key('sensor_id')) == key_slot(chunk_key('sensor_id')) == key_slot('sensor_id')
+
+
+@pytest.fixture
+def sharded_repo(fake_redis_db, redis_node_1, redis_node_2):
+    repo = ShardedRedisRepository([RedisRepository(client) for client in (fake_redis_db, redis_node_1, redis_node_2)])
+    yield repo
+    repo.close()
+
+
+def test_sharded_redis_repository_spreads_sensors_over_nodes(timestamp_fixture, sharded_repo):
+    measurements = [Measurement('sensor_id_{}'.format(i % 30), timestamp_fixture + i, float(i)) for i in range(90)]
+    sharded_repo.add_measurements(measurements)
+
+    for node in sharded_repo.nodes:
+        stored = node.redis_client.smembers('sensors')
+        assert stored
+        assert all(sharded_repo.node_for(sensor_id.decode()) is node for sensor_id in stored)
+    assert sharded_repo.get_measurements('sensor_id_7') == measurements[7::30]
+    assert sharded_repo.get_measurement_batch('sensor_id_7', start=timestamp_fixture + 10) == measurements[37::30]
+
+
+def test_sharded_redis_repository_get_measurements_many(timestamp_fixture, sharded_repo):
+    measurements = [Measurement('sensor_id_{}'.format(i % 10), timestamp_fixture + i, float(i)) for i in range(40)]
+    sharded_repo.add_measurements(measurements)
+    sharded_repo.compact(older_than=timestamp_fixture + 20)
+
+    result = sharded_repo.get_measurements_many(['sensor_id_{}'.format(i) for i in range(10)] + ['unknown'], limit=3)
+    assert result['unknown'] == []
+    for i in range(10):
+        assert result['sensor_id_{}'.format(i)] == measurements[i::10][:3]
+
+
+def test_sharded_redis_repository_pop_measurement_drains_every_node(timestamp_fixture, sharded_repo):
+    measurements = [Measurement('sensor_id_{}'.format(i), timestamp_fixture, float(i)) for i in range(12)]
+    sharded_repo.add_measurements(measurements)
+
+    popped = [sharded_repo.pop_measurement() for _ in range(12)]
+    assert sorted(popped, key=lambda measurement: measurement.value) == measurements
+    assert sharded_repo.pop_measurement() is None
+
+
+def test_sharded_redis_repository_async(timestamp_fixture, fake_redis_db, redis_node_1):
+    measurements = [Measurement('sensor_id_{}'.format(i), timestamp_fixture, float(i)) for i in range(6)]
+    clients = [client.connection_pool.connection_kwargs for client in (fake_redis_db, redis_node_1)]
+
+    async def run():
+        async_clients = [AsyncRedis(host=kwargs['host'], port=kwargs['port'], db=kwargs['db']) for kwargs in clients]
+        repo = ShardedRedisRepository([
+            RedisRepository(client, async_client) for client, async_client in zip((fake_redis_db, redis_node_1), async_clients)
+            ])
+        await repo.async_add_measurements(measurements)
+        result = [await repo.async_get_measurements(measurement.sensor_id) for measurement in measurements]
+        for async_client in async_clients:
+            await async_client.close()
+        return result
+
+    assert asyncio.run(run()) == [[measurement] for measurement in measurements]
+
+
+def test_redis_repository_get_measurements_many(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id_{}'.format(i % 3), timestamp_fixture + i, float(i)) for i in range(12)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+    repo.compact(older_than=timestamp_fixture + 4)
+
+    result = repo.get_measurements_many(['sensor_id_0', 'sensor_id_2', 'unknown'], start=timestamp_fixture + 1)
+    assert result == {'sensor_id_0': measurements[3::3], 'sensor_id_2': measurements[2::3], 'unknown': []}
+    assert repo.get_measurements_many([]) == {}
+
+
+def test_redis_repository_iter_measurements_pages_through_equal_timestamps(timestamp_fixture, fake_redis_db):
+    measurements = [
+        Measurement('sensor_id_{}'.format(i % 2), timestamp_fixture + i // 4, float(i)) for i in range(40)
+        ]  # four measurements per timestamp, two of each sensor
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+
+    streamed = [m for chunk in repo.iter_measurements(['sensor_id_0', 'sensor_id_1'], chunk_size=3) for m in chunk]
+    assert len(streamed) == 40
+    assert sorted(streamed, key=lambda m: m.value) == measurements
+    assert [m.timestamp for m in streamed] == sorted(m.timestamp for m in measurements)
+
+
+def test_redis_repository_iter_measurement_batches_pages_through_equal_timestamps(timestamp_fixture, fake_redis_db):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i // 4, float(i)) for i in range(20)]
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(measurements)
+
+    batches = list(repo.iter_measurement_batches('sensor_id', start=timestamp_fixture + 1, page_size=3))
+    assert all(0 < len(batch) <= 3 for batch in batches)
+    assert sorted((m for batch in batches for m in batch), key=lambda m: m.value) == measurements[4:]
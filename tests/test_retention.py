@@ -0,0 +1,97 @@
+import time
+
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.repository import MEASUREMENTS_KEY, RedisRepository, ShardedRedisRepository
+from monitor.retention import EvictionWorker, RetentionPolicy
+from monitor.sensors import SensorType
+
+NOW = 1_600_000_000.0
+
+
+def test_retention_policy_prefers_sensor_then_type_then_default():
+    policy = RetentionPolicy(default=100.0, sensors={'tank': 10.0, 'archive': None}, types={SensorType.HUMIDITY: 50.0})
+    assert policy.max_age('tank', SensorType.HUMIDITY) == 10.0
+    assert policy.max_age('archive') is None
+    assert policy.max_age('room', SensorType.HUMIDITY) == 50.0
+    assert policy.max_age('room', SensorType.TEMPERATURE) == 100.0
+    assert RetentionPolicy().max_age('room') is None
+
+
+def test_evict_removes_old_measurements_in_batches(fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(Measurement('sensor_id_1', NOW + i, float(i)) for i in range(10))
+    assert repo.evict('sensor_id_1', NOW + 5, batch_size=3) == 3
+    assert repo.evict('sensor_id_1', NOW + 5, batch_size=3) == 2
+    assert repo.evict('sensor_id_1', NOW + 5, batch_size=3) == 0
+    assert [m.timestamp for m in repo.get_measurements('sensor_id_1')] == [NOW + i for i in range(5, 10)]
+
+
+def test_evict_removes_chunks_holding_only_old_measurements(fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(Measurement('sensor_id_1', NOW + i, float(i)) for i in range(10))
+    repo.compact(NOW + 8, chunk_size=4)  # chunks of 0-3, 4-7
+    assert repo.evict('sensor_id_1', NOW + 6) == 4
+    assert [m.timestamp for m in repo.get_measurements('sensor_id_1')] == [NOW + i for i in range(4, 10)]
+
+
+def test_trim_measurement_list_removes_expired_entries_of_a_window(fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(Measurement('sensor_id_{}'.format(i % 2), NOW + i, float(i)) for i in range(6))
+    removed, kept = repo.trim_measurement_list(lambda m: m.sensor_id == 'sensor_id_0', start=0, batch_size=4)
+    assert (removed, kept) == (2, 2)
+    assert [repo.pop_measurement().timestamp for _ in range(4)] == [NOW + 1, NOW + 3, NOW + 4, NOW + 5]
+
+
+def test_eviction_worker_applies_policy(fake_redis_db, temperature_sensor_fixture, humidity_sensor_fixture):
+    repo = RedisRepository(fake_redis_db)
+    sensors = {'sensor_id_1': temperature_sensor_fixture('sensor_id_1'), 'sensor_id_2': humidity_sensor_fixture('sensor_id_2')}
+    repo.add_measurements(
+        Measurement(sensor_id, NOW - 100 + i, float(i)) for i in range(100) for sensor_id in ('sensor_id_1', 'sensor_id_2', 'sensor_id_3')
+        )
+    policy = RetentionPolicy(sensors={'sensor_id_1': 10.0}, types={SensorType.HUMIDITY: 50.0})
+    metrics = MetricsRegistry()
+    worker = EvictionWorker(repo, policy, sensors.get, batch_size=7, pause=0.0, metrics=metrics, clock=lambda: NOW)
+
+    report = worker.run_once()
+    assert report.measurements == {'sensor_id_1': 90, 'sensor_id_2': 50}
+    assert report.list_entries == 140
+    assert len(repo.get_measurements('sensor_id_1')) == 10
+    assert len(repo.get_measurements('sensor_id_2')) == 50
+    assert len(repo.get_measurements('sensor_id_3')) == 100
+    assert fake_redis_db.llen(MEASUREMENTS_KEY) == 160
+    assert metrics.get('monitor_measurements_evicted_total').labels('sensor_id_1').value == 90
+    report = worker.run_once()
+    assert (report.measurements, report.list_entries) == ({}, 0)
+
+
+def test_eviction_worker_stops_at_max_batches(fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(Measurement('sensor_id_1', NOW - 100 + i, float(i)) for i in range(100))
+    worker = EvictionWorker(repo, RetentionPolicy(default=0.0), batch_size=10, max_batches=2, pause=0.0, clock=lambda: NOW)
+    assert worker.run_once().measurements == {'sensor_id_1': 20}
+    assert worker.run_once().measurements == {'sensor_id_1': 20}
+
+
+def test_eviction_worker_covers_every_node(fake_redis_db, redis_node_1, redis_node_2):
+    repo = ShardedRedisRepository([RedisRepository(client) for client in (fake_redis_db, redis_node_1, redis_node_2)])
+    sensor_ids = ['sensor_{}'.format(i) for i in range(12)]
+    repo.add_measurements(Measurement(sensor_id, NOW - 10 + i, float(i)) for sensor_id in sensor_ids for i in range(10))
+    worker = EvictionWorker(repo, RetentionPolicy(default=5.0), pause=0.0, clock=lambda: NOW)
+    report = worker.run_once()
+    repo.close()
+    assert report.measurements == {sensor_id: 5 for sensor_id in sensor_ids}
+    assert report.list_entries == 60
+    assert all(len(repo.get_measurements(sensor_id)) == 5 for sensor_id in sensor_ids)
+
+
+def test_eviction_worker_runs_in_background(fake_redis_db):
+    repo = RedisRepository(fake_redis_db)
+    repo.add_measurements(Measurement('sensor_id_1', NOW - 100 + i, float(i)) for i in range(100))
+    worker = EvictionWorker(repo, RetentionPolicy(default=10.0), interval=0.01, pause=0.0, clock=lambda: NOW)
+    worker.start()
+    deadline = time.monotonic() + 5
+    while len(repo.get_measurements('sensor_id_1')) > 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    assert len(repo.get_measurements('sensor_id_1')) == 10
@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.rules import FIRING, RESOLVED, Alert, CallbackSink, MissingData, RateOfChange, RuleEngine, RuleState, Threshold
+from monitor.sensors import SensorType
+
+
+def engine_with(rules, **kwargs):
+    alerts = []
+    return RuleEngine(rules, [CallbackSink(alerts.append)], **kwargs), alerts
+
+
+def test_threshold_fires_once_and_resolves(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    engine, alerts = engine_with([Threshold('hot', above=30.0)])
+    for timestamp, value in enumerate([20.0, 31.0, 32.0, 33.0, 25.0, 24.0]):
+        engine.evaluate(sensor, Measurement('sensor_id_1', float(timestamp), value))
+    assert [(alert.state, alert.timestamp, alert.value) for alert in alerts] == [(FIRING, 1.0, 31.0), (RESOLVED, 4.0, 25.0)]
+
+
+def test_threshold_needs_a_limit():
+    with pytest.raises(ValueError):
+        Threshold('none')
+
+
+def test_rule_names_must_be_unique():
+    with pytest.raises(ValueError, match='temp'):
+        RuleEngine([Threshold('temp', above=30.0), Threshold('temp', above=40.0)])
+    RuleEngine([Threshold('temp-warn', above=30.0), Threshold('temp-critical', above=40.0)])
+
+
+def test_threshold_with_duration_fires_only_when_sustained(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    engine, alerts = engine_with([Threshold('cold', below=5.0, duration=10.0)])
+    readings = [(0.0, 4.0), (5.0, 3.0), (8.0, 6.0), (9.0, 4.0), (15.0, 4.0), (19.0, 4.0), (20.0, 4.0)]
+    for timestamp, value in readings:
+        engine.evaluate(sensor, Measurement('sensor_id_1', timestamp, value))
+    assert [(alert.state, alert.timestamp) for alert in alerts] == [(FIRING, 19.0)]
+
+
+def test_rate_of_change_between_readings(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    engine, alerts = engine_with([RateOfChange('jump', max_rate=1.0)])
+    for timestamp, value in [(0.0, 10.0), (1.0, 10.5), (2.0, 12.0), (3.0, 12.5)]:
+        engine.evaluate(sensor, Measurement('sensor_id_1', timestamp, value))
+    assert [(alert.state, alert.timestamp) for alert in alerts] == [(FIRING, 2.0), (RESOLVED, 3.0)]
+
+
+def test_rate_of_change_over_window(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    engine, alerts = engine_with([RateOfChange('drift', max_rate=0.5, window=4.0)])
+    # a steady rise of 0.4 per second stays below the limit, a jump of 2.5 is over 0.5 per second across the window
+    for timestamp, value in [(0.0, 10.0), (1.0, 10.4), (2.0, 10.8), (3.0, 11.2), (4.0, 11.6), (5.0, 12.0)]:
+        assert engine.evaluate(sensor, Measurement('sensor_id_1', timestamp, value)) == []
+    engine.evaluate(sensor, Measurement('sensor_id_1', 6.0, 14.5))
+    assert [(alert.state, alert.timestamp) for alert in alerts] == [(FIRING, 6.0)]
+
+
+def test_rate_of_change_keeps_a_bounded_window():
+    rule = RateOfChange('drift', max_rate=0.5, window=100.0, max_readings=16)
+    state = RuleState()
+    for timestamp in range(1000):
+        assert rule.evaluate(state, Measurement('sensor_id_1', float(timestamp), 0.4 * timestamp)) is None
+        assert len(state.window) <= 16
+    alert = rule.evaluate(state, Measurement('sensor_id_1', 1000.0, 460.0))
+    assert alert is not None and alert.state == FIRING
+
+
+def test_missing_data_fires_for_silent_and_watched_sensors(temperature_sensor_fixture):
+    reporting = temperature_sensor_fixture('sensor_id_1')
+    silent = temperature_sensor_fixture('sensor_id_2')
+    engine, alerts = engine_with([MissingData('stale', timeout=10.0)])
+    engine.watch([silent])
+    engine.check(now=100.0)
+    engine.evaluate(reporting, Measurement('sensor_id_1', 105.0, 1.0))
+    assert engine.check(now=110.0) == []
+    assert [(alert.sensor_id, alert.state) for alert in engine.check(now=111.0)] == [('sensor_id_2', FIRING)]
+    assert [(alert.sensor_id, alert.state) for alert in engine.check(now=116.0)] == [('sensor_id_1', FIRING)]
+    engine.evaluate(reporting, Measurement('sensor_id_1', 117.0, 1.0))
+    assert [(alert.sensor_id, alert.state) for alert in alerts[-1:]] == [('sensor_id_1', RESOLVED)]
+
+
+def test_rules_apply_per_sensor_and_per_type(temperature_sensor_fixture, humidity_sensor_fixture):
+    temperature = temperature_sensor_fixture('sensor_id_1')
+    other_temperature = temperature_sensor_fixture('sensor_id_2')
+    humidity = humidity_sensor_fixture('sensor_id_3')
+    engine, alerts = engine_with([
+        Threshold('damp', above=0.0, sensor_type=SensorType.HUMIDITY),
+        Threshold('tank', above=0.0, sensor_id='sensor_id_2'),
+        ])
+    for sensor in (temperature, other_temperature, humidity):
+        engine.evaluate(sensor, Measurement(sensor.sensor_id, 1.0, 1.0))
+    assert sorted((alert.rule, alert.sensor_id) for alert in alerts) == [('damp', 'sensor_id_3'), ('tank', 'sensor_id_2')]
+
+
+def test_forget_drops_sensor_state(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    engine, alerts = engine_with([Threshold('hot', above=0.0)])
+    engine.evaluate(sensor, Measurement('sensor_id_1', 1.0, 1.0))
+    engine.forget(['sensor_id_1'])
+    engine.evaluate(sensor, Measurement('sensor_id_1', 2.0, 1.0))
+    assert [alert.state for alert in alerts] == [FIRING, FIRING]
+
+
+def test_failing_sink_does_not_stop_other_sinks(temperature_sensor_fixture):
+    def fail(alert):
+        raise RuntimeError('sink down')
+
+    alerts = []
+    engine = RuleEngine([Threshold('hot', above=0.0)], [CallbackSink(fail), CallbackSink(alerts.append)])
+    engine.evaluate(temperature_sensor_fixture('sensor_id_1'), Measurement('sensor_id_1', 1.0, 1.0))
+    assert len(alerts) == 1
+
+
+def test_submit_never_blocks_and_counts_dropped_readings(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    metrics = MetricsRegistry()
+    engine, alerts = engine_with([Threshold('hot', above=0.0)], max_queued=2, metrics=metrics)
+    for timestamp in range(5):
+        engine.submit(sensor, Measurement('sensor_id_1', float(timestamp), 1.0))
+    assert metrics.get('monitor_rule_readings_dropped_total').collect()[0].value == 3
+    engine.start()
+    engine.stop()
+    assert metrics.get('monitor_rule_readings_total').collect()[0].value == 2
+    assert alerts == [Alert('hot', 'sensor_id_1', FIRING, 0.0, 1.0, alerts[0].message)]
+
+
+def test_engine_thread_checks_timed_rules(temperature_sensor_fixture):
+    fired = threading.Event()
+    engine = RuleEngine([MissingData('stale', timeout=0.05)], [CallbackSink(lambda alert: fired.set())], check_interval=0.02)
+    engine.watch([temperature_sensor_fixture('sensor_id_1')])
+    engine.start()
+    try:
+        assert fired.wait(2.0)
+    finally:
+        engine.stop()
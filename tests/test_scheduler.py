@@ -0,0 +1,167 @@
+from threading import Lock
+import time
+
+import pytest
+
+from monitor.metrics import MetricsRegistry
+from monitor.scheduler import PollingScheduler, next_deadline
+
+
+class Recorder:
+    def __init__(self, delay=0.0) -> None:
+        self.delay = delay
+        self.polls = []
+        self._lock = Lock()
+
+    def __call__(self, sensor):
+        with self._lock:
+            self.polls.append((sensor.sensor_id, time.monotonic()))
+        time.sleep(self.delay)
+
+    def count(self, sensor_id):
+        return len([poll for poll in self.polls if poll[0] == sensor_id])
+
+
+def test_next_deadline_is_one_interval_later():
+    assert next_deadline(10.0, 1.0, 10.5) == 11.0
+
+
+def test_next_deadline_skips_missed_slots():
+    assert next_deadline(10.0, 1.0, 12.5) == 13.0
+
+
+def test_next_deadline_when_now_is_on_the_grid():
+    assert next_deadline(10.0, 1.0, 11.0) == 12.0
+
+
+def test_scheduler_polls_all_sensors(temperature_sensor_fixture):
+    sensors = [temperature_sensor_fixture('sensor_id_{}'.format(i)) for i in range(20)]
+    recorder = Recorder()
+    scheduler = PollingScheduler(recorder, max_workers=2)
+    for sensor in sensors:
+        scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.2)
+    scheduler.stop()
+
+    for sensor in sensors:
+        assert recorder.count(sensor.sensor_id) == 1
+
+
+def test_scheduler_keeps_polling_interval(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.2
+    recorder = Recorder()
+    scheduler = PollingScheduler(recorder, max_workers=1)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.stop()
+
+    assert recorder.count(sensor.sensor_id) == 3
+    intervals = [b[1] - a[1] for a, b in zip(recorder.polls, recorder.polls[1:])]
+    assert intervals == pytest.approx([0.2, 0.2], abs=0.05)
+
+
+def test_scheduler_skips_polls_when_measurement_overruns(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.2
+    recorder = Recorder(delay=0.3)
+    scheduler = PollingScheduler(recorder, max_workers=1)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.stop()
+
+    assert recorder.count(sensor.sensor_id) == 2
+    assert recorder.polls[1][1] - recorder.polls[0][1] == pytest.approx(0.4, abs=0.05)
+
+
+def test_scheduler_stops_polling_removed_sensor(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    recorder = Recorder()
+    scheduler = PollingScheduler(recorder, max_workers=1)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.05)
+    scheduler.remove_sensor(sensor)
+    time.sleep(0.3)
+    scheduler.stop()
+
+    assert recorder.count(sensor.sensor_id) == 1
+
+
+def test_scheduler_releases_removed_sensor_after_poll_in_progress(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    recorder = Recorder(delay=0.2)
+    released = []
+    scheduler = PollingScheduler(recorder, max_workers=1)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.05)
+    scheduler.remove_sensor(sensor, released.append)
+    assert released == []  # still being polled
+    time.sleep(0.3)
+    assert released == [sensor]
+    scheduler.stop()
+
+    idle = temperature_sensor_fixture('idle')
+    scheduler.remove_sensor(idle, released.append)
+    assert released == [sensor, idle]
+
+
+def test_scheduler_reschedules_sensor_added_again_after_poll_in_progress(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    recorder = Recorder(delay=0.2)
+    released = []
+    scheduler = PollingScheduler(recorder, max_workers=2)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.05)
+    scheduler.remove_sensor(sensor, released.append)
+    scheduler.add_sensor(sensor)
+    time.sleep(0.1)
+    assert recorder.count(sensor.sensor_id) == 1  # not polled again while the first poll is in progress
+    time.sleep(0.15)
+    scheduler.stop()
+
+    assert recorder.count(sensor.sensor_id) == 2
+    assert recorder.polls[1][1] - recorder.polls[0][1] >= 0.2
+    assert released == []
+
+
+def test_scheduler_keeps_polling_after_sensor_error(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    polls = []
+
+    def failing_poll(sensor):
+        polls.append(sensor)
+        raise RuntimeError('sensor failure')
+
+    scheduler = PollingScheduler(failing_poll, max_workers=1)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.25)
+    scheduler.stop()
+
+    assert len(polls) == 3
+
+
+def test_scheduler_records_missed_deadlines(temperature_sensor_fixture):
+    sensor = temperature_sensor_fixture('sensor_id')
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.2
+    metrics = MetricsRegistry()
+    scheduler = PollingScheduler(Recorder(delay=0.3), max_workers=1, metrics=metrics)
+    scheduler.add_sensor(sensor)
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.stop()
+
+    assert metrics.counter('monitor_missed_deadlines_total', '', ['sensor_id']).labels('sensor_id').value == 2
@@ -1,8 +1,13 @@
+import asyncio
+import json
 from pathlib import Path
+import pickle
 
 import pytest
 
-from monitor.sensors import DS18B20Sensor, SensorType, SensorInitError, SensorMeasurementError, SensorConfigError
+from monitor.sensors import (
+    discover_ds18b20_sensors, DS18B20Bus, DS18B20Sensor, load_sensors, SensorType, SensorInitError, SensorMeasurementError, SensorConfigError
+    )
 
 
 @pytest.fixture
@@ -127,3 +132,132 @@ def test_ds18b20_get_measurement_rounds_to_one_decimal(tmpdir, timestamp_fixture
     assert m.sensor_id == 'sensor_id'
     assert m.timestamp == timestamp_fixture
     assert m.value == 27.8
+
+
+def test_ds18b20_async_get_measurement(tmpdir, timestamp_fixture, good_measurement):
+    device_file = Path(tmpdir) / 'sensor.txt'
+    device_file.write_text(good_measurement)
+    s = DS18B20Sensor('sensor_id', device_file)
+    m = asyncio.run(s.async_get_measurement())
+    assert m.sensor_id == 'sensor_id'
+    assert m.timestamp == timestamp_fixture
+    assert m.value == 27.8
+
+
+@pytest.mark.parametrize('keep_open', [False, True])
+def test_ds18b20_get_measurement_reads_updated_file(tmpdir, good_measurement, keep_open):
+    device_file = Path(tmpdir) / 'sensor.txt'
+    device_file.write_text(good_measurement)
+    s = DS18B20Sensor('sensor_id', device_file, keep_open=keep_open)
+    assert s.get_measurement().value == 27.8
+
+    device_file.write_text(good_measurement.replace('t=27772', 't=-1250'))
+    assert s.get_measurement().value == -1.2
+    s.close()
+
+
+def test_ds18b20_keep_open_bad_crc(tmpdir, bad_crc):
+    device_file = Path(tmpdir) / 'sensor.txt'
+    device_file.write_text(bad_crc)
+    s = DS18B20Sensor('sensor_id', device_file, keep_open=True)
+    with pytest.raises(SensorMeasurementError):
+        s.get_measurement()
+    s.close()
+
+
+def test_ds18b20_pickle_drops_open_file(tmpdir, good_measurement):
+    device_file = Path(tmpdir) / 'sensor.txt'
+    device_file.write_text(good_measurement)
+    s = DS18B20Sensor('sensor_id', device_file, keep_open=True)
+    s.get_measurement()
+    copy = pickle.loads(pickle.dumps(s))
+    assert copy._fd is None
+    assert copy.get_measurement().value == 27.8
+    s.close()
+    copy.close()
+
+
+def test_ds18b20_get_measurement_empty_file(tmpdir):
+    device_file = Path(tmpdir) / 'sensor.txt'
+    device_file.touch()
+    s = DS18B20Sensor('sensor_id', device_file)
+    with pytest.raises(SensorMeasurementError):
+        s.get_measurement()
+
+
+def test_ds18b20_bus_triggers_and_reads_all_sensors(tmpdir, good_measurement, bad_crc):
+    sensors = []
+    for i in range(5):
+        device_file = Path(tmpdir) / 'sensor_{}.txt'.format(i)
+        device_file.write_text(good_measurement if i != 2 else bad_crc)
+        sensors.append(DS18B20Sensor('sensor_id_{}'.format(i), device_file, keep_open=True))
+    bulk_read_file = Path(tmpdir) / 'therm_bulk_read'
+    bulk_read_file.touch()
+
+    bus = DS18B20Bus(sensors, bulk_read_file)
+    measurements = bus.get_measurements()
+    assert [m.sensor_id for m in measurements] == ['sensor_id_0', 'sensor_id_1', 'sensor_id_3', 'sensor_id_4']
+    assert all(m.value == 27.8 for m in measurements)
+    assert bulk_read_file.read_text() == 'trigger\n'
+    for sensor in sensors:
+        sensor.close()
+
+
+@pytest.fixture
+def w1_devices(tmpdir, good_measurement):
+    devices_dir = Path(tmpdir) / 'devices'
+    for name in ('28-0000000000b2', '28-0000000000a1', '10-0000000000c3', 'w1_bus_master1'):
+        (devices_dir / name).mkdir(parents=True)
+        (devices_dir / name / 'w1_slave').write_text(good_measurement)
+    yield devices_dir
+
+
+def test_discover_ds18b20_sensors(w1_devices):
+    sensors = discover_ds18b20_sensors(w1_devices, polling_interval=5.0, measurement_delay=2.0)
+    assert [s.sensor_id for s in sensors] == ['28-0000000000a1', '28-0000000000b2']
+    assert all(s.polling_interval == 5.0 and s.measurement_delay == 2.0 for s in sensors)
+    assert sensors[0].get_measurement().value == 27.8
+
+
+def test_discover_ds18b20_sensors_does_not_stat_entries(w1_devices):
+    (w1_devices / '28-not-a-directory').write_text('')
+    sensors = discover_ds18b20_sensors(w1_devices)
+    assert [s.sensor_id for s in sensors] == ['28-0000000000a1', '28-0000000000b2', '28-not-a-directory']
+    with pytest.raises(OSError):
+        sensors[2].get_measurement()
+
+
+def test_discover_ds18b20_sensors_missing_directory(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        discover_ds18b20_sensors(Path(tmpdir) / 'missing')
+
+
+def test_load_sensors(tmpdir, w1_devices):
+    config_file = Path(tmpdir) / 'sensors.json'
+    config_file.write_text(json.dumps({
+        'polling_interval': 4.0,
+        'w1_devices_dir': str(w1_devices),
+        'sensors': [
+            {'sensor_id': '28-0000000000a1', 'device_file': str(w1_devices / '28-0000000000a1' / 'w1_slave'), 'polling_interval': 8.0},
+            {'sensor_id': 'tank', 'device_file': str(w1_devices / '10-0000000000c3' / 'w1_slave'), 'keep_open': True},
+            ],
+        }))
+    sensors = {s.sensor_id: s for s in load_sensors(config_file)}
+
+    assert sorted(sensors) == ['28-0000000000a1', '28-0000000000b2', 'tank']
+    assert sensors['28-0000000000a1'].polling_interval == 8.0
+    assert sensors['28-0000000000b2'].polling_interval == 4.0
+    assert sensors['tank'].keep_open
+
+
+@pytest.mark.parametrize('config', [
+    'not json',
+    '[]',
+    '{"sensors": [{"sensor_id": "no device file"}]}',
+    '{"sensors": [{"type": "dht22", "sensor_id": "s", "device_file": "f"}]}',
+    ])
+def test_load_sensors_bad_config(tmpdir, config):
+    config_file = Path(tmpdir) / 'sensors.json'
+    config_file.write_text(config)
+    with pytest.raises(SensorConfigError):
+        load_sensors(config_file)
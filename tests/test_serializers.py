@@ -0,0 +1,71 @@
+import pytest
+
+from monitor.measurements import Measurement, MeasurementBatch
+from monitor.serializers import BinarySerializer, JSONSerializer, SensorIdDictionary, SerializationError
+
+
+def test_json_serializer_round_trip(timestamp_fixture):
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.5)
+    serializer = JSONSerializer()
+    assert serializer.loads(serializer.dumps(measurement)) == measurement
+
+
+def test_json_serializer_bad_data():
+    with pytest.raises(SerializationError):
+        JSONSerializer().loads(b'not json')
+
+
+def test_binary_serializer_round_trip(timestamp_fixture):
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.5)
+    serializer = BinarySerializer(SensorIdDictionary())
+    encoded = serializer.dumps(measurement)
+    assert len(encoded) == BinarySerializer.RECORD.size
+    assert encoded[0] == BinarySerializer.VERSION
+    assert serializer.loads(encoded) == measurement
+
+
+def test_binary_serializer_is_smaller_than_json(timestamp_fixture):
+    measurement = Measurement('sensor_id', timestamp_fixture, 1.5)
+    assert len(BinarySerializer(SensorIdDictionary()).dumps(measurement)) * 3 < len(JSONSerializer().dumps(measurement))
+
+
+def test_binary_serializer_loads_many(timestamp_fixture):
+    measurements = [Measurement('sensor_id_{}'.format(i % 3), timestamp_fixture + i, float(i)) for i in range(10)]
+    serializer = BinarySerializer(SensorIdDictionary())
+    assert serializer.loads_many([serializer.dumps(m) for m in measurements]) == measurements
+
+
+def test_binary_serializer_reads_json(timestamp_fixture):
+    measurements = [Measurement('sensor_id', timestamp_fixture + i, float(i)) for i in range(2)]
+    serializer = BinarySerializer(SensorIdDictionary())
+    encoded = [JSONSerializer().dumps(measurements[0]).encode(), serializer.dumps(measurements[1])]
+    assert serializer.loads_many(encoded) == measurements
+
+
+def test_binary_serializer_rejects_unknown_version(timestamp_fixture):
+    serializer = BinarySerializer(SensorIdDictionary())
+    encoded = serializer.dumps(Measurement('sensor_id', timestamp_fixture, 1.0))
+    with pytest.raises(SerializationError):
+        serializer.loads(bytes([BinarySerializer.VERSION + 1]) + encoded[1:])
+
+
+def test_binary_serializer_rejects_unknown_sensor_code(timestamp_fixture):
+    encoded = BinarySerializer(SensorIdDictionary()).dumps(Measurement('sensor_id', timestamp_fixture, 1.0))
+    with pytest.raises(SerializationError):
+        BinarySerializer(SensorIdDictionary()).loads(encoded)
+
+
+def test_sensor_id_dictionary():
+    sensor_ids = SensorIdDictionary()
+    assert sensor_ids.code('sensor_id_1') == 0
+    assert sensor_ids.code('sensor_id_2') == 1
+    assert sensor_ids.code('sensor_id_1') == 0
+    assert sensor_ids.sensor_id(1) == 'sensor_id_2'
+
+
+@pytest.mark.parametrize('serializer', [JSONSerializer(), BinarySerializer(SensorIdDictionary())])
+def test_serializer_loads_batch(serializer, timestamp_fixture):
+    measurements = [Measurement('sensor_id_{}'.format(i % 3), timestamp_fixture + i, float(i)) for i in range(10)]
+    batch = serializer.loads_batch([serializer.dumps(m) for m in measurements])
+    assert isinstance(batch, MeasurementBatch)
+    assert batch == measurements
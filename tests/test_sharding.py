@@ -0,0 +1,95 @@
+from collections import Counter
+from functools import partial
+import os
+import signal
+import time
+
+from redis import Redis
+
+from monitor.repository import MEASUREMENTS_KEY, RedisRepository
+from monitor.sharding import HashRing, ShardedController
+from tests.conftest import FakeTemperatureSensor
+
+
+def redis_repository(host, port, db):
+    return RedisRepository(Redis(host=host, port=port, db=db))
+
+
+def repo_factory(fake_redis_db):
+    kwargs = fake_redis_db.connection_pool.connection_kwargs
+    return partial(redis_repository, kwargs['host'], kwargs['port'], kwargs['db'])
+
+
+def fast_sensor(sensor_id):
+    sensor = FakeTemperatureSensor(sensor_id)
+    sensor.measurement_delay = 0.0
+    sensor.polling_interval = 0.1
+    return sensor
+
+
+def test_hash_ring_spreads_keys_over_nodes():
+    ring = HashRing(['a', 'b', 'c'])
+    owners = Counter(ring.node_for('sensor_{}'.format(i)) for i in range(3000))
+    assert set(owners) == {'a', 'b', 'c'}
+    assert min(owners.values()) > 500
+
+
+def test_hash_ring_only_moves_keys_of_removed_node():
+    ring = HashRing(['a', 'b', 'c'])
+    before = {key: ring.node_for(key) for key in ('sensor_{}'.format(i) for i in range(1000))}
+    ring.remove_node('b')
+    after = {key: ring.node_for(key) for key in before}
+
+    assert ring.nodes == ['a', 'c']
+    assert all(after[key] == node for key, node in before.items() if node != 'b')
+    assert all(node != 'b' for node in after.values())
+
+
+def test_sharded_controller_polls_sensors_from_workers(fake_redis_db):
+    controller = ShardedController(repo_factory(fake_redis_db), shards=2, flush_interval=0.1)
+    for i in range(6):
+        controller.add_sensor(fast_sensor('sensor_{}'.format(i)))
+    assert {controller.shard_of(sensor.sensor_id) for sensor in controller.sensors} == {'shard-0', 'shard-1'}
+
+    controller.start_polling()
+    try:
+        pids = controller.worker_pids()
+        assert len(set(pids.values())) == 2 and os.getpid() not in pids.values()
+        controller.add_sensor(fast_sensor('sensor_added'))
+        controller.remove_sensor(controller.sensors[0])
+        time.sleep(3)
+    finally:
+        controller.stop_polling()
+
+    repo = RedisRepository(fake_redis_db)
+    assert repo.get_measurements('sensor_added')
+    assert all(repo.get_measurements('sensor_{}'.format(i)) for i in range(1, 6))
+    polled = len(repo.get_measurements('sensor_0'))
+    time.sleep(0.3)
+    assert len(repo.get_measurements('sensor_0')) == polled
+
+
+def test_sharded_controller_restarts_dead_workers(fake_redis_db):
+    controller = ShardedController(repo_factory(fake_redis_db), shards=2, flush_interval=0.1, check_interval=60)
+    for i in range(4):
+        controller.add_sensor(fast_sensor('sensor_{}'.format(i)))
+    sensor_ids = {sensor.sensor_id for sensor in controller.sensors if controller.shard_of(sensor.sensor_id) == 'shard-0'}
+    assert sensor_ids
+
+    def polls():
+        return sum(1 for measurement in RedisRepository(fake_redis_db).serializer.loads_many(fake_redis_db.lrange(MEASUREMENTS_KEY, 0, -1))
+                   if measurement.sensor_id in sensor_ids)
+
+    controller.start_polling()
+    try:
+        pid = controller.worker_pids()['shard-0']
+        os.kill(pid, signal.SIGKILL)
+        time.sleep(0.5)
+        assert controller.check_workers() == ['shard-0']
+        assert controller.worker_pids()['shard-0'] != pid
+        before = polls()
+        time.sleep(3)
+    finally:
+        controller.stop_polling()
+
+    assert polls() > before
@@ -0,0 +1,167 @@
+import time
+
+import pytest
+
+from monitor.controller import Controller
+from monitor.measurements import Measurement
+from monitor.metrics import MetricsRegistry
+from monitor.repository import AbstractRepository
+from monitor.spool import SegmentLog, SpoolingRepository
+
+START = 1_600_000_000.0
+
+
+class FlakyRepo(AbstractRepository):
+    def __init__(self) -> None:
+        self.measurements = []
+        self.writes = []
+        self.down = False
+        self.delay = 0.0
+
+    def add_measurement(self, measurement):
+        self.add_measurements([measurement])
+
+    def add_measurements(self, measurements):
+        if self.down:
+            raise ConnectionError('repository is down')
+        time.sleep(self.delay)
+        measurements = list(measurements)
+        self.writes.append(len(measurements))
+        self.measurements.extend(measurements)
+
+
+def measurements(start, count, sensor_id='sensor_id_1'):
+    return [Measurement(sensor_id, START + i, float(i)) for i in range(start, start + count)]
+
+
+def test_segment_log_rotates_and_reads_back(tmp_path):
+    log = SegmentLog(tmp_path, segment_bytes=500)
+    for measurement in measurements(0, 20):
+        log.append([measurement])
+    log.seal()
+    segments = log.sealed()
+    assert len(segments) > 1
+    assert [m for path in segments for m in log.read(path)] == measurements(0, 20)
+    assert not log.empty
+    for path in segments:
+        log.remove(path)
+    assert log.empty
+
+
+def test_segment_log_stops_at_torn_record(tmp_path):
+    log = SegmentLog(tmp_path)
+    log.append(measurements(0, 3))
+    log.close()
+    path = log.sealed()[0]
+    with open(path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00\x00')
+    assert SegmentLog(tmp_path).read(path) == measurements(0, 3)
+
+
+def test_segment_log_continues_numbering_after_restart(tmp_path):
+    log = SegmentLog(tmp_path)
+    log.append(measurements(0, 3))
+    log.close()
+    log = SegmentLog(tmp_path)
+    log.append(measurements(3, 3))
+    assert len(log.sealed()) == 1
+    log.seal()
+    assert [m for path in log.sealed() for m in log.read(path)] == measurements(0, 6)
+
+
+def test_writes_go_straight_to_a_healthy_repository(tmp_path):
+    repo = FlakyRepo()
+    spooling = SpoolingRepository(repo, tmp_path)
+    spooling.add_measurements(measurements(0, 5))
+    assert repo.measurements == measurements(0, 5)
+    assert not spooling.spooling
+    assert spooling.log.empty
+
+
+def test_outage_spools_and_replays_in_order_without_duplicates(tmp_path):
+    repo = FlakyRepo()
+    metrics = MetricsRegistry()
+    spooling = SpoolingRepository(repo, tmp_path, batch_size=4, metrics=metrics)
+    spooling.add_measurements(measurements(0, 3))
+    repo.down = True
+    spooling.add_measurements(measurements(5, 3))
+    assert spooling.spooling
+    repo.down = False
+    spooling.add_measurements(measurements(3, 2) + measurements(5, 1))  # late and duplicate measurements
+    assert repo.measurements == measurements(0, 3)
+
+    assert spooling.replay() == 5
+    assert repo.measurements == measurements(0, 8)
+    assert repo.writes[1:] == [4, 1]
+    assert not spooling.spooling and spooling.log.empty
+    assert metrics.get('monitor_measurements_spooled_total').collect()[0].value == 6
+    spooling.add_measurements(measurements(8, 1))
+    assert repo.measurements[-1] == measurements(8, 1)[0]
+
+
+def test_failed_replay_resumes_from_checkpoint(tmp_path):
+    class FailsOnce(FlakyRepo):
+        def add_measurements(self, measurements):
+            super().add_measurements(measurements)
+            if len(self.writes) == 2:
+                raise ConnectionError('connection lost after the write')
+
+    repo = FailsOnce()
+    repo.down = True
+    spooling = SpoolingRepository(repo, tmp_path, batch_size=2)
+    spooling.add_measurements(measurements(0, 6))
+    repo.down = False
+    with pytest.raises(ConnectionError):
+        spooling.replay()
+    assert spooling.spooling
+
+    restarted = SpoolingRepository(repo, tmp_path, batch_size=2)
+    assert restarted.spooling
+    assert restarted.replay() == 4
+    assert repo.measurements == measurements(0, 2) + measurements(2, 2) + measurements(2, 4)  # only the failed batch twice
+
+
+def test_slow_writes_divert_to_the_spool(tmp_path):
+    repo = FlakyRepo()
+    repo.delay = 0.05
+    spooling = SpoolingRepository(repo, tmp_path, slow_write=0.01)
+    spooling.add_measurements(measurements(0, 1))
+    assert spooling.spooling
+    spooling.add_measurements(measurements(1, 1))
+    assert len(repo.measurements) == 1
+    repo.delay = 0.0
+    spooling.replay()
+    assert repo.measurements == measurements(0, 2)
+
+
+def test_background_replayer_drains_after_recovery(tmp_path):
+    repo = FlakyRepo()
+    repo.down = True
+    spooling = SpoolingRepository(repo, tmp_path, backoff=0.01, max_backoff=0.05)
+    spooling.start()
+    try:
+        spooling.add_measurements(measurements(0, 10))
+        time.sleep(0.1)
+        repo.down = False
+        deadline = time.monotonic() + 5
+        while spooling.spooling and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        spooling.stop()
+    assert repo.measurements == measurements(0, 10)
+
+
+def test_controller_spools_while_repository_is_down(tmp_path, temperature_sensor_fixture):
+    repo = FlakyRepo()
+    repo.down = True
+    sensor = temperature_sensor_fixture('sensor_id_1')
+    c = Controller(repo, batch_size=1, spool_path=tmp_path / 'spool')
+    c.take_measurement(sensor)
+    c._queue.flush()
+    assert repo.measurements == []
+    c.stop_polling()
+
+    repo.down = False
+    c = Controller(repo, batch_size=1, spool_path=tmp_path / 'spool')
+    c._spool.replay()
+    assert [m.sensor_id for m in repo.measurements] == ['sensor_id_1']
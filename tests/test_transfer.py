@@ -0,0 +1,101 @@
+import zipfile
+
+import numpy as np
+import pytest
+
+from monitor.filestore import FileRepository
+from monitor.measurements import Measurement
+from monitor.repository import MEASUREMENTS_KEY, RedisRepository, ShardedRedisRepository
+from monitor.transfer import export_measurements, import_measurements, main, read_archive
+
+START = 1_600_000_000.0
+
+
+def fill(repo, sensor_ids, count):
+    repo.add_measurements(Measurement(sensor_id, START + i, float(i)) for sensor_id in sensor_ids for i in range(count))
+
+
+def test_export_writes_bounded_chunks(fake_redis_db, tmp_path):
+    repo = RedisRepository(fake_redis_db)
+    fill(repo, ['sensor_id_1', 'sensor_id_2'], 25)
+    path = tmp_path / 'history.npz'
+    assert export_measurements(repo, path, chunk_size=10) == 50
+    batches = list(read_archive(path))
+    assert [(batch.sensor_id(0), len(batch)) for batch in batches] == [
+        ('sensor_id_1', 10), ('sensor_id_1', 10), ('sensor_id_1', 5), ('sensor_id_2', 10), ('sensor_id_2', 10), ('sensor_id_2', 5),
+        ]
+    assert list(batches[1]) == [Measurement('sensor_id_1', START + i, float(i)) for i in range(10, 20)]
+    assert not (tmp_path / 'history.npz.partial').exists()
+
+
+def test_export_pages_over_equal_timestamps(tmp_path):
+    repo = FileRepository(tmp_path / 'store', buffer_size=1)
+    repo.add_measurements(Measurement('sensor_id_1', START + i // 4, float(i)) for i in range(20))
+    path = tmp_path / 'history.npz'
+    assert export_measurements(repo, path, start=START + 1, end=START + 3, chunk_size=3) == 12
+    assert sorted(m.value for batch in read_archive(path) for m in batch) == [float(i) for i in range(4, 16)]
+
+
+def test_import_round_trip_into_redis_without_the_measurement_list(fake_redis_db, tmp_path):
+    source = FileRepository(tmp_path / 'store')
+    fill(source, ['sensor_id_1', 'sensor_id_2', 'sensor_id_3'], 30)
+    source.flush()
+    path = tmp_path / 'history.npz'
+    export_measurements(source, path, chunk_size=7)
+
+    repo = RedisRepository(fake_redis_db)
+    assert import_measurements(repo, path, sensor_ids=['sensor_id_1', 'sensor_id_3'], batch_size=4) == 60
+    assert import_measurements(repo, path, sensor_ids=['sensor_id_1'], batch_size=4) == 30
+    assert repo.get_measurements('sensor_id_1') == source.get_measurements('sensor_id_1')
+    assert repo.get_measurements('sensor_id_2') == []
+    assert repo.sensor_ids() == ['sensor_id_1', 'sensor_id_3']
+    assert fake_redis_db.llen(MEASUREMENTS_KEY) == 0
+
+
+def test_import_into_sharded_repository(fake_redis_db, redis_node_1, redis_node_2, tmp_path):
+    source = RedisRepository(fake_redis_db)
+    sensor_ids = ['sensor_{}'.format(i) for i in range(6)]
+    fill(source, sensor_ids, 5)
+    path = tmp_path / 'history.npz'
+    export_measurements(source, path)
+    fake_redis_db.flushdb()
+
+    repo = ShardedRedisRepository([RedisRepository(client) for client in (fake_redis_db, redis_node_1, redis_node_2)])
+    assert import_measurements(repo, path) == 30
+    repo.close()
+    assert repo.sensor_ids() == sensor_ids
+    assert all(len(repo.get_measurements(sensor_id)) == 5 for sensor_id in sensor_ids)
+
+
+def test_read_archive_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.npz'
+    np.savez(path, data=np.arange(3))
+    with pytest.raises(ValueError):
+        list(read_archive(path))
+
+
+def test_failed_export_leaves_no_file(fake_redis_db, tmp_path):
+    class FailingRepo(RedisRepository):
+        def get_measurement_batch(self, *args, **kwargs):
+            raise OSError('connection lost')
+
+    fill(RedisRepository(fake_redis_db), ['sensor_id_1'], 5)
+    with pytest.raises(OSError):
+        export_measurements(FailingRepo(fake_redis_db), tmp_path / 'history.npz')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_command_line_export_and_import(fake_redis_db, tmp_path, capsys):
+    fill(RedisRepository(fake_redis_db), ['sensor_id_1', 'sensor_id_2'], 10)
+    url = 'redis://{}:{}/{}'.format(
+        fake_redis_db.connection_pool.connection_kwargs['host'], fake_redis_db.connection_pool.connection_kwargs['port'],
+        fake_redis_db.connection_pool.connection_kwargs.get('db', 0),
+        )
+    path = tmp_path / 'history.npz'
+    assert main(['export', '--url', url, '--sensor', 'sensor_id_2', '--chunk-size', '3', str(path)]) == 0
+    assert zipfile.is_zipfile(path)
+    fake_redis_db.flushdb()
+    assert main(['import', '--url', url, str(path)]) == 0
+    assert len(RedisRepository(fake_redis_db).get_measurements('sensor_id_2')) == 10
+    assert 'Imported 10 measurements' in capsys.readouterr().out
+    assert main(['import', '--url', url, str(tmp_path / 'missing.npz')]) == 1